@@ -18,13 +18,16 @@
 
 import os
 import logging
+import mmap
 import pickle
+import struct
+import threading
 from collections import defaultdict
 import bb.utils
 
 logger = logging.getLogger("BitBake.Cache")
 
-__cache_version__ = "152"
+__cache_version__ = "153"
 
 def getCacheFile(path, filename, data_hash):
     return os.path.join(path, filename + "." + data_hash)
@@ -307,6 +310,257 @@ def parse_recipe(bb_data, bbfile, appends, mc=''):
 
 
 
+class IndexedCacheFile(object):
+    """
+    A cache file made of one pickle per entry, followed by an index of
+    where each entry is stored in the file. Opening the file only loads the
+    index. Each entry is unpickled from the memory mapped file the first
+    time it is looked up.
+
+    Changed entries can be appended to the file along with a new index,
+    leaving the data they replace in place as unused space.
+    """
+    magic = b"BBCACHE\0"
+    trailer = struct.Struct("<Q8s")
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}
+        self.mm = None
+        self.stat = None
+
+    def open(self):
+        """
+        Map the file and load its index. Returns False (after logging why)
+        if the file can't be used.
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                st = os.fstat(f.fileno())
+                size = st.st_size
+                if size < self.trailer.size:
+                    logger.info('Invalid cache, rebuilding...')
+                    return False
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            logger.info('Invalid cache, rebuilding...')
+            return False
+
+        try:
+            offset, magic = self.trailer.unpack(mm[-self.trailer.size:])
+            if magic != self.magic:
+                raise ValueError("bad magic")
+            cache_ver, bitbake_ver, index = pickle.loads(mm[offset:-self.trailer.size])
+        except Exception:
+            mm.close()
+            logger.info('Invalid cache, rebuilding...')
+            return False
+
+        if cache_ver != __cache_version__:
+            mm.close()
+            logger.info('Cache version mismatch, rebuilding...')
+            return False
+        elif bitbake_ver != bb.__version__:
+            mm.close()
+            logger.info('Bitbake version mismatch, rebuilding...')
+            return False
+
+        self.mm = mm
+        self.index = index
+        self.stat = (st.st_dev, st.st_ino, size)
+        return True
+
+    @property
+    def size(self):
+        return self.stat[2]
+
+    def current(self):
+        """
+        Is the file on disk still the one which was opened, with nothing
+        written to it since?
+        """
+        if self.mm is None:
+            return False
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        return (st.st_dev, st.st_ino, st.st_size) == self.stat
+
+    @staticmethod
+    def live_size(index):
+        return sum(length for _, length in index.values())
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.index = {}
+
+    def raw(self, key):
+        offset, length = self.index[key]
+        return self.mm[offset:offset + length]
+
+    def get(self, key):
+        return pickle.loads(self.raw(key))
+
+    @classmethod
+    def write(cls, filename, entries):
+        """
+        Write a cache file from an iterable of (key, pickled data) pairs.
+        The file is written under a temporary name and then renamed, so
+        anything still mapping the old file keeps seeing its old contents.
+        """
+        tmpfile = filename + ".tmp"
+        with open(tmpfile, "wb") as f:
+            cls._write_entries(f, 0, entries, {})
+        os.rename(tmpfile, filename)
+
+    def append(self, index, entries):
+        """
+        Append (key, pickled data) pairs to the end of the file, followed by
+        a new index made of index and the new entries. The data already in
+        the file isn't touched, so this only costs as much I/O as the new
+        entries and the index. The file has to be opened again to read the
+        new entries.
+        """
+        with open(self.filename, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            self._write_entries(f, offset, entries, dict(index))
+
+    @classmethod
+    def _write_entries(cls, f, offset, entries, index):
+        for key, data in entries:
+            f.write(data)
+            index[key] = (offset, len(data))
+            offset += len(data)
+        pickle.dump((__cache_version__, bb.__version__, index), f, pickle.HIGHEST_PROTOCOL)
+        f.write(cls.trailer.pack(offset, cls.magic))
+
+class DependsCache(object):
+    """
+    Maps a (virtual) filename to the list of RecipeInfo objects stored for
+    it, one for each cache class. Entries stored in the cache files are
+    only unpickled when they are first used.
+    """
+    def __init__(self):
+        # (cache class name, IndexedCacheFile) in caches_array order
+        self.files = []
+        self.entries = {}
+        self.modified = set()
+        self.removed = set()
+
+    def add_file(self, class_name, cachefile):
+        self.files.append((class_name, cachefile))
+
+    def close(self):
+        for _, cachefile in self.files:
+            cachefile.close()
+        self.files = []
+
+    def keys(self):
+        keys = set(self.entries)
+        for _, cachefile in self.files:
+            keys.update(cachefile.index)
+        return keys - self.removed
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        if key in self.entries:
+            return True
+        if key in self.removed:
+            return False
+        return any(key in cachefile.index for _, cachefile in self.files)
+
+    def __getitem__(self, key):
+        try:
+            return self.entries[key]
+        except KeyError:
+            pass
+        if key in self.removed:
+            raise KeyError(key)
+        info_array = [cachefile.get(key) for _, cachefile in self.files if key in cachefile.index]
+        if not info_array:
+            raise KeyError(key)
+        self.entries[key] = info_array
+        return info_array
+
+    def __setitem__(self, key, info_array):
+        # Entries loaded from the cache get added back unchanged while
+        # parsing, only count new objects as modified
+        if self.entries.get(key) is info_array:
+            return
+        self.entries[key] = info_array
+        self.modified.add(key)
+        self.removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.entries.pop(key, None)
+        self.modified.discard(key)
+        self.removed.add(key)
+
+    def get_file(self, class_name):
+        for name, cachefile in self.files:
+            if name == class_name:
+                return cachefile
+        return None
+
+    def pickle_info(self, key, class_name):
+        for info in self[key]:
+            if isinstance(info, RecipeInfoCommon) and info.__class__.__name__ == class_name:
+                yield key, pickle.dumps(info, pickle.HIGHEST_PROTOCOL)
+
+    def pickled_entries(self, class_name):
+        """
+        Yield (key, pickled data) for the entries of the given cache class.
+        Entries which haven't changed since they were loaded are copied
+        straight from the existing cache file without being unpickled.
+        """
+        oldfile = self.get_file(class_name)
+        for key in sorted(self.keys()):
+            if key not in self.modified and oldfile and key in oldfile.index:
+                yield key, oldfile.raw(key)
+                continue
+            yield from self.pickle_info(key, class_name)
+
+    def save(self, class_name, filename):
+        """
+        Save the entries of the given cache class to filename. If the file
+        is still the one the entries were loaded from, only the changed
+        entries and a new index are appended to it. Once more than half of
+        the file would be replaced data it is compacted by writing it out
+        again.
+        """
+        oldfile = self.get_file(class_name)
+        if oldfile is None or not oldfile.current():
+            IndexedCacheFile.write(filename, self.pickled_entries(class_name))
+            return
+
+        index = dict((key, entry) for key, entry in oldfile.index.items()
+                     if key not in self.removed and key not in self.modified)
+        new = []
+        for key in sorted(self.modified):
+            new.extend(self.pickle_info(key, class_name))
+
+        if not new and len(index) == len(oldfile.index):
+            logger.debug(2, "Cache file %s unchanged, not saving.", filename)
+            return
+
+        newsize = sum(len(data) for _, data in new)
+        live = oldfile.live_size(index) + newsize
+        if oldfile.size + newsize - live > live:
+            logger.debug(1, "Compacting cache file %s", filename)
+            entries = [(key, oldfile.raw(key)) for key in sorted(index)]
+            IndexedCacheFile.write(filename, entries + new)
+        else:
+            logger.debug(1, "Appending %d entries to cache file %s", len(new), filename)
+            oldfile.append(index, new)
+
+
 class NoCache(object):
 
     def __init__(self, databuilder):
@@ -365,7 +619,9 @@ class Cache(NoCache):
         self.cachedir = data.getVar("CACHE")
         self.clean = set()
         self.checked = set()
-        self.depends_cache = {}
+        self._depends_cache = DependsCache()
+        self.loader = None
+        self.cachesize = 0
         self.data_fn = None
         self.cacheclean = True
         self.data_hash = data_hash
@@ -389,7 +645,8 @@ class Cache(NoCache):
                 cache_ok = cache_ok and os.path.exists(cachefile)
                 cache_class.init_cacheData(self)
         if cache_ok:
-            self.load_cachefile()
+            self.loader = threading.Thread(target=self.load_cachefile, name="CacheLoader")
+            self.loader.start()
         elif os.path.isfile(self.cachefile):
             logger.info("Out of date cache found, rebuilding...")
         else:
@@ -405,76 +662,35 @@ class Cache(NoCache):
             pass
 
     def load_cachefile(self):
-        cachesize = 0
-        previous_progress = 0
-        previous_percent = 0
-
-        # Calculate the correct cachesize of all those cache files
-        for cache_class in self.caches_array:
-            cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
-            with open(cachefile, "rb") as cachefile:
-                cachesize += os.fstat(cachefile.fileno()).st_size
-
-        bb.event.fire(bb.event.CacheLoadStarted(cachesize), self.data)
-
+        """
+        Open the cache files and load their indexes. This runs in the
+        background while the recipes are being found; entries themselves
+        are only unpickled when they're looked up.
+        """
+        depends_cache = DependsCache()
         for cache_class in self.caches_array:
             cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
             logger.debug(1, 'Loading cache file: %s' % cachefile)
-            with open(cachefile, "rb") as cachefile:
-                pickled = pickle.Unpickler(cachefile)
-                # Check cache version information
-                try:
-                    cache_ver = pickled.load()
-                    bitbake_ver = pickled.load()
-                except Exception:
-                    logger.info('Invalid cache, rebuilding...')
-                    return
-
-                if cache_ver != __cache_version__:
-                    logger.info('Cache version mismatch, rebuilding...')
-                    return
-                elif bitbake_ver != bb.__version__:
-                    logger.info('Bitbake version mismatch, rebuilding...')
-                    return
-
-                # Load the rest of the cache file
-                current_progress = 0
-                while cachefile:
-                    try:
-                        key = pickled.load()
-                        value = pickled.load()
-                    except Exception:
-                        break
-                    if not isinstance(key, str):
-                        bb.warn("%s from extras cache is not a string?" % key)
-                        break
-                    if not isinstance(value, RecipeInfoCommon):
-                        bb.warn("%s from extras cache is not a RecipeInfoCommon class?" % value)
-                        break
-
-                    if key in self.depends_cache:
-                        self.depends_cache[key].append(value)
-                    else:
-                        self.depends_cache[key] = [value]
-                    # only fire events on even percentage boundaries
-                    current_progress = cachefile.tell() + previous_progress
-                    if current_progress > cachesize:
-                        # we might have calculated incorrect total size because a file
-                        # might've been written out just after we checked its size
-                        cachesize = current_progress
-                    current_percent = 100 * current_progress / cachesize
-                    if current_percent > previous_percent:
-                        previous_percent = current_percent
-                        bb.event.fire(bb.event.CacheLoadProgress(current_progress, cachesize),
-                                      self.data)
-
-                previous_progress += current_progress
-
-        # Note: depends cache number is corresponding to the parsing file numbers.
-        # The same file has several caches, still regarded as one item in the cache
-        bb.event.fire(bb.event.CacheLoadCompleted(cachesize,
-                                                  len(self.depends_cache)),
-                      self.data)
+            cachefile = IndexedCacheFile(cachefile)
+            if not cachefile.open():
+                depends_cache.close()
+                return
+            self.cachesize += len(cachefile.mm)
+            depends_cache.add_file(cache_class.__name__, cachefile)
+        self._depends_cache = depends_cache
+
+    @property
+    def depends_cache(self):
+        if self.loader:
+            self.loader.join()
+            self.loader = None
+            bb.event.fire(bb.event.CacheLoadStarted(self.cachesize), self.data)
+            # Note: depends cache number is corresponding to the parsing file numbers.
+            # The same file has several caches, still regarded as one item in the cache
+            bb.event.fire(bb.event.CacheLoadCompleted(self.cachesize,
+                                                      len(self._depends_cache)),
+                          self.data)
+        return self._depends_cache
 
     def parse(self, filename, appends):
         """Parse the specified filename, returning the recipe information"""
@@ -687,20 +903,11 @@ class Cache(NoCache):
             return
 
         for cache_class in self.caches_array:
-            cache_class_name = cache_class.__name__
             cachefile = getCacheFile(self.cachedir, cache_class.cachefile, self.data_hash)
-            with open(cachefile, "wb") as f:
-                p = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
-                p.dump(__cache_version__)
-                p.dump(bb.__version__)
-
-                for key, info_array in self.depends_cache.items():
-                    for info in info_array:
-                        if isinstance(info, RecipeInfoCommon) and info.__class__.__name__ == cache_class_name:
-                            p.dump(key)
-                            p.dump(info)
-
-        del self.depends_cache
+            self.depends_cache.save(cache_class.__name__, cachefile)
+
+        self.depends_cache.close()
+        del self._depends_cache
 
     @staticmethod
     def mtime(cachefile):
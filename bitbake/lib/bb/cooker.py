@@ -389,7 +389,8 @@ class BBCooker:
             if not self.hashserv:
                 dbfile = (self.data.getVar("PERSISTENT_DIR") or self.data.getVar("CACHE")) + "/hashserv.db"
                 self.hashservaddr = "unix://%s/hashserve.sock" % self.data.getVar("TOPDIR")
-                self.hashserv = hashserv.create_server(self.hashservaddr, dbfile, sync=False)
+                upstream = self.data.getVar("BB_HASHSERVE_UPSTREAM") or None
+                self.hashserv = hashserv.create_server(self.hashservaddr, dbfile, sync=False, upstream=upstream)
                 self.hashserv.process = multiprocessing.Process(target=self.hashserv.serve_forever)
                 self.hashserv.process.start()
             self.data.setVar("BB_HASHSERVE", self.hashservaddr)
@@ -1552,6 +1553,9 @@ class BBCooker:
                 for dep in self.configuration.extra_assume_provided:
                     self.recipecaches[mc].ignored_dependencies.add(dep)
 
+            # The cache index loads in the background while the recipes are found
+            bb_cache = bb.cache.Cache(self.databuilder, self.data_hash, self.caches_array)
+
             self.collection = CookerCollectFiles(self.bbfile_config_priorities)
             (filelist, masked, searchdirs) = self.collection.collect_bbfiles(self.data, self.data)
 
@@ -1559,7 +1563,7 @@ class BBCooker:
             for dirent in searchdirs:
                 self.add_filewatch([[dirent]], dirs=True)
 
-            self.parser = CookerParser(self, filelist, masked)
+            self.parser = CookerParser(self, filelist, masked, bb_cache)
             self.parsecache_valid = True
 
         self.state = state.parsing
@@ -1892,9 +1896,29 @@ class ParsingFailure(Exception):
         self.recipe = recipe
         Exception.__init__(self, realexception, recipe)
 
+def order_by_parse_cost(jobs, parsetimes):
+    """
+    Sort the (filename, appends) parse jobs so the most expensive recipes
+    are handed out first. Recipes with a parse time recorded by an earlier
+    run are ordered by that time, recipes without one are assumed to be
+    expensive and go first, largest file first.
+    """
+    def cost(job):
+        fn = job[0]
+        if fn in parsetimes:
+            return (0, parsetimes[fn])
+        try:
+            return (1, os.path.getsize(fn))
+        except OSError:
+            return (1, 0)
+    return sorted(jobs, key=cost, reverse=True)
+
 class Parser(multiprocessing.Process):
-    def __init__(self, jobs, results, quit, init, profile):
+    def __init__(self, jobs, next_job, results, quit, init, profile):
         self.jobs = jobs
+        # Shared index into jobs, each parser takes the next unparsed
+        # recipe from it so a slow recipe doesn't hold up a whole chunk
+        self.next_job = next_job
         self.results = results
         self.quit = quit
         self.init = init
@@ -1937,11 +1961,14 @@ class Parser(multiprocessing.Process):
             if pending:
                 result = pending.pop()
             else:
-                try:
-                    job = self.jobs.pop()
-                except IndexError:
+                with self.next_job.get_lock():
+                    jobid = self.next_job.value
+                    self.next_job.value += 1
+                if jobid >= len(self.jobs):
                     break
-                result = self.parse(*job)
+                job = self.jobs[jobid]
+                start = time.time()
+                result = self.parse(*job) + (job[0], time.time() - start)
                 # Clear the siggen cache after parsing to control memory usage, its huge
                 bb.parse.siggen.postparsing_clean_cache()
             try:
@@ -1978,7 +2005,9 @@ class Parser(multiprocessing.Process):
             bb.event.LogHandler.filter = origfilter
 
 class CookerParser(object):
-    def __init__(self, cooker, filelist, masked):
+    parsetimes_version = "1"
+
+    def __init__(self, cooker, filelist, masked, bb_cache=None):
         self.filelist = filelist
         self.cooker = cooker
         self.cfgdata = cooker.data
@@ -1998,7 +2027,9 @@ class CookerParser(object):
         self.current = 0
         self.process_names = []
 
-        self.bb_cache = bb.cache.Cache(self.cfgbuilder, self.cfghash, cooker.caches_array)
+        if bb_cache is None:
+            bb_cache = bb.cache.Cache(self.cfgbuilder, self.cfghash, cooker.caches_array)
+        self.bb_cache = bb_cache
         self.fromcache = []
         self.willparse = []
         for filename in self.filelist:
@@ -2008,6 +2039,14 @@ class CookerParser(object):
             else:
                 self.fromcache.append((filename, appends))
         self.toparse = self.total - len(self.fromcache)
+
+        # Hand out the slowest recipes first so that the end of parsing
+        # isn't left waiting on a single large recipe
+        self.parsetimes_cache = bb.cache.SimpleCache(self.parsetimes_version)
+        self.parsetimes = self.parsetimes_cache.init_cache(self.cfgdata, "bb_parsetimes.dat", {})
+        self.newparsetimes = {}
+        self.willparse = order_by_parse_cost(self.willparse, self.parsetimes)
+
         self.progress_chunk = int(max(self.toparse / 100, 1))
 
         self.num_processes = min(int(self.cfgdata.getVar("BB_NUMBER_PARSE_THREADS") or
@@ -2029,13 +2068,10 @@ class CookerParser(object):
 
             self.parser_quit = multiprocessing.Queue(maxsize=self.num_processes)
             self.result_queue = multiprocessing.Queue()
-
-            def chunkify(lst,n):
-                return [lst[i::n] for i in range(n)]
-            self.jobs = chunkify(self.willparse, self.num_processes)
+            self.next_job = multiprocessing.Value('i', 0)
 
             for i in range(0, self.num_processes):
-                parser = Parser(self.jobs[i], self.result_queue, self.parser_quit, init, self.cooker.configuration.profile)
+                parser = Parser(self.willparse, self.next_job, self.result_queue, self.parser_quit, init, self.cooker.configuration.profile)
                 parser.start()
                 self.process_names.append(parser.name)
                 self.processes.append(parser)
@@ -2083,6 +2119,7 @@ class CookerParser(object):
         multiprocessing.util.Finalize(None, sync.join, exitpriority=-100)
         bb.codeparser.parser_cache_savemerge()
         bb.fetch.fetcher_parse_done()
+        self.save_parsetimes()
         if self.cooker.configuration.profile:
             profiles = []
             for i in self.process_names:
@@ -2094,6 +2131,31 @@ class CookerParser(object):
             bb.utils.process_profilelog(profiles, pout = pout)
             print("Processed parsing statistics saved to %s" % (pout))
 
+            tout = "profile-parse-times.log"
+            self.write_parsetimes_report(tout)
+            print("Per recipe parse times saved to %s" % (tout))
+
+    def save_parsetimes(self):
+        if not self.newparsetimes:
+            return
+        # Only keep entries for recipes which still exist
+        filenames = set(self.filelist)
+        parsetimes = dict((fn, t) for fn, t in self.parsetimes.items() if fn in filenames)
+        parsetimes.update(self.newparsetimes)
+        self.parsetimes_cache.save(parsetimes)
+
+        slowest = sorted(self.newparsetimes.items(), key=lambda i: i[1], reverse=True)[:10]
+        logger.debug(1, "Slowest recipes to parse:\n%s" %
+                     "\n".join("  %.2fs %s" % (t, fn) for fn, t in slowest))
+
+    def write_parsetimes_report(self, filename):
+        total = sum(self.newparsetimes.values())
+        with open(filename, "w") as f:
+            f.write("Parsed %d recipes in %.2fs total using %d processes\n\n" %
+                    (len(self.newparsetimes), total, self.num_processes))
+            for fn, t in sorted(self.newparsetimes.items(), key=lambda i: i[1], reverse=True):
+                f.write("%10.3fs %s\n" % (t, fn))
+
     def load_cached(self):
         for filename, appends in self.fromcache:
             cached, infos = self.bb_cache.load(filename, appends)
@@ -2113,7 +2175,9 @@ class CookerParser(object):
                 if isinstance(value, BaseException):
                     raise value
                 else:
-                    yield result
+                    _, _, filename, elapsed = result
+                    self.newparsetimes[filename] = elapsed
+                    yield result[:2]
 
     def parse_next(self):
         result = []
@@ -18,6 +18,7 @@ BitBake build tools.
 
 import copy, re, sys, traceback
 from collections import MutableMapping
+import functools
 import logging
 import hashlib
 import bb, bb.codeparser
@@ -79,6 +80,59 @@ def infer_caller_details(loginfo, parent = False, varval = True):
         if func not in loginfo:
             loginfo['func'] = func
 
+# Segment types of an expansion template
+__expand_literal__ = 0
+__expand_var__ = 1
+__expand_python__ = 2
+
+@functools.lru_cache(maxsize=16384)
+def expansion_template(s):
+    """
+    Split a string containing expressions into a tuple of (type, text)
+    segments: literal text, ${VAR} references (text is the variable name)
+    and ${@...} expressions (text is the code). This lets expandWithRefs()
+    expand the string without rescanning it with the expansion regexps.
+
+    The template depends only on the string, so it never needs to be
+    invalidated, and the many values shared between variables and recipes
+    are only split once.
+
+    Returns None for strings where the regexp based expansion isn't
+    equivalent to expanding each segment in place, i.e. when an ${@...}
+    expression contains references or a ${@ isn't a complete expression.
+    """
+    pymatches = list(__expand_python_regexp__.finditer(s))
+    if s.count("${@") != len(pymatches):
+        return None
+    for m in pymatches:
+        if "${" in m.group()[3:]:
+            return None
+
+    matches = list(__expand_var_regexp__.finditer(s)) + pymatches
+    matches.sort(key=lambda m: m.start())
+
+    segments = []
+    pos = 0
+    for m in matches:
+        if m.start() > pos:
+            segments.append((__expand_literal__, s[pos:m.start()]))
+        if m.re is __expand_python_regexp__:
+            segments.append((__expand_python__, m.group()[3:-1]))
+        else:
+            segments.append((__expand_var__, m.group()[2:-1]))
+        pos = m.end()
+    if pos < len(s):
+        segments.append((__expand_literal__, s[pos:]))
+    return tuple(segments)
+
+@functools.lru_cache(maxsize=4096)
+def compile_expression(code, name):
+    """
+    Compile the code of an ${@...} expression. Expressions are evaluated
+    again whenever the datastore changes, but their code rarely does.
+    """
+    return compile(code, name, "eval")
+
 class VariableParse:
     def __init__(self, varname, d, val = None):
         self.varname = varname
@@ -91,15 +145,19 @@ class VariableParse:
 
     def var_sub(self, match):
             key = match.group()[2:-1]
+            var = self.var_ref(key)
+            if var is not None:
+                return var
+            else:
+                return match.group()
+
+    def var_ref(self, key):
             if self.varname and key:
                 if self.varname == key:
                     raise Exception("variable %s references itself!" % self.varname)
             var = self.d.getVarFlag(key, "_content")
             self.references.add(key)
-            if var is not None:
-                return var
-            else:
-                return match.group()
+            return var
 
     def python_sub(self, match):
             if isinstance(match, str):
@@ -115,7 +173,7 @@ class VariableParse:
                 varname = 'Var <%s>' % self.varname
             else:
                 varname = '<expansion>'
-            codeobj = compile(code.strip(), varname, "eval")
+            codeobj = compile_expression(code.strip(), varname)
 
             parser = bb.codeparser.PythonParser(self.varname, logger)
             parser.parse_python(code)
@@ -403,6 +461,16 @@ class DataSmart(MutableMapping):
 
         varparse = VariableParse(varname, self)
 
+        if s.find('${') != -1:
+            template = expansion_template(s)
+            if template is not None:
+                news = self.expandTemplate(s, template, varparse, varname)
+                if news == s:
+                    varparse.value = s
+                    return varparse
+                if news is not None:
+                    s = news
+
         while s.find('${') != -1:
             olds = s
             try:
@@ -427,6 +495,67 @@ class DataSmart(MutableMapping):
 
         return varparse
 
+    def expandTemplate(self, s, template, varparse, varname):
+        """
+        Perform one round of expansion of s, the string the template was
+        created from, equivalent to one pass of the loop in
+        expandWithRefs(). Returns None if the expanded references produce
+        new ${@...} expressions, in which case the loop has to be used.
+        """
+        try:
+            expanded = []
+            codes = 0
+            for (kind, text) in template:
+                if kind == __expand_literal__:
+                    expanded.append(text)
+                elif kind == __expand_var__:
+                    var = varparse.var_ref(text)
+                    if var is not None:
+                        expanded.append(var)
+                    else:
+                        expanded.append("${" + text + "}")
+                else:
+                    codes += 1
+                    expanded.append(None)
+        except ExpansionError:
+            raise
+        except bb.parse.SkipRecipe:
+            raise
+        except Exception as exc:
+            tb = sys.exc_info()[2]
+            raise ExpansionError(varname, s, exc).with_traceback(tb) from exc
+
+        # Values of references are joined to literal text, so check that
+        # doesn't create any ${@ that the regexp would also match
+        if codes:
+            news = "".join(("${@" + text + "}") if part is None else part for ((kind, text), part) in zip(template, expanded))
+        else:
+            news = "".join(expanded)
+        if news.count("${@") != codes:
+            return None
+        if not codes:
+            return news
+
+        try:
+            try:
+                for i, (kind, text) in enumerate(template):
+                    if kind == __expand_python__:
+                        expanded[i] = varparse.python_sub(text)
+            except SyntaxError as e:
+                # Likely unmatched brackets, just don't expand the expression
+                if e.msg != "EOL while scanning string literal":
+                    raise
+                return news
+        except ExpansionError:
+            raise
+        except bb.parse.SkipRecipe:
+            raise
+        except Exception as exc:
+            tb = sys.exc_info()[2]
+            raise ExpansionError(varname, news, exc).with_traceback(tb) from exc
+
+        return "".join(expanded)
+
     def expand(self, s, varname = None):
         return self.expandWithRefs(s, varname).value
 
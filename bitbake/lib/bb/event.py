@@ -54,6 +54,7 @@ def get_class_handlers():
 def set_class_handlers(h):
     global _handlers
     _handlers = h
+    _handler_table.clear()
 
 def clean_class_handlers():
     return bb.compat.OrderedDict()
@@ -65,10 +66,13 @@ _ui_logfilters = {}
 _ui_handler_seq = 0
 _event_handler_map = {}
 _catchall_handlers = {}
+# Event class -> list of (name, handler) to run for it, in registration order
+_handler_table = {}
 _eventfilter = None
 _uiready = False
 _thread_lock = threading.Lock()
-_thread_lock_enabled = False
+# Number of users of threads firing events, see enable_threadlock()
+_thread_lock_enabled = 0
 
 if hasattr(__builtins__, '__setitem__'):
     builtins = __builtins__
@@ -76,12 +80,17 @@ else:
     builtins = __builtins__.__dict__
 
 def enable_threadlock():
+    """
+    Serialise sending events to the UI handlers, for code firing events
+    from several threads. Calls nest, the lock stays enabled until each
+    call has been matched by a disable_threadlock() call.
+    """
     global _thread_lock_enabled
-    _thread_lock_enabled = True
+    _thread_lock_enabled += 1
 
 def disable_threadlock():
     global _thread_lock_enabled
-    _thread_lock_enabled = False
+    _thread_lock_enabled = max(_thread_lock_enabled - 1, 0)
 
 def execute_handler(name, handler, event, d):
     event.data = d
@@ -107,18 +116,30 @@ def execute_handler(name, handler, event, d):
         if addedd:
             del builtins['d']
 
+def class_handlers_for(cls):
+    """
+    Return the (name, handler) pairs to run for events of class cls. The
+    list is worked out once per class and dropped whenever the handlers
+    change.
+    """
+    handlers = _handler_table.get(cls)
+    if handlers is None:
+        eid = str(cls)[8:-2]
+        evt_hmap = _event_handler_map.get(eid, {})
+        handlers = [(name, handler) for name, handler in _handlers.items()
+                    if name in _catchall_handlers or name in evt_hmap]
+        _handler_table[cls] = handlers
+    return handlers
+
 def fire_class_handlers(event, d):
     if isinstance(event, logging.LogRecord):
         return
 
-    eid = str(event.__class__)[8:-2]
-    evt_hmap = _event_handler_map.get(eid, {})
-    for name, handler in list(_handlers.items()):
-        if name in _catchall_handlers or name in evt_hmap:
-            if _eventfilter:
-                if not _eventfilter(name, handler, event, d):
-                    continue
-            execute_handler(name, handler, event, d)
+    for name, handler in class_handlers_for(event.__class__):
+        if _eventfilter:
+            if not _eventfilter(name, handler, event, d):
+                continue
+        execute_handler(name, handler, event, d)
 
 ui_queue = []
 @atexit.register
@@ -179,10 +200,12 @@ def fire_ui_handlers(event, d):
         ui_queue.append(event)
         return
 
-    if _thread_lock_enabled:
+    locked = _thread_lock_enabled
+    if locked:
         _thread_lock.acquire()
 
     errors = []
+    pickled = None
     for h in _ui_handlers:
         #print "Sending event %s" % event
         try:
@@ -190,9 +213,11 @@ def fire_ui_handlers(event, d):
                  continue
              # We use pickle here since it better handles object instances
              # which xmlrpc's marshaller does not. Events *must* be serializable
-             # by pickle.
+             # by pickle. The event is only pickled once for all the handlers.
              if hasattr(_ui_handlers[h].event, "sendpickle"):
-                _ui_handlers[h].event.sendpickle((pickle.dumps(event)))
+                if pickled is None:
+                    pickled = pickle.dumps(event)
+                _ui_handlers[h].event.sendpickle(pickled)
              else:
                 _ui_handlers[h].event.send(event)
         except:
@@ -200,7 +225,7 @@ def fire_ui_handlers(event, d):
     for h in errors:
         del _ui_handlers[h]
 
-    if _thread_lock_enabled:
+    if locked:
         _thread_lock.release()
 
 def fire(event, d):
@@ -234,6 +259,7 @@ def register(name, handler, mask=None, filename=None, lineno=None):
     if name in _handlers:
         return AlreadyRegistered
 
+    _handler_table.clear()
     if handler is not None:
         # handle string containing python code
         if isinstance(handler, str):
@@ -273,6 +299,7 @@ def register(name, handler, mask=None, filename=None, lineno=None):
 def remove(name, handler):
     """Remove an Event handler"""
     _handlers.pop(name)
+    _handler_table.clear()
     if name in _catchall_handlers:
         _catchall_handlers.pop(name)
     for event in _event_handler_map.keys():
@@ -285,6 +312,7 @@ def get_handlers():
 def set_handlers(handlers):
     global _handlers
     _handlers = handlers
+    _handler_table.clear()
 
 def set_eventfilter(func):
     global _eventfilter
@@ -1679,6 +1679,10 @@ class Fetch(object):
     def download(self, urls=None):
         """
         Fetch all urls
+
+        If BB_FETCH_THREADS is greater than one, the urls are fetched
+        concurrently by that many threads, with at most
+        BB_FETCH_HOST_CONNECTIONS of them fetching from the same host.
         """
         if not urls:
             urls = self.urls
@@ -1686,94 +1690,168 @@ class Fetch(object):
         network = self.d.getVar("BB_NO_NETWORK")
         premirroronly = bb.utils.to_boolean(self.d.getVar("BB_FETCH_PREMIRRORONLY"))
 
+        threads = int(self.d.getVar("BB_FETCH_THREADS") or 1)
+        if threads > 1 and len(urls) > 1:
+            self._download_concurrent(urls, threads, network, premirroronly)
+            return
+
         for u in urls:
-            ud = self.ud[u]
-            ud.setup_localpath(self.d)
-            m = ud.method
-            done = False
+            self._download_url(u, self.d, network, premirroronly)
 
-            if ud.lockfile:
-                lf = bb.utils.lockfile(ud.lockfile)
+    def _download_concurrent(self, urls, threads, network, premirroronly):
+        """
+        Fetch urls using a pool of threads. Each thread uses its own copy
+        of the datastore, since the fetchers change variables while they
+        run. A url is only handed to the pool once a thread is free and its
+        host has fewer than BB_FETCH_HOST_CONNECTIONS fetches running, so
+        urls waiting for a busy host never hold up urls from other hosts.
+        If any url fails, the urls which haven't been started yet are
+        skipped and the error of the first failing url is raised.
+        """
+        import collections
+        import concurrent.futures
+        import queue
+
+        threads = min(threads, len(urls))
+        hostlimit = int(self.d.getVar("BB_FETCH_HOST_CONNECTIONS") or threads)
+        hostrunning = collections.Counter()
+        waiting = list(urls)
+        running = {}
+        errors = {}
+
+        datastores = queue.Queue()
+        for _ in range(threads):
+            datastores.put(bb.data.createCopy(self.d))
 
+        progress = bb.progress.AggregateProgressReporter(self.d, len(urls))
+
+        def fetch_url(u):
+            d = datastores.get()
             try:
-                self.d.setVar("BB_NO_NETWORK", network)
+                with progress.slot(u):
+                    self._download_url(u, d, network, premirroronly)
+            finally:
+                datastores.put(d)
 
-                if m.verify_donestamp(ud, self.d) and not m.need_update(ud, self.d):
-                    done = True
-                elif m.try_premirror(ud, self.d):
-                    logger.debug(1, "Trying PREMIRRORS")
-                    mirrors = mirror_from_string(self.d.getVar('PREMIRRORS'))
-                    done = m.try_mirrors(self, ud, self.d, mirrors)
-                    if done:
-                        try:
-                            # early checksum verification so that if the checksum of the premirror
-                            # contents mismatch the fetcher can still try upstream and mirrors
-                            m.update_donestamp(ud, self.d)
-                        except ChecksumError as e:
-                            logger.warning("Checksum failure encountered with premirror download of %s - will attempt other sources." % u)
-                            logger.debug(1, str(e))
-                            done = False
-
-                if premirroronly:
-                    self.d.setVar("BB_NO_NETWORK", "1")
-
-                firsterr = None
-                verified_stamp = m.verify_donestamp(ud, self.d)
-                if not done and (not verified_stamp or m.need_update(ud, self.d)):
+        bb.event.enable_threadlock()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                while True:
+                    if not errors:
+                        for u in list(waiting):
+                            if len(running) >= threads:
+                                break
+                            host = self.ud[u].host
+                            if hostrunning[host] < hostlimit:
+                                waiting.remove(u)
+                                hostrunning[host] += 1
+                                running[executor.submit(fetch_url, u)] = u
+                    if not running:
+                        break
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for f in done:
+                        u = running.pop(f)
+                        hostrunning[self.ud[u].host] -= 1
+                        if f.exception():
+                            errors[u] = f.exception()
+        finally:
+            bb.event.disable_threadlock()
+
+        for u in urls:
+            if u in errors:
+                raise errors[u]
+
+    def _download_url(self, u, d, network, premirroronly):
+        """
+        Fetch a single url, trying PREMIRRORS, upstream and then MIRRORS
+        """
+        ud = self.ud[u]
+        ud.setup_localpath(d)
+        m = ud.method
+        done = False
+
+        if ud.lockfile:
+            lf = bb.utils.lockfile(ud.lockfile)
+
+        try:
+            d.setVar("BB_NO_NETWORK", network)
+
+            if m.verify_donestamp(ud, d) and not m.need_update(ud, d):
+                done = True
+            elif m.try_premirror(ud, d):
+                logger.debug(1, "Trying PREMIRRORS")
+                mirrors = mirror_from_string(d.getVar('PREMIRRORS'))
+                done = m.try_mirrors(self, ud, d, mirrors)
+                if done:
                     try:
-                        if not trusted_network(self.d, ud.url):
-                            raise UntrustedUrl(ud.url)
-                        logger.debug(1, "Trying Upstream")
-                        m.download(ud, self.d)
-                        if hasattr(m, "build_mirror_data"):
-                            m.build_mirror_data(ud, self.d)
-                        done = True
-                        # early checksum verify, so that if checksum mismatched,
-                        # fetcher still have chance to fetch from mirror
-                        m.update_donestamp(ud, self.d)
-
-                    except bb.fetch2.NetworkAccess:
+                        # early checksum verification so that if the checksum of the premirror
+                        # contents mismatch the fetcher can still try upstream and mirrors
+                        m.update_donestamp(ud, d)
+                    except ChecksumError as e:
+                        logger.warning("Checksum failure encountered with premirror download of %s - will attempt other sources." % u)
+                        logger.debug(1, str(e))
+                        done = False
+
+            if premirroronly:
+                d.setVar("BB_NO_NETWORK", "1")
+
+            firsterr = None
+            verified_stamp = m.verify_donestamp(ud, d)
+            if not done and (not verified_stamp or m.need_update(ud, d)):
+                try:
+                    if not trusted_network(d, ud.url):
+                        raise UntrustedUrl(ud.url)
+                    logger.debug(1, "Trying Upstream")
+                    m.download(ud, d)
+                    if hasattr(m, "build_mirror_data"):
+                        m.build_mirror_data(ud, d)
+                    done = True
+                    # early checksum verify, so that if checksum mismatched,
+                    # fetcher still have chance to fetch from mirror
+                    m.update_donestamp(ud, d)
+
+                except bb.fetch2.NetworkAccess:
+                    raise
+
+                except BBFetchException as e:
+                    if isinstance(e, ChecksumError):
+                        logger.warning("Checksum failure encountered with download of %s - will attempt other sources if available" % u)
+                        logger.debug(1, str(e))
+                        if os.path.exists(ud.localpath):
+                            rename_bad_checksum(ud, e.checksum)
+                    elif isinstance(e, NoChecksumError):
                         raise
+                    else:
+                        logger.warning('Failed to fetch URL %s, attempting MIRRORS if available' % u)
+                        logger.debug(1, str(e))
+                    firsterr = e
+                    # Remove any incomplete fetch
+                    if not verified_stamp:
+                        m.clean(ud, d)
+                    logger.debug(1, "Trying MIRRORS")
+                    mirrors = mirror_from_string(d.getVar('MIRRORS'))
+                    done = m.try_mirrors(self, ud, d, mirrors)
+
+            if not done or not m.done(ud, d):
+                if firsterr:
+                    logger.error(str(firsterr))
+                raise FetchError("Unable to fetch URL from any source.", u)
+
+            m.update_donestamp(ud, d)
+
+        except IOError as e:
+            if e.errno in [errno.ESTALE]:
+                logger.error("Stale Error Observed %s." % u)
+                raise ChecksumError("Stale Error Detected")
+
+        except BBFetchException as e:
+            if isinstance(e, ChecksumError):
+                logger.error("Checksum failure fetching %s" % u)
+            raise
 
-                    except BBFetchException as e:
-                        if isinstance(e, ChecksumError):
-                            logger.warning("Checksum failure encountered with download of %s - will attempt other sources if available" % u)
-                            logger.debug(1, str(e))
-                            if os.path.exists(ud.localpath):
-                                rename_bad_checksum(ud, e.checksum)
-                        elif isinstance(e, NoChecksumError):
-                            raise
-                        else:
-                            logger.warning('Failed to fetch URL %s, attempting MIRRORS if available' % u)
-                            logger.debug(1, str(e))
-                        firsterr = e
-                        # Remove any incomplete fetch
-                        if not verified_stamp:
-                            m.clean(ud, self.d)
-                        logger.debug(1, "Trying MIRRORS")
-                        mirrors = mirror_from_string(self.d.getVar('MIRRORS'))
-                        done = m.try_mirrors(self, ud, self.d, mirrors)
-
-                if not done or not m.done(ud, self.d):
-                    if firsterr:
-                        logger.error(str(firsterr))
-                    raise FetchError("Unable to fetch URL from any source.", u)
-
-                m.update_donestamp(ud, self.d)
-
-            except IOError as e:
-                if e.errno in [errno.ESTALE]:
-                    logger.error("Stale Error Observed %s." % u)
-                    raise ChecksumError("Stale Error Detected")
-
-            except BBFetchException as e:
-                if isinstance(e, ChecksumError):
-                    logger.error("Checksum failure fetching %s" % u)
-                raise
-
-            finally:
-                if ud.lockfile:
-                    bb.utils.unlockfile(lf)
+        finally:
+            if ud.lockfile:
+                bb.utils.unlockfile(lf)
 
     def checkstatus(self, urls=None):
         """
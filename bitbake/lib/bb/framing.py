@@ -0,0 +1,215 @@
+"""
+BitBake message framing
+
+Framing of the messages task processes and workers send back to the cooker.
+Each message is a frame made of a one byte message type, the length of the
+payload as a four byte big endian number and the pickled payload itself.
+"""
+
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import os
+import pickle
+import struct
+import time
+
+HEADER = struct.Struct("!cI")
+
+EVENT = b"e"
+EXITCODE = b"x"
+
+# Size of the read buffer, and the least space left for a read
+READ_BUFFER_SIZE = 256 * 1024
+MIN_READ_SIZE = 64 * 1024
+
+def frame(msgtype, data):
+    return HEADER.pack(msgtype, len(data)) + data
+
+def event_frame(event):
+    return frame(EVENT, pickle.dumps(event))
+
+def exitcode_frame(task, status):
+    return frame(EXITCODE, pickle.dumps((task, status)))
+
+class FrameError(Exception):
+    """
+    A frame couldn't be unpickled
+    """
+
+class FrameStats(object):
+    """
+    Message and byte counters of a pipe, for profiling
+    """
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.start = time.time()
+
+    def add(self, size, messages=1):
+        self.messages += messages
+        self.bytes += size
+
+    def rates(self):
+        """
+        Return the messages and bytes per second since the counters were created
+        """
+        elapsed = max(time.time() - self.start, 1e-6)
+        return (self.messages / elapsed, self.bytes / elapsed)
+
+    def __str__(self):
+        (msgrate, byterate) = self.rates()
+        return "%d messages (%.0f/s), %d bytes (%.0f/s)" % (self.messages, msgrate, self.bytes, byterate)
+
+class FrameReader(object):
+    """
+    Reassembles frames from a non-blocking file descriptor or socket
+
+    Data is read straight into a preallocated buffer and payloads are
+    unpickled from views of the buffer, so nothing is copied or searched
+    for message boundaries. Whatever follows the last complete frame is
+    moved to the start of the buffer once the space after it runs low, and
+    the buffer only grows for frames larger than itself.
+
+    readinto is called with a writable memoryview and returns the number of
+    bytes it read, like socket.recv_into(). It defaults to os.readv() on fd.
+    """
+    def __init__(self, fd=None, readinto=None, size=READ_BUFFER_SIZE):
+        if readinto is None:
+            readinto = lambda view: os.readv(fd, [view])
+        self.readinto = readinto
+        self.buf = bytearray(size)
+        self.start = 0
+        self.end = 0
+        self.stats = FrameStats()
+
+    def __len__(self):
+        """
+        Number of bytes read but not returned as frames yet
+        """
+        return self.end - self.start
+
+    def make_room(self, size):
+        pending = self.end - self.start
+        if len(self.buf) - pending < size:
+            # A new buffer, as the old one can't be resized while messages()
+            # holds a view of it
+            buf = bytearray(pending + size)
+            buf[:pending] = self.buf[self.start:self.end]
+            self.buf = buf
+        elif self.start:
+            self.buf[:pending] = self.buf[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def read(self):
+        """
+        Read whatever is available. Returns the number of bytes read, which
+        is 0 at the end of the file, or None if nothing was available.
+        """
+        needed = MIN_READ_SIZE
+        if self.end - self.start >= HEADER.size:
+            (_, length) = HEADER.unpack_from(self.buf, self.start)
+            needed = max(needed, self.start + HEADER.size + length - self.end)
+        if len(self.buf) - self.end < needed:
+            self.make_room(needed)
+
+        view = memoryview(self.buf)[self.end:]
+        try:
+            count = self.readinto(view)
+        except (BlockingIOError, InterruptedError):
+            return None
+        finally:
+            view.release()
+        self.end += count
+        return count
+
+    def frames(self):
+        """
+        Yield (message type, frame) for each complete frame read, the frame
+        as bytes, to pass it on as is
+        """
+        stats = self.stats
+        while self.end - self.start >= HEADER.size:
+            start = self.start
+            (msgtype, length) = HEADER.unpack_from(self.buf, start)
+            size = HEADER.size + length
+            if self.end - start < size:
+                break
+            self.start = start + size
+            stats.messages += 1
+            stats.bytes += size
+            yield (msgtype, bytes(self.buf[start:start + size]))
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def messages(self):
+        """
+        Yield (message type, payload) for each complete frame read, the
+        payload unpickled straight from the buffer. The consumer may read()
+        again while handling a message, later messages are then handed out
+        from within that call.
+        """
+        stats = self.stats
+        unpack_from = HEADER.unpack_from
+        headersize = HEADER.size
+        loads = pickle.loads
+        buf = self.buf
+        view = memoryview(buf)
+        try:
+            while self.end - self.start >= headersize:
+                start = self.start
+                (msgtype, length) = unpack_from(buf, start)
+                size = headersize + length
+                if self.end - start < size:
+                    break
+                self.start = start + size
+                stats.messages += 1
+                stats.bytes += size
+                try:
+                    obj = loads(view[start + headersize:start + size])
+                except ValueError as e:
+                    raise FrameError("failed load pickle '%s': '%s'" % (e, bytes(view[start + headersize:start + size])))
+                yield (msgtype, obj)
+                if self.buf is not buf:
+                    view.release()
+                    buf = self.buf
+                    view = memoryview(buf)
+        finally:
+            view.release()
+        if self.start == self.end:
+            self.start = self.end = 0
+
+class FrameWriter(object):
+    """
+    Queues frames for writing to a non-blocking file descriptor
+
+    The frames are appended to a bytearray which write() consumes from the
+    front. Deleting from the front of a bytearray only moves its start, so
+    neither side copies the queued data again.
+    """
+    def __init__(self, fd):
+        self.fd = fd
+        self.buf = bytearray()
+        self.stats = FrameStats()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def append(self, data):
+        """
+        Queue a complete frame
+        """
+        self.buf += data
+        self.stats.add(len(data))
+
+    def write(self):
+        """
+        Write as much of the queued data as possible, returns the number of
+        bytes written. Errors, EAGAIN included, are raised as OSError.
+        """
+        with memoryview(self.buf) as view:
+            written = os.write(self.fd, view)
+        del self.buf[:written]
+        return written
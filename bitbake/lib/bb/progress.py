@@ -10,6 +10,7 @@ BitBake progress handling code
 import re
 import time
 import inspect
+import threading
 import bb.event
 import bb.build
 from bb.build import StdoutNoopContextManager
@@ -38,6 +39,10 @@ class ProgressHandler(object):
 
     def _fire_progress(self, taskprogress, rate=None):
         """Internal function to fire the progress event"""
+        slot = getattr(_thread_state, 'slot', None)
+        if slot:
+            slot[0].update(slot[1], taskprogress)
+            return
         bb.event.fire(bb.build.TaskProgress(taskprogress, rate), self._data)
 
     def write(self, string):
@@ -114,6 +119,63 @@ class OutOfProgressHandler(ProgressHandler):
             self.update(progress)
         super(OutOfProgressHandler, self).write(string)
 
+_thread_state = threading.local()
+
+class AggregateProgressReporter(object):
+    """
+    Class which combines the progress of several operations running
+    concurrently in separate threads into a single progress value. Each
+    operation runs inside slot(); ProgressHandler objects used within
+    it report to this object instead of firing their own events.
+    """
+    def __init__(self, d, total):
+        self._data = d
+        self._total = max(total, 1)
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._lastprogress = 0
+        self._lastevent = 0
+        # Send an initial progress event so the bar gets shown
+        self._fire_progress(0)
+
+    def _fire_progress(self, taskprogress):
+        bb.event.fire(bb.build.TaskProgress(taskprogress), self._data)
+
+    def update(self, key, progress):
+        """
+        Update the progress of the operation identified by key. Negative
+        values (progress of unknown extent) count as no progress.
+        """
+        with self._lock:
+            self._progress[key] = min(max(progress, 0), 100)
+            overall = int(sum(self._progress.values()) / self._total)
+            ts = time.time()
+            if overall != self._lastprogress or self._lastevent + 1 < ts:
+                self._fire_progress(overall)
+                self._lastprogress = overall
+                self._lastevent = ts
+
+    class _Slot(object):
+        def __init__(self, reporter, key):
+            self._reporter = reporter
+            self._key = key
+
+        def __enter__(self):
+            _thread_state.slot = (self._reporter, self._key)
+            return self
+
+        def __exit__(self, *excinfo):
+            _thread_state.slot = None
+            self._reporter.update(self._key, 100)
+
+    def slot(self, key):
+        """
+        Return a context manager for running the operation identified by
+        key in the current thread. The operation counts as complete once
+        it exits.
+        """
+        return self._Slot(self, key)
+
 class MultiStageProgressReporter(object):
     """
     Class which allows reporting progress without the caller
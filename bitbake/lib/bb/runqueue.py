@@ -17,6 +17,7 @@ import errno
 import logging
 import re
 import bb
+import bb.framing
 from bb import msg, event
 from bb import monitordisk
 import subprocess
@@ -24,6 +25,10 @@ import pickle
 from multiprocessing import Process
 import shlex
 import pprint
+import collections
+import threading
+import heapq
+import time
 
 bblogger = logging.getLogger("BitBake")
 logger = logging.getLogger("BitBake.RunQueue")
@@ -129,71 +134,86 @@ class RunQueueScheduler(object):
         self.rqdata = rqdata
         self.numTasks = len(self.rqdata.runtaskentries)
 
-        self.prio_map = [self.rqdata.runtaskentries.keys()]
+        self.prio_map = list(self.rqdata.runtaskentries.keys())
 
+        # Buildable tasks are kept in a heap ordered by priority. Entries for
+        # tasks which are no longer buildable are dropped lazily when popped.
         self.buildable = set()
+        self.buildable_heap = []
+        # Buildable tasks which can't run until the scenequeue holdoffs change
+        self.parked_holdoff = []
+        # Buildable tasks waiting for a thread of their taskname to be free
+        self.parked_maxthread = {}
+
         self.skip_maxthread = {}
+        self.running_limited = set()
+        self.running_count = collections.Counter()
+
         self.stamps = {}
         for tid in self.rqdata.runtaskentries:
             (mc, fn, taskname, taskfn) = split_tid_mcfn(tid)
             self.stamps[tid] = bb.build.stampfile(taskname, self.rqdata.dataCaches[mc], taskfn, noextra=True)
-            if tid in self.rq.runq_buildable:
-                self.buildable.append(tid)
 
         self.rev_prio_map = None
 
+    def get_maxthreads(self, taskname):
+        if taskname not in self.skip_maxthread:
+            maxthreads = self.rq.cfgData.getVarFlag(taskname, "number_threads")
+            self.skip_maxthread[taskname] = int(maxthreads) if maxthreads else None
+        return self.skip_maxthread[taskname]
+
+    def get_rev_prio_map(self):
+        # Computed on first use since subclasses reorder prio_map after
+        # the base class constructor has run
+        if self.rev_prio_map is None:
+            self.rev_prio_map = {}
+            for prio, tid in enumerate(self.prio_map):
+                self.rev_prio_map[tid] = prio
+        return self.rev_prio_map
+
     def next_buildable_task(self):
         """
-        Return the id of the first task we find that is buildable
+        Return the id of the highest priority task we find that is buildable
         """
-        # Once tasks are running we don't need to worry about them again
-        self.buildable.difference_update(self.rq.runq_running)
-        buildable = set(self.buildable)
-        buildable.difference_update(self.rq.holdoff_tasks)
-        buildable.intersection_update(self.rq.tasks_covered | self.rq.tasks_notcovered)
-        if not buildable:
-            return None
+        holdoff = self.rq.holdoff_tasks
+        covered = self.rq.tasks_covered
+        notcovered = self.rq.tasks_notcovered
 
-        # Filter out tasks that have a max number of threads that have been exceeded
-        skip_buildable = {}
-        for running in self.rq.runq_running.difference(self.rq.runq_complete):
-            rtaskname = taskname_from_tid(running)
-            if rtaskname not in self.skip_maxthread:
-                self.skip_maxthread[rtaskname] = self.rq.cfgData.getVarFlag(rtaskname, "number_threads")
-            if not self.skip_maxthread[rtaskname]:
+        best = None
+        seen = set()
+        requeue = []
+        while self.buildable_heap:
+            entry = heapq.heappop(self.buildable_heap)
+            tid = entry[1]
+            if tid not in self.buildable or tid in seen:
                 continue
-            if rtaskname in skip_buildable:
-                skip_buildable[rtaskname] += 1
-            else:
-                skip_buildable[rtaskname] = 1
-
-        if len(buildable) == 1:
-            tid = buildable.pop()
-            taskname = taskname_from_tid(tid)
-            if taskname in skip_buildable and skip_buildable[taskname] >= int(self.skip_maxthread[taskname]):
-                return None
-            stamp = self.stamps[tid]
-            if stamp not in self.rq.build_stamps.values():
-                return tid
+            # Once tasks are running we don't need to worry about them again
+            if tid in self.rq.runq_running:
+                self.buildable.remove(tid)
+                continue
+            seen.add(tid)
 
-        if not self.rev_prio_map:
-            self.rev_prio_map = {}
-            for tid in self.rqdata.runtaskentries:
-                self.rev_prio_map[tid] = self.prio_map.index(tid)
+            if tid in holdoff or (tid not in covered and tid not in notcovered):
+                self.parked_holdoff.append(entry)
+                continue
 
-        best = None
-        bestprio = None
-        for tid in buildable:
+            # Filter out tasks that have a max number of threads that have been exceeded
             taskname = taskname_from_tid(tid)
-            if taskname in skip_buildable and skip_buildable[taskname] >= int(self.skip_maxthread[taskname]):
+            maxthreads = self.get_maxthreads(taskname)
+            if maxthreads and self.running_count[taskname] >= maxthreads:
+                self.parked_maxthread.setdefault(taskname, []).append(entry)
                 continue
-            prio = self.rev_prio_map[tid]
-            if bestprio is None or bestprio > prio:
-                stamp = self.stamps[tid]
-                if stamp in self.rq.build_stamps.values():
-                    continue
-                bestprio = prio
-                best = tid
+
+            requeue.append(entry)
+            if self.stamps[tid] in self.rq.build_stamps2:
+                continue
+
+            best = tid
+            break
+
+        # The chosen task stays buildable until the runqueue marks it running
+        for entry in requeue:
+            heapq.heappush(self.buildable_heap, entry)
 
         return best
 
@@ -205,11 +225,41 @@ class RunQueueScheduler(object):
             return self.next_buildable_task()
 
     def newbuildable(self, task):
+        if task in self.buildable:
+            return
         self.buildable.add(task)
+        heapq.heappush(self.buildable_heap, (self.get_rev_prio_map()[task], task))
 
     def removebuildable(self, task):
         self.buildable.remove(task)
 
+    def taskrunning(self, task):
+        """
+        Called when a task starts executing so the per taskname
+        number_threads limits can be tracked
+        """
+        taskname = taskname_from_tid(task)
+        if self.get_maxthreads(taskname):
+            self.running_limited.add(task)
+            self.running_count[taskname] += 1
+
+    def taskcomplete(self, task):
+        if task not in self.running_limited:
+            return
+        self.running_limited.remove(task)
+        taskname = taskname_from_tid(task)
+        self.running_count[taskname] -= 1
+        for entry in self.parked_maxthread.pop(taskname, []):
+            heapq.heappush(self.buildable_heap, entry)
+
+    def holdoffupdated(self):
+        """
+        Called when the scenequeue holdoff and covered task sets change
+        """
+        for entry in self.parked_holdoff:
+            heapq.heappush(self.buildable_heap, entry)
+        self.parked_holdoff = []
+
     def describe_task(self, taskid):
         result = 'ID %s' % taskid
         if self.rev_prio_map:
@@ -1163,25 +1213,32 @@ class RunQueueData:
 
         bb.parse.siggen.set_setscene_tasks(self.runq_setscene_tids)
 
-        # Iterate over the task list and call into the siggen code
+        # Iterate over the task list and call into the siggen code, one level
+        # of the dependency tree at a time so the unihashes for each level
+        # can be resolved in a single batch
         dealtwith = set()
         todeal = set(self.runtaskentries)
         while len(todeal) > 0:
-            for tid in todeal.copy():
+            ready = set()
+            for tid in todeal:
                 if len(self.runtaskentries[tid].depends - dealtwith) == 0:
-                    dealtwith.add(tid)
-                    todeal.remove(tid)
-                    self.prepare_task_hash(tid)
+                    ready.add(tid)
+            dealtwith |= ready
+            todeal -= ready
+            self.prepare_task_hashes(sorted(ready))
 
         bb.parse.siggen.writeout_file_checksum_cache()
 
         #self.dump_data()
         return len(self.runtaskentries)
 
-    def prepare_task_hash(self, tid):
-        bb.parse.siggen.prep_taskhash(tid, self.runtaskentries[tid].depends, self.dataCaches[mc_from_tid(tid)])
-        self.runtaskentries[tid].hash = bb.parse.siggen.get_taskhash(tid, self.runtaskentries[tid].depends, self.dataCaches[mc_from_tid(tid)])
-        self.runtaskentries[tid].unihash = bb.parse.siggen.get_unihash(tid)
+    def prepare_task_hashes(self, tids):
+        for tid in tids:
+            bb.parse.siggen.prep_taskhash(tid, self.runtaskentries[tid].depends, self.dataCaches[mc_from_tid(tid)])
+            self.runtaskentries[tid].hash = bb.parse.siggen.get_taskhash(tid, self.runtaskentries[tid].depends, self.dataCaches[mc_from_tid(tid)])
+        unihashes = bb.parse.siggen.get_unihashes(tids)
+        for tid in tids:
+            self.runtaskentries[tid].unihash = unihashes[tid]
 
     def dump_data(self):
         """
@@ -1199,6 +1256,144 @@ class RunQueueWorker():
         self.process = process
         self.pipe = pipe
 
+class StampIndex(object):
+    """
+    Index of the stamp files, filled with a single scandir() of a stamp
+    directory the first time a stamp in it is looked up. Validating the
+    stamps of a large task graph would otherwise take several access() and
+    stat() calls per dependency, which is slow on network filesystems.
+
+    The index doesn't notice stamps being written, so the directory of a
+    stamp has to be invalidated whenever it may have changed.
+    """
+    def __init__(self):
+        self.dirs = {}
+
+    def mtime(self, stampfile):
+        """
+        Return the modification time of a stamp file (as os.stat() would),
+        or None if it doesn't exist
+        """
+        (stampdir, name) = os.path.split(stampfile)
+        entries = self.dirs.get(stampdir)
+        if entries is None:
+            try:
+                entries = dict((entry.name, entry) for entry in os.scandir(stampdir))
+            except OSError:
+                entries = {}
+            self.dirs[stampdir] = entries
+        entry = entries.get(name)
+        if entry is None:
+            return None
+        try:
+            # The entry caches the result, so each stamp is only stat()ed once
+            return entry.stat()[stat.ST_MTIME]
+        except OSError:
+            return None
+
+    def invalidate(self, stampfile=None):
+        """
+        Forget the directory of the given stamp file, or everything if no
+        stamp file is given
+        """
+        if stampfile is None:
+            self.dirs = {}
+        else:
+            self.dirs.pop(os.path.dirname(stampfile), None)
+
+class SetscenePrefetcher(object):
+    """
+    Runs a prefetch function for upcoming setscene tasks in a pool of
+    threads, so the artefacts of those tasks can be downloaded while other
+    setscene tasks execute. Tasks are prefetched in the order they were
+    queued. A task which starts executing before its prefetch has begun is
+    dropped from the queue, the task then fetches for itself.
+
+    func is called as func(sq_data, d) for one task at a time, d being a
+    copy of the datastore private to the calling thread. The threads are
+    only started once the first task is queued.
+    """
+    def __init__(self, func, d, threads):
+        self.func = func
+        self.d = d
+        self.numthreads = threads
+        self.pending = collections.OrderedDict()
+        self.cond = threading.Condition()
+        self.threads = []
+        self.stopped = False
+        self.queued = 0
+        self.prefetched = 0
+
+    def queue(self, tid, sq_data):
+        with self.cond:
+            if self.stopped or tid in self.pending:
+                return
+            if not self.threads:
+                self.start()
+            self.pending[tid] = sq_data
+            self.queued += 1
+            self.cond.notify()
+
+    def cancel(self, tid):
+        """
+        Drop a task from the queue, if its prefetch hasn't begun yet
+        """
+        with self.cond:
+            self.pending.pop(tid, None)
+
+    def start(self):
+        for _ in range(self.numthreads):
+            # The fetchers change variables while they run and the copies
+            # must not be made while the main thread uses the datastore
+            thread = threading.Thread(target=self.run, args=(bb.data.createCopy(self.d),))
+            thread.daemon = True
+            bb.event.enable_threadlock()
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, d):
+        try:
+            while True:
+                with self.cond:
+                    while not self.pending and not self.stopped:
+                        self.cond.wait()
+                    if self.stopped:
+                        return
+                    (tid, sq_data) = self.pending.popitem(last=False)
+                    self.prefetched += 1
+                try:
+                    self.func(sq_data, d)
+                except Exception as e:
+                    # The setscene task fetches for itself if this failed
+                    logger.warning("Prefetching for setscene task %s failed: %s" % (tid, e))
+        finally:
+            bb.event.disable_threadlock()
+
+    def stop(self, timeout=None):
+        """
+        Drop the queued tasks and end the threads. Prefetches in progress
+        are waited for, for up to timeout seconds in total if a timeout is
+        given. Returns False if some of them were still running then.
+        """
+        with self.cond:
+            if not self.stopped:
+                self.stopped = True
+                self.pending.clear()
+                self.cond.notify_all()
+                if self.threads:
+                    logger.debug(1, "Prefetched %d of %d queued setscene tasks" % (self.prefetched, self.queued))
+        return self.join(timeout)
+
+    def join(self, timeout=None):
+        if timeout is not None:
+            end = time.time() + timeout
+        for thread in self.threads:
+            if timeout is None:
+                thread.join()
+            else:
+                thread.join(max(end - time.time(), 0))
+        return not any(thread.is_alive() for thread in self.threads)
+
 class RunQueue:
     def __init__(self, cooker, cfgData, dataCaches, taskData, targets):
 
@@ -1209,9 +1404,12 @@ class RunQueue:
         self.stamppolicy = cfgData.getVar("BB_STAMP_POLICY") or "perfile"
         self.hashvalidate = cfgData.getVar("BB_HASHCHECK_FUNCTION") or None
         self.depvalidate = cfgData.getVar("BB_SETSCENE_DEPVALID") or None
+        self.prefetchfunc = cfgData.getVar("BB_SETSCENE_PREFETCH_FUNCTION") or None
 
         self.state = runQueuePrepare
 
+        self.stampindex = StampIndex()
+
         # For disk space monitor
         # Invoked at regular time intervals via the bitbake heartbeat event
         # while the build is running. We generate a unique name for the handler
@@ -1298,6 +1496,11 @@ class RunQueue:
 
     def teardown_workers(self):
         self.teardown = True
+        if self.rqexe and self.rqexe.prefetcher:
+            # The fetchers must not write to the download directories once
+            # the build has ended, but a stalled download shouldn't hang it
+            if not self.rqexe.prefetcher.stop(timeout=10):
+                logger.warning("Setscene prefetches still running after 10s, leaving them to end on their own")
         for mc in self.worker:
             self._teardown_worker(self.worker[mc])
         self.worker = {}
@@ -1319,14 +1522,18 @@ class RunQueue:
             fds.append(self.fakeworker[mc].pipe.input)
         return fds
 
+    def invalidate_stamps(self, tid):
+        """
+        Drop the stamp directory of a task from the stamp index, after the
+        runqueue or a task wrote or removed stamps in it
+        """
+        (mc, fn, taskname, taskfn) = split_tid_mcfn(tid)
+        stamp = self.rqdata.dataCaches[mc].stamp[taskfn]
+        if stamp:
+            self.stampindex.invalidate(stamp)
+
     def check_stamp_task(self, tid, taskname = None, recurse = False, cache = None):
-        def get_timestamp(f):
-            try:
-                if not os.access(f, os.F_OK):
-                    return None
-                return os.stat(f)[stat.ST_MTIME]
-            except:
-                return None
+        get_timestamp = self.stampindex.mtime
 
         (mc, fn, tn, taskfn) = split_tid_mcfn(tid)
         if taskname is None:
@@ -1343,7 +1550,8 @@ class RunQueue:
         stampfile = bb.build.stampfile(taskname, self.rqdata.dataCaches[mc], taskfn)
 
         # If the stamp is missing, it's not current
-        if not os.access(stampfile, os.F_OK):
+        t1 = get_timestamp(stampfile)
+        if t1 is None:
             logger.debug(2, "Stampfile %s not available", stampfile)
             return False
         # If it's a 'nostamp' task, it's not current
@@ -1359,7 +1567,6 @@ class RunQueue:
             cache = {}
 
         iscurrent = True
-        t1 = get_timestamp(stampfile)
         for dep in self.rqdata.runtaskentries[tid].depends:
             if iscurrent:
                 (mc2, fn2, taskname2, taskfn2) = split_tid_mcfn(dep)
@@ -1392,19 +1599,22 @@ class RunQueue:
             cache[tid] = iscurrent
         return iscurrent
 
+    def build_sq_data(self, tids):
+        sq_data = {}
+        sq_data['hash'] = {}
+        sq_data['hashfn'] = {}
+        sq_data['unihash'] = {}
+        for tid in tids:
+            (mc, fn, taskname, taskfn) = split_tid_mcfn(tid)
+            sq_data['hash'][tid] = self.rqdata.runtaskentries[tid].hash
+            sq_data['hashfn'][tid] = self.rqdata.dataCaches[mc].hashfn[taskfn]
+            sq_data['unihash'][tid] = self.rqdata.runtaskentries[tid].unihash
+        return sq_data
+
     def validate_hashes(self, tocheck, data, currentcount=0, siginfo=False, summary=True):
         valid = set()
         if self.hashvalidate:
-            sq_data = {}
-            sq_data['hash'] = {}
-            sq_data['hashfn'] = {}
-            sq_data['unihash'] = {}
-            for tid in tocheck:
-                (mc, fn, taskname, taskfn) = split_tid_mcfn(tid)
-                sq_data['hash'][tid] = self.rqdata.runtaskentries[tid].hash
-                sq_data['hashfn'][tid] = self.rqdata.dataCaches[mc].hashfn[taskfn]
-                sq_data['unihash'][tid] = self.rqdata.runtaskentries[tid].unihash
-
+            sq_data = self.build_sq_data(tocheck)
             valid = self.validate_hash(sq_data, data, siginfo, currentcount, summary)
 
         return valid
@@ -1417,6 +1627,14 @@ class RunQueue:
 
         return bb.utils.better_eval(call, locs)
 
+    def prefetch_setscene(self, sq_data, d):
+        locs = {"sq_data" : sq_data, "d" : d}
+
+        # As with the hash validation, metadata has **kwargs so args can be added
+        call = self.prefetchfunc + "(sq_data, d)"
+
+        return bb.utils.better_eval(call, locs)
+
     def _execute_runqueue(self):
         """
         Run the tasks in a queue prepared by rqdata.prepare()
@@ -1700,6 +1918,10 @@ class RunQueueExecute:
         self.sq_running = set()
         self.sq_live = set()
 
+        self.prefetcher = None
+        # Buildable setscene tasks considered for prefetching so far
+        self.sq_prefetch_checked = set()
+
         self.updated_taskhash_queue = []
         self.pending_migrations = set()
 
@@ -1709,7 +1931,8 @@ class RunQueueExecute:
         self.runq_tasksrun = set()
 
         self.build_stamps = {}
-        self.build_stamps2 = []
+        # Reverse index of the stamps in build_stamps
+        self.build_stamps2 = set()
         self.failed_tids = []
         self.sq_deferred = {}
 
@@ -1754,15 +1977,26 @@ class RunQueueExecute:
             bb.fatal("Invalid scheduler '%s'.  Available schedulers: %s" %
                      (self.scheduler, ", ".join(obj.name for obj in schedulers)))
 
+        # Stamps may have changed since the runqueue was prepared
+        self.rq.stampindex.invalidate()
+
         #if len(self.rqdata.runq_setscene_tids) > 0:
         self.sqdata = SQData()
         build_scenequeue_data(self.sqdata, self.rqdata, self.rq, self.cooker, self.stampcache, self)
 
+        prefetchthreads = int(self.cfgData.getVar("BB_SETSCENE_PREFETCH_THREADS") or 0)
+        if self.rq.prefetchfunc and prefetchthreads > 0 and not self.cooker.configuration.dry_run \
+                and not self.cooker.configuration.skipsetscene:
+            self.prefetcher = SetscenePrefetcher(self.rq.prefetch_setscene, self.cooker.data, prefetchthreads)
+
     def runqueue_process_waitpid(self, task, status):
 
+        # The task wrote its stamps
+        self.rq.invalidate_stamps(task)
+
         # self.build_stamps[pid] may not exist when use shared work directory.
         if task in self.build_stamps:
-            self.build_stamps2.remove(self.build_stamps[task])
+            self.build_stamps2.discard(self.build_stamps[task])
             del self.build_stamps[task]
 
         if task in self.sq_live:
@@ -1836,6 +2070,30 @@ class RunQueueExecute:
         valid = bb.utils.better_eval(call, locs)
         return valid
 
+    def sq_prefetch_upcoming(self):
+        """
+        Queue the setscene tasks which became buildable since the last call
+        for prefetching, unless they are going to be skipped
+        """
+        if self.sq_buildable <= self.sq_prefetch_checked:
+            return
+
+        for tid in sorted(self.sq_buildable - self.sq_prefetch_checked):
+            self.sq_prefetch_checked.add(tid)
+            if tid in self.sq_running or tid in self.sqdata.outrightfail or tid in self.sq_deferred:
+                continue
+            # Tasks whose dependees are all covered are usually skipped,
+            # BB_SETSCENE_DEPVALID only decides that once they are up next
+            revdeps = self.sqdata.sq_revdeps[tid]
+            if tid not in self.sqdata.unskippable and revdeps and revdeps.issubset(self.scenequeue_covered):
+                continue
+            taskname = taskname_from_tid(tid)
+            if self.rq.check_stamp_task(tid, taskname + "_setscene", cache=self.stampcache):
+                continue
+            if self.rq.check_stamp_task(tid, taskname, recurse=True, cache=self.stampcache):
+                continue
+            self.prefetcher.queue(tid, self.rq.build_sq_data([tid]))
+
     def can_start_task(self):
         active = self.stats.active + self.sq_stats.active
         can_start = active < self.number_tasks
@@ -1874,6 +2132,7 @@ class RunQueueExecute:
         completed dependencies as buildable
         """
         self.runq_complete.add(task)
+        self.sched.taskcomplete(task)
         for revdep in self.rqdata.runtaskentries[task].revdeps:
             if revdep in self.runq_running:
                 continue
@@ -1966,11 +2225,14 @@ class RunQueueExecute:
             # Don't want to sort this set every execution
             self.sorted_setscene_tids = sorted(self.rqdata.runq_setscene_tids)
 
+        if self.prefetcher and not self.sqdone:
+            self.sq_prefetch_upcoming()
+
         task = None
         if not self.sqdone and self.can_start_task():
             # Find the next setscene to run
             for nexttask in self.sorted_setscene_tids:
-                if nexttask in self.sq_buildable and nexttask not in self.sq_running and self.sqdata.stamps[nexttask] not in self.build_stamps.values():
+                if nexttask in self.sq_buildable and nexttask not in self.sq_running and self.sqdata.stamps[nexttask] not in self.build_stamps2:
                     if nexttask not in self.sqdata.unskippable and len(self.sqdata.sq_revdeps[nexttask]) > 0 and self.sqdata.sq_revdeps[nexttask].issubset(self.scenequeue_covered) and self.check_dependencies(nexttask, self.sqdata.sq_revdeps[nexttask]):
                         if nexttask not in self.rqdata.target_tids:
                             logger.debug(2, "Skipping setscene for task %s" % nexttask)
@@ -2026,6 +2288,9 @@ class RunQueueExecute:
                 self.sq_task_failoutright(task)
                 return True
 
+            if self.prefetcher:
+                self.prefetcher.cancel(task)
+
             startevent = sceneQueueTaskStarted(task, self.sq_stats, self.rq)
             bb.event.fire(startevent, self.cfgData)
 
@@ -2044,7 +2309,7 @@ class RunQueueExecute:
                 self.rq.worker[mc].process.stdin.flush()
 
             self.build_stamps[task] = bb.build.stampfile(taskname, self.rqdata.dataCaches[mc], taskfn, noextra=True)
-            self.build_stamps2.append(self.build_stamps[task])
+            self.build_stamps2.add(self.build_stamps[task])
             self.sq_running.add(task)
             self.sq_live.add(task)
             self.sq_stats.taskActive()
@@ -2104,6 +2369,7 @@ class RunQueueExecute:
                 self.stats.taskActive()
                 if not (self.cooker.configuration.dry_run or self.rqdata.setscene_enforce):
                     bb.build.make_stamp(taskname, self.rqdata.dataCaches[mc], taskfn)
+                    self.rq.invalidate_stamps(task)
                 self.task_complete(task)
                 return True
             else:
@@ -2131,8 +2397,9 @@ class RunQueueExecute:
                 self.rq.worker[mc].process.stdin.flush()
 
             self.build_stamps[task] = bb.build.stampfile(taskname, self.rqdata.dataCaches[mc], taskfn, noextra=True)
-            self.build_stamps2.append(self.build_stamps[task])
+            self.build_stamps2.add(self.build_stamps[task])
             self.runq_running.add(task)
+            self.sched.taskrunning(task)
             self.stats.taskActive()
             if self.can_start_task():
                 return True
@@ -2247,6 +2514,7 @@ class RunQueueExecute:
                     self.holdoff_tasks.add(dep)
 
         self.holdoff_need_update = False
+        self.sched.holdoffupdated()
 
     def process_possible_migrations(self):
 
@@ -2368,6 +2636,10 @@ class RunQueueExecute:
                 self.sq_buildable.remove(tid)
             if tid in self.sq_running:
                 self.sq_running.remove(tid)
+            # The artefacts of the new hash need prefetching
+            self.sq_prefetch_checked.discard(tid)
+            if self.prefetcher:
+                self.prefetcher.cancel(tid)
             harddepfail = False
             for t in self.sqdata.sq_harddeps:
                 if tid in self.sqdata.sq_harddeps[t] and t in self.scenequeue_notcovered:
@@ -2393,8 +2665,10 @@ class RunQueueExecute:
 
             if tid in self.stampcache:
                 del self.stampcache[tid]
+            self.rq.invalidate_stamps(tid)
 
             if tid in self.build_stamps:
+                self.build_stamps2.discard(self.build_stamps[tid])
                 del self.build_stamps[tid]
 
             update_tasks.append((tid, harddepfail, tid in self.sqdata.valid))
@@ -2758,6 +3032,7 @@ def update_scenequeue_data(tids, sqdata, rqdata, rq, cooker, stampcache, sqrq, s
             sqdata.noexec.add(tid)
             sqrq.sq_task_skip(tid)
             bb.build.make_stamp(taskname + "_setscene", rqdata.dataCaches[mc], taskfn)
+            rq.invalidate_stamps(tid)
             continue
 
         if rq.check_stamp_task(tid, taskname + "_setscene", cache=stampcache):
@@ -2923,7 +3198,7 @@ class runQueuePipe():
         if pipeout:
             pipeout.close()
         bb.utils.nonblockingfd(self.input)
-        self.queue = b""
+        self.reader = bb.framing.FrameReader(self.input.fileno())
         self.d = d
         self.rq = rq
         self.rqexec = rqexec
@@ -2939,45 +3214,26 @@ class runQueuePipe():
                     bb.error("%s process (%s) exited unexpectedly (%s), shutting down..." % (name, worker.process.pid, str(worker.process.returncode)))
                     self.rq.finish_runqueue(True)
 
-        start = len(self.queue)
+        count = self.reader.read()
         try:
-            self.queue = self.queue + (self.input.read(102400) or b"")
-        except (OSError, IOError) as e:
-            if e.errno != errno.EAGAIN:
-                raise
-        end = len(self.queue)
-        found = True
-        while found and len(self.queue):
-            found = False
-            index = self.queue.find(b"</event>")
-            while index != -1 and self.queue.startswith(b"<event>"):
-                try:
-                    event = pickle.loads(self.queue[7:index])
-                except ValueError as e:
-                    bb.msg.fatal("RunQueue", "failed load pickle '%s': '%s'" % (e, self.queue[7:index]))
-                bb.event.fire_from_worker(event, self.d)
-                if isinstance(event, taskUniHashUpdate):
-                    self.rqexec.updated_taskhash_queue.append((event.taskid, event.unihash))
-                found = True
-                self.queue = self.queue[index+8:]
-                index = self.queue.find(b"</event>")
-            index = self.queue.find(b"</exitcode>")
-            while index != -1 and self.queue.startswith(b"<exitcode>"):
-                try:
-                    task, status = pickle.loads(self.queue[10:index])
-                except ValueError as e:
-                    bb.msg.fatal("RunQueue", "failed load pickle '%s': '%s'" % (e, self.queue[10:index]))
-                self.rqexec.runqueue_process_waitpid(task, status)
-                found = True
-                self.queue = self.queue[index+11:]
-                index = self.queue.find(b"</exitcode>")
-        return (end > start)
+            for (msgtype, obj) in self.reader.messages():
+                if msgtype == bb.framing.EXITCODE:
+                    task, status = obj
+                    self.rqexec.runqueue_process_waitpid(task, status)
+                else:
+                    bb.event.fire_from_worker(obj, self.d)
+                    if isinstance(obj, taskUniHashUpdate):
+                        self.rqexec.updated_taskhash_queue.append((obj.taskid, obj.unihash))
+        except bb.framing.FrameError as e:
+            bb.msg.fatal("RunQueue", str(e))
+        return bool(count)
 
     def close(self):
         while self.read():
             continue
-        if len(self.queue) > 0:
-            print("Warning, worker left partial message: %s" % self.queue)
+        if len(self.reader) > 0:
+            print("Warning, worker left partial message of %d bytes" % len(self.reader))
+        logger.debug(1, "Worker pipe received %s", self.reader.stats)
         self.input.close()
 
 def get_setscene_enforce_whitelist(d):
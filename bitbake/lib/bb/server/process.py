@@ -649,8 +649,11 @@ class ConnectionWriter(object):
 
     def send(self, obj):
         obj = multiprocessing.reduction.ForkingPickler.dumps(obj)
+        self.sendpickle(obj)
+
+    def sendpickle(self, data):
         with self.wlock:
-            self.writer.send_bytes(obj)
+            self.writer.send_bytes(data)
 
     def fileno(self):
         return self.writer.fileno()
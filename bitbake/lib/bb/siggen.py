@@ -57,6 +57,12 @@ class SignatureGenerator(object):
     def get_unihash(self, tid):
         return self.taskhash[tid]
 
+    def get_unihashes(self, tids):
+        """
+        Return a dict mapping each tid in tids to its unihash
+        """
+        return dict((tid, self.get_unihash(tid)) for tid in tids)
+
     def prep_taskhash(self, tid, deps, dataCache):
         return
 
@@ -463,19 +469,41 @@ class SignatureGeneratorUniHashMixIn(object):
         return unihash
 
     def get_unihash(self, tid):
-        taskhash = self.taskhash[tid]
+        return self.get_unihashes([tid])[tid]
 
-        # If its not a setscene task we can return
-        if self.setscenetasks and tid not in self.setscenetasks:
-            self.unihash[tid] = None
-            return taskhash
+    def get_unihashes(self, tids):
+        """
+        Return a dict mapping each tid in tids to its unihash. Any tids not
+        already known are looked up from the server in a single batch.
+        """
+        result = {}
+        query_tids = []
+        query = []
+        for tid in tids:
+            taskhash = self.taskhash[tid]
+
+            # If its not a setscene task we can return
+            if self.setscenetasks and tid not in self.setscenetasks:
+                self.unihash[tid] = None
+                result[tid] = taskhash
+                continue
 
-        # TODO: This cache can grow unbounded. It probably only needs to keep
-        # for each task
-        unihash =  self._get_unihash(tid)
-        if unihash is not None:
-            self.unihash[tid] = unihash
-            return unihash
+            # TODO: This cache can grow unbounded. It probably only needs to keep
+            # for each task
+            unihash =  self._get_unihash(tid)
+            if unihash is not None:
+                self.unihash[tid] = unihash
+                result[tid] = unihash
+                continue
+
+            method = self.method
+            if tid in self.extramethod:
+                method = method + self.extramethod[tid]
+            query_tids.append(tid)
+            query.append((method, taskhash))
+
+        if not query:
+            return result
 
         # In the absence of being able to discover a unique hash from the
         # server, make it be equivalent to the taskhash. The unique "hash" only
@@ -490,27 +518,29 @@ class SignatureGeneratorUniHashMixIn(object):
         #    independent builders find the same taskhash, but it isn't reported
         #    to the server, there is a better chance that they will agree on
         #    the unique hash.
-        unihash = taskhash
+        unihashes = [taskhash for (method, taskhash) in query]
 
         try:
-            method = self.method
-            if tid in self.extramethod:
-                method = method + self.extramethod[tid]
-            data = self.client().get_unihash(method, self.taskhash[tid])
-            if data:
-                unihash = data
-                # A unique hash equal to the taskhash is not very interesting,
-                # so it is reported it at debug level 2. If they differ, that
-                # is much more interesting, so it is reported at debug level 1
-                bb.debug((1, 2)[unihash == taskhash], 'Found unihash %s in place of %s for %s from %s' % (unihash, taskhash, tid, self.server))
-            else:
-                bb.debug(2, 'No reported unihash for %s:%s from %s' % (tid, taskhash, self.server))
+            data = self.client().get_unihash_batch(query)
+            for i, tid in enumerate(query_tids):
+                taskhash = query[i][1]
+                if data[i]:
+                    unihashes[i] = data[i]
+                    # A unique hash equal to the taskhash is not very interesting,
+                    # so it is reported it at debug level 2. If they differ, that
+                    # is much more interesting, so it is reported at debug level 1
+                    bb.debug((1, 2)[data[i] == taskhash], 'Found unihash %s in place of %s for %s from %s' % (data[i], taskhash, tid, self.server))
+                else:
+                    bb.debug(2, 'No reported unihash for %s:%s from %s' % (tid, taskhash, self.server))
         except hashserv.client.HashConnectionError as e:
             bb.warn('Error contacting Hash Equivalence Server %s: %s' % (self.server, str(e)))
 
-        self.set_unihash(tid, unihash)
-        self.unihash[tid] = unihash
-        return unihash
+        for tid, unihash in zip(query_tids, unihashes):
+            self.set_unihash(tid, unihash)
+            self.unihash[tid] = unihash
+            result[tid] = unihash
+
+        return result
 
     def report_unihash(self, path, task, d):
         import importlib
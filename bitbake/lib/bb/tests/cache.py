@@ -0,0 +1,206 @@
+#
+# BitBake Tests for cache.py
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import unittest
+import os
+import pickle
+import tempfile
+import time
+import bb
+import bb.cache
+import bb.data
+import bb.parse
+
+class TestRecipeInfo(bb.cache.RecipeInfoCommon):
+    cachefile = "bb_test_cache.dat"
+
+    def __init__(self, filename, timestamp, size=0):
+        self.timestamp = timestamp
+        self.file_depends = []
+        self.variants = ['']
+        self.appends = []
+        self.skipped = False
+        self.vars = dict(("VAR%d" % i, "%s value %d" % (filename, i)) for i in range(size))
+
+    @classmethod
+    def init_cacheData(cls, cachedata):
+        pass
+
+class FakeDataBuilder(object):
+    def __init__(self, d):
+        self.data = d
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.d = bb.data.init()
+        self.d.setVar("CACHE", os.path.join(self.tempdir.name, "cache"))
+        self.databuilder = FakeDataBuilder(self.d)
+        bb.parse.clear_cache()
+
+    def new_cache(self):
+        return bb.cache.Cache(self.databuilder, "hash", [TestRecipeInfo])
+
+    def create_recipes(self, count, size=0):
+        recipes = {}
+        for i in range(count):
+            fn = os.path.join(self.tempdir.name, "recipe%d.bb" % i)
+            with open(fn, "w"):
+                pass
+            recipes[fn] = TestRecipeInfo(fn, bb.parse.cached_mtime_noerror(fn), size)
+        return recipes
+
+    def write_cache(self, recipes):
+        cache = self.new_cache()
+        for fn, info in recipes.items():
+            cache.depends_cache[fn] = [info]
+        cache.cacheclean = False
+        cache.sync()
+
+    def test_lazy_load(self):
+        recipes = self.create_recipes(10)
+        self.write_cache(recipes)
+
+        cache = self.new_cache()
+        depends_cache = cache.depends_cache
+        self.assertEqual(len(depends_cache), 10)
+        self.assertEqual(depends_cache.entries, {})
+
+        fn = sorted(recipes)[3]
+        self.assertTrue(cache.cacheValid(fn, []))
+        self.assertEqual(list(depends_cache.entries), [fn])
+        self.assertEqual(depends_cache[fn][0].timestamp, recipes[fn].timestamp)
+
+    def test_sync_keeps_unloaded_entries(self):
+        recipes = self.create_recipes(10)
+        self.write_cache(recipes)
+
+        # Change one recipe, leaving the others untouched in the old file
+        cache = self.new_cache()
+        fn = sorted(recipes)[0]
+        cache.remove(fn)
+        del recipes[fn]
+        changed = sorted(recipes)[0]
+        info = TestRecipeInfo(changed, recipes[changed].timestamp, 3)
+        cache.depends_cache[changed] = [info]
+        cache.cacheclean = False
+        cache.sync()
+
+        cache = self.new_cache()
+        self.assertEqual(set(cache.depends_cache.keys()), set(recipes))
+        for fn in recipes:
+            self.assertTrue(cache.cacheValid(fn, []))
+        self.assertEqual(cache.depends_cache[changed][0].vars, info.vars)
+
+    def test_sync_appends_changed_entries(self):
+        recipes = self.create_recipes(100, size=20)
+        self.write_cache(recipes)
+        cachefile = bb.cache.getCacheFile(self.d.getVar("CACHE"), TestRecipeInfo.cachefile, "hash")
+        oldstat = os.stat(cachefile)
+
+        # Cached entries are added back as they are while parsing
+        cache = self.new_cache()
+        for fn in recipes:
+            self.assertTrue(cache.cacheValid(fn, []))
+            cache.depends_cache[fn] = cache.depends_cache[fn]
+        changed = sorted(recipes)[0]
+        info = TestRecipeInfo(changed, recipes[changed].timestamp, 21)
+        cache.depends_cache[changed] = [info]
+        cache.cacheclean = False
+        cache.sync()
+
+        newstat = os.stat(cachefile)
+        self.assertEqual(newstat.st_ino, oldstat.st_ino)
+        self.assertLess(newstat.st_size - oldstat.st_size, oldstat.st_size / 10)
+
+        cache = self.new_cache()
+        for fn in recipes:
+            self.assertTrue(cache.cacheValid(fn, []))
+        self.assertEqual(cache.depends_cache[changed][0].vars, info.vars)
+
+    def test_sync_compacts(self):
+        recipes = self.create_recipes(10, size=20)
+        self.write_cache(recipes)
+        cachefile = bb.cache.getCacheFile(self.d.getVar("CACHE"), TestRecipeInfo.cachefile, "hash")
+        size = os.stat(cachefile).st_size
+
+        for i in range(5):
+            cache = self.new_cache()
+            for fn in sorted(recipes)[:4]:
+                cache.depends_cache[fn] = [TestRecipeInfo(fn, recipes[fn].timestamp, 20)]
+            cache.cacheclean = False
+            cache.sync()
+            self.assertLess(os.stat(cachefile).st_size, size * 2.1)
+
+        cache = self.new_cache()
+        self.assertEqual(set(cache.depends_cache.keys()), set(recipes))
+
+    def test_invalid_cache(self):
+        cache = self.new_cache()
+        cachefile = bb.cache.getCacheFile(cache.cachedir, TestRecipeInfo.cachefile, "hash")
+        with open(cachefile, "wb") as f:
+            pickle.dump(bb.cache.__cache_version__, f)
+            pickle.dump(bb.__version__, f)
+
+        cache = self.new_cache()
+        self.assertEqual(len(cache.depends_cache), 0)
+
+    def test_many_recipes(self):
+        recipes = self.create_recipes(2000, size=20)
+        keys = sorted(recipes)
+        self.write_cache(recipes)
+
+        cache = self.new_cache()
+        for key in keys:
+            self.assertTrue(cache.cacheValid(key, []))
+            self.assertEqual(cache.depends_cache[key][0].vars, recipes[key].vars)
+        self.assertEqual(len(cache.depends_cache.entries), len(keys))
+
+    @unittest.skipUnless(os.environ.get("BB_RUN_BENCHMARKS") == "yes", "benchmark")
+    def test_benchmark_10k_recipes(self):
+        recipes = self.create_recipes(10000, size=20)
+        keys = sorted(recipes)
+
+        # Previous format, a stream of (key, value) pickles which had to be
+        # loaded completely before the first lookup
+        oldfile = os.path.join(self.tempdir.name, "old_cache.dat")
+        with open(oldfile, "wb") as f:
+            p = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            p.dump(bb.cache.__cache_version__)
+            p.dump(bb.__version__)
+            for key in keys:
+                p.dump(key)
+                p.dump([recipes[key]])
+
+        start = time.perf_counter()
+        with open(oldfile, "rb") as f:
+            pickled = pickle.Unpickler(f)
+            pickled.load()
+            pickled.load()
+            depends_cache = {}
+            while True:
+                try:
+                    key = pickled.load()
+                    value = pickled.load()
+                except EOFError:
+                    break
+                depends_cache[key] = value
+        old_load = time.perf_counter() - start
+
+        self.write_cache(recipes)
+
+        start = time.perf_counter()
+        cache = self.new_cache()
+        cache.cacheValid(keys[0], [])
+        new_startup = time.perf_counter() - start
+        for key in keys:
+            cache.cacheValid(key, [])
+        new_all = time.perf_counter() - start
+
+        print("\nCache of %d recipes: old format %.3fs to load, indexed format "
+              "%.3fs until the first lookup, %.3fs with every recipe checked"
+              % (len(keys), old_load, new_startup, new_all))
@@ -9,6 +9,10 @@ import os
 import bb, bb.cooker
 import re
 import logging
+import multiprocessing
+import queue
+import tempfile
+import time
 
 # Cooker tests
 class CookerTest(unittest.TestCase):
@@ -67,3 +71,56 @@ class CookerTest(unittest.TestCase):
         expected = []
 
         self.assertEqual(log_handler.logdata, expected)
+
+    def test_order_by_parse_cost(self):
+        with tempfile.TemporaryDirectory(prefix="bitbake-cooker-") as tempdir:
+            small = os.path.join(tempdir, "small.bb")
+            large = os.path.join(tempdir, "large.bb")
+            with open(small, "w") as f:
+                f.write("A = '1'\n")
+            with open(large, "w") as f:
+                f.write("A = '1'\n" * 100)
+
+            jobs = [("fast.bb", []), (small, []), ("slow.bb", []), (large, [])]
+            parsetimes = {"fast.bb": 0.1, "slow.bb": 5.0}
+            ordered = [fn for fn, _ in bb.cooker.order_by_parse_cost(jobs, parsetimes)]
+
+            # Recipes with no history come first, then slowest first
+            self.assertEqual(ordered, [large, small, "slow.bb", "fast.bb"])
+
+    def test_parser_shares_jobs(self):
+        class SlowCache(object):
+            def parse(self, filename, appends):
+                if filename == "slow.bb":
+                    time.sleep(1)
+                return [(filename, [])]
+
+        jobs = [("slow.bb", [])] + [("recipe%d.bb" % i, []) for i in range(20)]
+        next_job = multiprocessing.Value('i', 0)
+        results = multiprocessing.Queue()
+        quit = multiprocessing.Queue()
+
+        d = self.d
+        def init():
+            bb.cooker.Parser.bb_cache = SlowCache()
+            bb.parse.siggen = bb.siggen.SignatureGenerator(d)
+
+        parsers = [bb.cooker.Parser(jobs, next_job, results, quit, init, False) for _ in range(2)]
+        for parser in parsers:
+            parser.start()
+
+        parsed = {}
+        while len(parsed) < len(jobs):
+            try:
+                result = results.get(timeout=10)
+            except queue.Empty:
+                break
+            parsed[result[2]] = result[1]
+
+        for parser in parsers:
+            parser.join()
+
+        # Every job is parsed exactly once, the second parser picking up
+        # everything left while the first is busy with the slow recipe
+        self.assertEqual(sorted(parsed), sorted(fn for fn, _ in jobs))
+        self.assertEqual(parsed["recipe3.bb"], [("recipe3.bb", [])])
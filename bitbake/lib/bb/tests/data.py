@@ -143,6 +143,33 @@ class DataExpansions(unittest.TestCase):
         keys = list(newd.keys())
         self.assertCountEqual(keys, ['value_of_foo', 'foo'])
 
+class TestExpansionTemplate(unittest.TestCase):
+    def setUp(self):
+        self.d = bb.data.init()
+        self.d["foo"] = "value_of_foo"
+        self.d["dollar"] = "$"
+        self.d["brace"] = "{@'joined'}"
+
+    def test_segments(self):
+        template = bb.data_smart.expansion_template("a ${foo} ${@5*12} b")
+        self.assertEqual([text for (kind, text) in template], ["a ", "foo", " ", "5*12", " b"])
+
+    def test_reference_in_python(self):
+        # Can't be split up, the reference is expanded before the code is
+        # evaluated
+        self.assertIsNone(bb.data_smart.expansion_template("${@'${foo}'}"))
+        self.assertEqual(self.d.expand("${@'${foo}'}"), "value_of_foo")
+
+    def test_joined_expression(self):
+        # The expression only appears once the references are expanded
+        val = self.d.expand("${dollar}${brace} ${@'x'}")
+        self.assertEqual(val, "joined x")
+
+    def test_refs(self):
+        self.d.setVar("FOO", "${foo} ${@d.getVar('bar')} ${undefined}")
+        refs = self.d.expandWithRefs(self.d.getVar("FOO", False), "FOO").references
+        self.assertEqual(refs, set(["foo", "bar", "undefined"]))
+
 class TestNestedExpansions(unittest.TestCase):
     def setUp(self):
         self.d = bb.data.init()
@@ -12,6 +12,7 @@ import logging
 import bb.compat
 import bb.event
 import importlib
+import os
 import threading
 import time
 import pickle
@@ -375,6 +376,115 @@ class EventHandlingTest(unittest.TestCase):
         self.assertEqual(self._test_ui1.event.send.call_args_list,
                          expected)
 
+    def test_fire_ui_handlers_pickle_once(self):
+        """ Test events are only pickled once for all UI handlers """
+        self._test_ui1.event = Mock(spec_set=PickleEventQueueStub)
+        bb.event.register_UIHhandler(self._test_ui1, mainui=True)
+        self._test_ui2.event = Mock(spec_set=PickleEventQueueStub)
+        bb.event.register_UIHhandler(self._test_ui2, mainui=True)
+        event1 = bb.event.OperationStarted()
+        bb.event.fire_ui_handlers(event1, None)
+        (pickled1,), _ = self._test_ui1.event.sendpickle.call_args
+        (pickled2,), _ = self._test_ui2.event.sendpickle.call_args
+        self.assertIs(pickled1, pickled2)
+        self.assertEqual(pickled1, pickle.dumps(event1))
+
+    def test_class_handler_table(self):
+        """ Test class handlers follow changes to the registered handlers """
+        saved_handlers = bb.event.get_handlers().copy()
+        bb.event.register("event_handler1",
+                          self._test_process.event_handler1,
+                          ["bb.event.OperationStarted"])
+        bb.event.register("event_handler2",
+                          self._test_process.event_handler2)
+        event1 = bb.event.OperationStarted()
+        event2 = bb.event.OperationCompleted(total=123)
+        bb.event.fire_class_handlers(event1, None)
+        bb.event.fire_class_handlers(event2, None)
+        self.assertEqual(self._test_process.method_calls,
+                         [call.event_handler1(event1),
+                          call.event_handler2(event1),
+                          call.event_handler2(event2)])
+
+        # Restoring the handlers, as done after parsing a recipe
+        bb.event.set_handlers(saved_handlers)
+        bb.event.fire_class_handlers(event1, None)
+        bb.event.fire_class_handlers(event2, None)
+        self.assertEqual(len(self._test_process.method_calls), 3)
+
+    def register_many_handlers(self, calls):
+        """ Register class handlers recording their calls in calls, and two
+        UI handlers counting the events they get """
+        class CountingQueue(object):
+            def __init__(self):
+                self.count = 0
+            def sendpickle(self, pickled_event):
+                self.count += 1
+
+        # Handlers for events other than the ones fired, and a few for all
+        # events, as with the handlers of OE's classes
+        for i in range(50):
+            bb.event.register("handler%d" % i, lambda e, i=i: calls.append(("handler%d" % i, e)), ["bb.event.OperationCompleted"])
+        for i in range(3):
+            bb.event.register("catchall%d" % i, lambda e, i=i: calls.append(("catchall%d" % i, e)))
+        queues = []
+        for i in range(2):
+            ui = UIClientStub()
+            ui.event = CountingQueue()
+            bb.event.register_UIHhandler(ui, mainui=True)
+            queues.append(ui.event)
+        return queues
+
+    def test_fire_many_handlers(self):
+        """ Test events only reach the class handlers registered for them """
+        count = 100
+        calls = []
+        queues = self.register_many_handlers(calls)
+        events = [bb.event.OperationProgress(i, count) for i in range(count)]
+
+        for event in events:
+            bb.event.fire(event, None)
+
+        self.assertEqual(calls, [("catchall%d" % i, e) for e in events for i in range(3)])
+        for queue in queues:
+            self.assertEqual(queue.count, count)
+
+    @unittest.skipUnless(os.environ.get("BB_RUN_BENCHMARKS") == "yes", "benchmark")
+    def test_benchmark_fire(self):
+        """ Measure the rate events are fired at to class and UI handlers """
+        count = 20000
+        calls = []
+        queues = self.register_many_handlers(calls)
+        events = [bb.event.OperationProgress(i, count) for i in range(count)]
+
+        def fire_unindexed(event, d):
+            # Matching every registered handler and pickling the event for
+            # every UI, as done before the handler table was added
+            eid = str(event.__class__)[8:-2]
+            evt_hmap = bb.event._event_handler_map.get(eid, {})
+            for name, handler in list(bb.event._handlers.items()):
+                if name in bb.event._catchall_handlers or name in evt_hmap:
+                    bb.event.execute_handler(name, handler, event, d)
+            for h in bb.event._ui_handlers:
+                if bb.event._ui_logfilters[h].filter(event):
+                    bb.event._ui_handlers[h].event.sendpickle(pickle.dumps(event))
+
+        start = time.time()
+        for event in events:
+            fire_unindexed(event, None)
+        unindexed = time.time() - start
+
+        start = time.time()
+        for event in events:
+            bb.event.fire(event, None)
+        indexed = time.time() - start
+
+        self.assertEqual(len(calls), 2 * 3 * count)
+        for queue in queues:
+            self.assertEqual(queue.count, 2 * count)
+        print("\nFired %d events to %d class and %d UI handlers: %.0f/s before, %.0f/s now"
+              % (count, len(bb.event.get_handlers()), len(queues), count / unindexed, count / indexed))
+
     def test_worker_fire(self):
         """ Test the triggering of bb.event.worker_fire callback """
         bb.event.worker_fire = Mock()
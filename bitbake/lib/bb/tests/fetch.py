@@ -11,6 +11,8 @@ import hashlib
 import tempfile
 import collections
 import os
+import threading
+import time
 from bb.fetch2 import URI
 from bb.fetch2 import FetchMethod
 import bb
@@ -1260,6 +1262,112 @@ class FetchLatestVersionTest(FetcherTest):
             server.stop()
 
 
+class FetchConcurrentTest(FetcherTest):
+    def setUp(self):
+        super(FetchConcurrentTest, self).setUp()
+        self.srcdir = os.path.join(self.tempdir, "http")
+        os.mkdir(self.srcdir)
+        self.checksums = {}
+        for i in range(8):
+            name = "file%d.txt" % i
+            data = ("contents of %s\n" % name).encode("utf-8") * 1000
+            with open(os.path.join(self.srcdir, name), "wb") as f:
+                f.write(data)
+            self.checksums[name] = hashlib.sha256(data).hexdigest()
+
+        self.server = HTTPService(self.srcdir)
+        self.server.start()
+        self.d.setVar("BB_FETCH_THREADS", "4")
+        self.d.setVar("BB_FETCH_HOST_CONNECTIONS", "2")
+
+    def tearDown(self):
+        self.server.stop()
+        super(FetchConcurrentTest, self).tearDown()
+
+    def get_urls(self, badchecksum=None):
+        urls = []
+        for name in sorted(self.checksums):
+            checksum = self.checksums[name]
+            if name == badchecksum:
+                checksum = "0" * 64
+            urls.append("http://localhost:%s/%s;sha256sum=%s" % (self.server.port, name, checksum))
+        return urls
+
+    def test_concurrent_download(self):
+        urls = self.get_urls()
+        fetcher = bb.fetch2.Fetch(urls, self.d)
+
+        # Count how many urls are being fetched from the host at once
+        lock = threading.Lock()
+        active = [0]
+        maxactive = [0]
+        orig_download_url = fetcher._download_url
+        def download_url(u, d, network, premirroronly):
+            with lock:
+                active[0] += 1
+                maxactive[0] = max(maxactive[0], active[0])
+            time.sleep(0.1)
+            try:
+                return orig_download_url(u, d, network, premirroronly)
+            finally:
+                with lock:
+                    active[0] -= 1
+        fetcher._download_url = download_url
+
+        fetcher.download()
+        self.assertEqual(maxactive[0], 2)
+        for name in self.checksums:
+            with open(os.path.join(self.dldir, name), "rb") as f:
+                self.assertEqual(hashlib.sha256(f.read()).hexdigest(), self.checksums[name])
+            self.assertTrue(os.path.exists(os.path.join(self.dldir, name + ".done")))
+
+        # The donestamps mean nothing is downloaded again
+        self.server.stop()
+        fetcher = bb.fetch2.Fetch(urls, self.d)
+        fetcher.download()
+
+    def test_concurrent_download_hosts(self):
+        # Most of the urls are from one host. Those waiting for it must not
+        # keep the threads from fetching the urls of the other host.
+        urls = self.get_urls()
+        urls[-2:] = [u.replace("localhost", "127.0.0.1") for u in urls[-2:]]
+        fetcher = bb.fetch2.Fetch(urls, self.d)
+
+        lock = threading.Lock()
+        started = []
+        orig_download_url = fetcher._download_url
+        def download_url(u, d, network, premirroronly):
+            with lock:
+                started.append(u)
+            time.sleep(0.1)
+            return orig_download_url(u, d, network, premirroronly)
+        fetcher._download_url = download_url
+
+        fetcher.download()
+        self.assertEqual(sorted(started), sorted(urls))
+        self.assertEqual(sorted(started[:4]), sorted(urls[:2] + urls[-2:]))
+
+    def test_concurrent_download_checksum_error(self):
+        urls = self.get_urls(badchecksum="file3.txt")
+        fetcher = bb.fetch2.Fetch(urls, self.d)
+        with self.assertRaises(bb.fetch2.FetchError):
+            fetcher.download()
+        self.assertFalse(os.path.exists(os.path.join(self.dldir, "file3.txt.done")))
+
+    def test_concurrent_download_progress(self):
+        events = []
+        def progress_handler(event):
+            events.append(event.progress)
+        bb.event.register("progress_handler", progress_handler, ["bb.build.TaskProgress"])
+        try:
+            fetcher = bb.fetch2.Fetch(self.get_urls(), self.d)
+            fetcher.download()
+        finally:
+            bb.event.remove("progress_handler", progress_handler)
+        self.assertEqual(events[0], 0)
+        self.assertEqual(events[-1], 100)
+        self.assertEqual(events, sorted(events))
+
 class FetchCheckStatusTest(FetcherTest):
     test_wget_uris = ["http://www.cups.org/software/1.7.2/cups-1.7.2-source.tar.bz2",
                       "http://www.cups.org/",
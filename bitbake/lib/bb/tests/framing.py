@@ -0,0 +1,132 @@
+#
+# BitBake Tests for framing.py
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import unittest
+import os
+import pickle
+import bb.framing
+import bb.utils
+
+class ChunkedInput(object):
+    """
+    Hands out data in chunks of the given size, like a pipe would
+    """
+    def __init__(self, data, chunksize):
+        self.data = data
+        self.pos = 0
+        self.chunksize = chunksize
+
+    def readinto(self, view):
+        if self.pos == len(self.data):
+            raise BlockingIOError()
+        count = min(self.chunksize, len(view), len(self.data) - self.pos)
+        view[:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+class FramingTest(unittest.TestCase):
+
+    def make_messages(self, count):
+        messages = []
+        for i in range(count):
+            if i % 10 == 9:
+                messages.append((bb.framing.EXITCODE, ("task%d" % i, i % 3)))
+            else:
+                messages.append((bb.framing.EVENT, {"msg": "Log message %d" % i, "args": list(range(i % 50))}))
+        return messages
+
+    def encode(self, messages):
+        return b"".join(bb.framing.frame(msgtype, pickle.dumps(obj)) for (msgtype, obj) in messages)
+
+    def read_all(self, reader):
+        received = []
+        while reader.read():
+            received.extend(reader.messages())
+        return received
+
+    def test_chunks(self):
+        messages = self.make_messages(200)
+        data = self.encode(messages)
+        for chunksize in (1, 7, 4096, len(data)):
+            reader = bb.framing.FrameReader(readinto=ChunkedInput(data, chunksize).readinto, size=1024)
+            self.assertEqual(self.read_all(reader), messages)
+            self.assertEqual(len(reader), 0)
+            self.assertEqual(reader.stats.messages, 200)
+            self.assertEqual(reader.stats.bytes, len(data))
+
+    def test_large_frame(self):
+        messages = [(bb.framing.EVENT, "x" * 3000000), (bb.framing.EVENT, "small")]
+        reader = bb.framing.FrameReader(readinto=ChunkedInput(self.encode(messages), 65536).readinto)
+        self.assertEqual(self.read_all(reader), messages)
+
+    def test_frames(self):
+        messages = self.make_messages(20)
+        data = self.encode(messages)
+        reader = bb.framing.FrameReader(readinto=ChunkedInput(data, 100).readinto)
+        frames = []
+        while reader.read():
+            frames.extend(reader.frames())
+        self.assertEqual(b"".join(frame for (msgtype, frame) in frames), data)
+        self.assertEqual([msgtype for (msgtype, frame) in frames], [msgtype for (msgtype, obj) in messages])
+
+    def test_partial(self):
+        data = self.encode(self.make_messages(3))
+        reader = bb.framing.FrameReader(readinto=ChunkedInput(data[:-5], len(data)).readinto)
+        self.assertEqual(len(self.read_all(reader)), 2)
+        self.assertGreater(len(reader), 0)
+
+    def test_nested_read(self):
+        # The runqueue can end up reading the pipe again while handling
+        # a message
+        messages = self.make_messages(500)
+        reader = bb.framing.FrameReader(readinto=ChunkedInput(self.encode(messages), 3000).readinto, size=4096)
+        received = []
+        def handle():
+            for msg in reader.messages():
+                received.append(msg)
+                if len(received) % 7 == 0:
+                    reader.read()
+                    handle()
+        while reader.read():
+            handle()
+        self.assertEqual(received, messages)
+
+    def test_pipe(self):
+        messages = self.make_messages(2000)
+        (rfd, wfd) = os.pipe()
+        try:
+            bb.utils.nonblockingfd(rfd)
+            bb.utils.nonblockingfd(wfd)
+            writer = bb.framing.FrameWriter(wfd)
+            reader = bb.framing.FrameReader(rfd)
+            for (msgtype, obj) in messages:
+                writer.append(bb.framing.frame(msgtype, pickle.dumps(obj)))
+            received = []
+            while len(writer):
+                try:
+                    writer.write()
+                except BlockingIOError:
+                    pass
+                while reader.read():
+                    received.extend(reader.messages())
+            self.assertEqual(received, messages)
+            self.assertEqual(writer.stats.messages, reader.stats.messages)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+
+    def read_events(self, events):
+        data = b"".join(bb.framing.event_frame(e) for e in events)
+        reader = bb.framing.FrameReader(readinto=ChunkedInput(data, 102400).readinto)
+        self.assertEqual(self.read_all(reader), [(bb.framing.EVENT, e) for e in events])
+        self.assertEqual(reader.stats.bytes, len(data))
+
+    def test_events(self):
+        # A burst of log events from parallel tasks, read in the 100KiB
+        # chunks the runqueue reads
+        self.read_events([{"msg": "NOTE: recipe%d: task do_compile: %s" % (i, "x" * 300), "levelno": 20} for i in range(10000)])
+        # A single large event, such as a task log sent on failure
+        self.read_events([{"msg": "x" * (8 * 1024 * 1024)}])
@@ -9,9 +9,15 @@
 import unittest
 import os
 import tempfile
+import threading
 import subprocess
 import sys
 import time
+import bb
+import bb.data
+import bb.parse
+import bb.runqueue
+import bb.siggen
 
 #
 # TODO:
@@ -95,6 +101,24 @@ class RunQueueTests(unittest.TestCase):
                         'a1:package_qa_setscene', 'a1:build', 'a1:populate_sysroot_setscene']
             self.assertEqual(set(tasks), set(expected))
 
+    def test_setscene_prefetch(self):
+        with tempfile.TemporaryDirectory(prefix="runqueuetest") as tempdir:
+            cmd = ["bitbake", "b1"]
+            sstatevalid = self.a1_sstatevalid + " " + self.b1_sstatevalid
+            # Six setscene tasks are buildable at first and four of them
+            # start straight away. Those are held until the prefetches of
+            # the other two have begun, so those can't start first.
+            waitfor = ['b1:package_write_rpm_setscene', 'b1:populate_sysroot_setscene']
+            extraenv = {"BB_SETSCENE_PREFETCH_THREADS" : "2", "PREFETCHWAIT" : " ".join(waitfor)}
+            tasks = self.run_bitbakecmd(cmd, tempdir, sstatevalid, extraenv=extraenv)
+            with open(tempdir + "/prefetch.log", "r") as f:
+                prefetched = [line.rstrip() for line in f]
+            # Only setscene tasks which then ran are prefetched, each once
+            setscene = [t for t in tasks if t.endswith("_setscene")]
+            self.assertEqual(len(prefetched), len(set(prefetched)))
+            self.assertTrue(set(prefetched).issubset(setscene))
+            self.assertTrue(set(prefetched).issuperset(waitfor))
+
     def test_no_settasks(self):
         with tempfile.TemporaryDirectory(prefix="runqueuetest") as tempdir:
             cmd = ["bitbake", "a1", "-c", "patch"]
@@ -232,6 +256,21 @@ class RunQueueTests(unittest.TestCase):
                 expected.remove(x)
             self.assertEqual(set(tasks), set(expected))
 
+    def test_worker_recipe_cache(self):
+        # Without recipe processes, and with recipe processes being ended
+        # and restarted all the time
+        expected = ['a1:' + x for x in self.alltasks] + ['b1:' + x for x in self.alltasks]
+        expected.remove('a1:build')
+        expected.remove('a1:package_qa')
+        for size in ("0", "1"):
+            with tempfile.TemporaryDirectory(prefix="runqueuetest") as tempdir:
+                extraenv = {
+                    "BB_WORKER_RECIPE_CACHE" : size
+                }
+                cmd = ["bitbake", "b1"]
+                tasks = self.run_bitbakecmd(cmd, tempdir, extraenv=extraenv)
+                self.assertEqual(set(tasks), set(expected))
+
 
     @unittest.skipIf(sys.version_info < (3, 5, 0), 'Python 3.5 or later required')
     def test_hashserv_single(self):
@@ -320,3 +359,336 @@ class RunQueueTests(unittest.TestCase):
             time.sleep(0.5)
 
 
+
+class FakeRunQueueData(object):
+    def __init__(self, tasks, stampdir):
+        self.runtaskentries = {}
+        for tid, deps in tasks:
+            entry = bb.runqueue.RunTaskEntry()
+            entry.depends = set(deps)
+            self.runtaskentries[tid] = entry
+        for tid, entry in self.runtaskentries.items():
+            for dep in entry.depends:
+                self.runtaskentries[dep].revdeps.add(tid)
+
+        class DataCache(object):
+            stamp = {}
+            stamp_extrainfo = {}
+            task_deps = {}
+        cache = DataCache()
+        for tid in self.runtaskentries:
+            fn = bb.runqueue.fn_from_tid(tid)
+            cache.stamp[fn] = os.path.join(stampdir, fn)
+            cache.stamp_extrainfo[fn] = {}
+            cache.task_deps[fn] = {}
+        self.dataCaches = {'': cache}
+
+class FakeRunQueueExecute(object):
+    """
+    Just enough of RunQueueExecute to drive a scheduler
+    """
+    def __init__(self, d, rqdata, number_tasks):
+        self.cfgData = d
+        self.rqdata = rqdata
+        self.number_tasks = number_tasks
+        self.runq_running = set()
+        self.runq_complete = set()
+        self.holdoff_tasks = set()
+        self.tasks_covered = set()
+        self.tasks_notcovered = set(rqdata.runtaskentries)
+        self.build_stamps = {}
+        self.build_stamps2 = set()
+        self.sched = None
+
+    def can_start_task(self):
+        return len(self.runq_running) - len(self.runq_complete) < self.number_tasks
+
+    def start(self, tid):
+        self.build_stamps[tid] = self.sched.stamps[tid]
+        self.build_stamps2.add(self.sched.stamps[tid])
+        self.runq_running.add(tid)
+        self.sched.taskrunning(tid)
+
+    def complete(self, tid):
+        self.build_stamps2.discard(self.build_stamps.pop(tid))
+        self.runq_complete.add(tid)
+        self.sched.taskcomplete(tid)
+        for revdep in self.rqdata.runtaskentries[tid].revdeps:
+            if self.rqdata.runtaskentries[revdep].depends.issubset(self.runq_complete):
+                self.sched.newbuildable(revdep)
+
+class RunQueueSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="runqueueschedtest")
+        self.d = bb.data.init()
+        self.origsiggen = getattr(bb.parse, "siggen", None)
+        bb.parse.siggen = bb.siggen.SignatureGenerator(self.d)
+
+    def tearDown(self):
+        bb.parse.siggen = self.origsiggen
+        bb.utils.prunedir(self.tempdir)
+
+    def make_scheduler(self, tasks, number_tasks=4, scheduler=None):
+        rqdata = FakeRunQueueData(tasks, os.path.join(self.tempdir, "stamps"))
+        rq = FakeRunQueueExecute(self.d, rqdata, number_tasks)
+        rq.sched = (scheduler or bb.runqueue.RunQueueScheduler)(rq, rqdata)
+        return rq
+
+    def replay(self, rq):
+        """
+        Run the whole task graph, completing the oldest running task
+        whenever no further task can be started
+        """
+        order = []
+        running = []
+        for tid, entry in rq.rqdata.runtaskentries.items():
+            if not entry.depends:
+                rq.sched.newbuildable(tid)
+        while len(rq.runq_complete) < len(rq.rqdata.runtaskentries):
+            tid = rq.sched.next()
+            if tid is not None:
+                rq.start(tid)
+                order.append(tid)
+                running.append(tid)
+                continue
+            self.assertTrue(running, "Scheduler deadlocked")
+            rq.complete(running.pop(0))
+        return order
+
+    def test_priority_order(self):
+        tasks = [("r%d.bb:do_%s" % (r, t), []) for r in range(3) for t in ("a", "b")]
+        rq = self.make_scheduler(tasks, number_tasks=1)
+        order = self.replay(rq)
+        self.assertEqual(order, [tid for tid, _ in tasks])
+
+    def test_number_threads(self):
+        self.d.setVarFlag("do_fetch", "number_threads", "2")
+        tasks = [("r%d.bb:do_fetch" % r, []) for r in range(6)] + [("r%d.bb:do_compile" % r, []) for r in range(6)]
+        rq = self.make_scheduler(tasks, number_tasks=4)
+        for tid, _ in tasks:
+            rq.sched.newbuildable(tid)
+        started = []
+        while True:
+            tid = rq.sched.next()
+            if tid is None:
+                break
+            rq.start(tid)
+            started.append(tid)
+        # Only two fetches may run at once, the other threads go to compile
+        self.assertEqual(started, ["r0.bb:do_fetch", "r1.bb:do_fetch", "r0.bb:do_compile", "r1.bb:do_compile"])
+
+        rq.complete("r0.bb:do_fetch")
+        self.assertEqual(rq.sched.next(), "r2.bb:do_fetch")
+
+    def test_holdoff(self):
+        tasks = [("r%d.bb:do_compile" % r, []) for r in range(3)]
+        rq = self.make_scheduler(tasks)
+        rq.holdoff_tasks = set(["r0.bb:do_compile"])
+        rq.tasks_notcovered = set(["r0.bb:do_compile", "r1.bb:do_compile"])
+        for tid, _ in tasks:
+            rq.sched.newbuildable(tid)
+        self.assertEqual(rq.sched.next(), "r1.bb:do_compile")
+        rq.start("r1.bb:do_compile")
+        self.assertIsNone(rq.sched.next())
+
+        # Held off tasks are only reconsidered once the holdoffs change
+        rq.holdoff_tasks = set()
+        rq.tasks_notcovered = set(rq.rqdata.runtaskentries)
+        rq.sched.holdoffupdated()
+        self.assertEqual(rq.sched.next(), "r0.bb:do_compile")
+
+    def world_build(self, recipes):
+        """
+        Synthetic world build: recipes of 10 tasks each, every task depending
+        on the previous task of its recipe and the matching task of a few
+        earlier recipes
+        """
+        tasknames = ["do_task%d" % i for i in range(10)]
+        tasks = []
+        for r in range(recipes):
+            for i, taskname in enumerate(tasknames):
+                deps = []
+                if i:
+                    deps.append("recipe%d.bb:%s" % (r, tasknames[i - 1]))
+                for dep in (r // 2, r // 3, r - 1):
+                    if 0 <= dep < r:
+                        deps.append("recipe%d.bb:%s" % (dep, taskname))
+                tasks.append(("recipe%d.bb:%s" % (r, taskname), deps))
+        self.d.setVarFlag("do_task0", "number_threads", "4")
+        return tasks
+
+    def test_world_build(self):
+        tasks = self.world_build(500)
+        rq = self.make_scheduler(tasks, number_tasks=64, scheduler=bb.runqueue.RunQueueSchedulerSpeed)
+        order = self.replay(rq)
+
+        self.assertEqual(len(order), len(tasks))
+        self.assertEqual(len(set(order)), len(tasks))
+        position = dict((tid, i) for i, tid in enumerate(order))
+        for tid, deps in tasks:
+            for dep in deps:
+                self.assertLess(position[dep], position[tid])
+
+    @unittest.skipUnless(os.environ.get("BB_RUN_BENCHMARKS") == "yes", "benchmark")
+    def test_benchmark_50k_tasks(self):
+        tasks = self.world_build(5000)
+        rq = self.make_scheduler(tasks, number_tasks=64, scheduler=bb.runqueue.RunQueueSchedulerSpeed)
+        start = time.perf_counter()
+        order = self.replay(rq)
+        elapsed = time.perf_counter() - start
+        print("\nScheduled %d tasks in %.2fs (%.1fus per task)" % (len(order), elapsed, elapsed * 1000000 / len(order)))
+
+class FakeRunQueue(object):
+    """
+    Just enough of RunQueue to check stamps
+    """
+    check_stamp_task = bb.runqueue.RunQueue.check_stamp_task
+    invalidate_stamps = bb.runqueue.RunQueue.invalidate_stamps
+
+    def __init__(self, rqdata):
+        self.rqdata = rqdata
+        self.stamppolicy = "perfile"
+        self.stampindex = bb.runqueue.StampIndex()
+
+class StampIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix="runqueuestamptest")
+        self.stampdir = os.path.join(self.tempdir, "stamps")
+        os.makedirs(self.stampdir)
+        self.origsiggen = getattr(bb.parse, "siggen", None)
+        bb.parse.siggen = bb.siggen.SignatureGenerator(bb.data.init())
+
+    def tearDown(self):
+        bb.parse.siggen = self.origsiggen
+        bb.utils.prunedir(self.tempdir)
+
+    def touch(self, stamp, mtime):
+        open(stamp, "w").close()
+        os.utime(stamp, (mtime, mtime))
+
+    def test_mtime(self):
+        index = bb.runqueue.StampIndex()
+        stamp = os.path.join(self.stampdir, "foo.do_compile")
+        self.assertIsNone(index.mtime(stamp))
+        self.assertIsNone(index.mtime(os.path.join(self.tempdir, "missing", "foo.do_compile")))
+
+        # Not noticed until the directory is invalidated
+        self.touch(stamp, 1000)
+        self.assertIsNone(index.mtime(stamp))
+        index.invalidate(stamp)
+        self.assertEqual(index.mtime(stamp), 1000)
+
+        os.unlink(stamp)
+        index.invalidate()
+        self.assertIsNone(index.mtime(stamp))
+
+    def test_check_stamp_task(self):
+        tasks = [("a.bb:do_fetch", []), ("a.bb:do_compile", ["a.bb:do_fetch"]),
+                 ("b.bb:do_compile", ["b.bb:do_fetch", "a.bb:do_compile"]), ("b.bb:do_fetch", [])]
+        rq = FakeRunQueue(FakeRunQueueData(tasks, self.stampdir))
+
+        self.assertFalse(rq.check_stamp_task("a.bb:do_compile"))
+        self.touch(os.path.join(self.stampdir, "a.bb.do_fetch"), 1000)
+        self.touch(os.path.join(self.stampdir, "a.bb.do_compile"), 2000)
+        rq.invalidate_stamps("a.bb:do_compile")
+        self.assertTrue(rq.check_stamp_task("a.bb:do_compile"))
+
+        # A dependency newer than the task makes it out of date
+        self.touch(os.path.join(self.stampdir, "a.bb.do_fetch"), 3000)
+        rq.invalidate_stamps("a.bb:do_fetch")
+        self.assertFalse(rq.check_stamp_task("a.bb:do_compile"))
+
+        # A setscene stamp covers the dependency
+        self.touch(os.path.join(self.stampdir, "b.bb.do_fetch_setscene"), 1000)
+        self.touch(os.path.join(self.stampdir, "b.bb.do_compile"), 2000)
+        rq.invalidate_stamps("b.bb:do_fetch")
+        self.assertTrue(rq.check_stamp_task("b.bb:do_compile"))
+
+    def test_world_build(self):
+        # Stamps of a world build: 200 recipes of 10 tasks each, every task
+        # depending on the previous task of its recipe
+        tasknames = ["do_task%d" % i for i in range(10)]
+        tasks = []
+        for r in range(200):
+            os.makedirs(os.path.join(self.stampdir, "recipe%d" % r))
+            for i, taskname in enumerate(tasknames):
+                deps = []
+                if i:
+                    deps.append("recipe%d/r.bb:%s" % (r, tasknames[i - 1]))
+                tasks.append(("recipe%d/r.bb:%s" % (r, taskname), deps))
+                self.touch(os.path.join(self.stampdir, "recipe%d" % r, "r.bb.%s" % taskname), 1000 + i)
+        rq = FakeRunQueue(FakeRunQueueData(tasks, self.stampdir))
+
+        for tid, _ in tasks:
+            self.assertTrue(rq.check_stamp_task(tid))
+
+        # The stamps looked up by check_stamp_task(), the task itself and
+        # the normal and setscene stamps of each dependency
+        stamps = []
+        for tid, deps in tasks:
+            stamps.append(bb.build.stampfile(bb.runqueue.taskname_from_tid(tid), rq.rqdata.dataCaches[''], bb.runqueue.fn_from_tid(tid)))
+            for dep in deps:
+                (mc2, fn2, taskname2, taskfn2) = bb.runqueue.split_tid_mcfn(dep)
+                stamps.append(bb.build.stampfile(taskname2, rq.rqdata.dataCaches[mc2], taskfn2))
+                stamps.append(bb.build.stampfile(taskname2 + "_setscene", rq.rqdata.dataCaches[mc2], taskfn2))
+
+        index = bb.runqueue.StampIndex()
+        for f in stamps:
+            if os.path.exists(f):
+                self.assertEqual(index.mtime(f), os.stat(f).st_mtime)
+            else:
+                self.assertIsNone(index.mtime(f))
+
+class SetscenePrefetcherTests(unittest.TestCase):
+
+    def test_queue(self):
+        prefetched = []
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+
+        def prefetch(sq_data, d):
+            prefetched.append(sq_data)
+            if sq_data == "t1":
+                started.set()
+                release.wait(10)
+            if sq_data == "t5":
+                done.set()
+
+        prefetcher = bb.runqueue.SetscenePrefetcher(prefetch, bb.data.init(), 1)
+        prefetcher.queue("t1", "t1")
+        self.assertTrue(started.wait(10))
+        for tid in ("t2", "t3", "t4", "t5"):
+            prefetcher.queue(tid, tid)
+        # Already queued tasks aren't queued again and tasks which started
+        # executing are dropped
+        prefetcher.queue("t2", "t2")
+        prefetcher.cancel("t3")
+        prefetcher.cancel("t1")
+        release.set()
+        self.assertTrue(done.wait(10))
+        prefetcher.stop()
+        prefetcher.join()
+        self.assertEqual(prefetched, ["t1", "t2", "t4", "t5"])
+
+    def test_stop(self):
+        prefetched = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def prefetch(sq_data, d):
+            prefetched.append(sq_data)
+            started.set()
+            release.wait(10)
+
+        prefetcher = bb.runqueue.SetscenePrefetcher(prefetch, bb.data.init(), 2)
+        prefetcher.queue("t1", "t1")
+        self.assertTrue(started.wait(10))
+        # The prefetch in progress completes, the queued ones are dropped
+        self.assertFalse(prefetcher.stop(timeout=0.1))
+        prefetcher.queue("t2", "t2")
+        release.set()
+        self.assertTrue(prefetcher.stop(timeout=10))
+        self.assertEqual(prefetched, ["t1"])
@@ -61,6 +61,9 @@ class ORMWrapper(object):
         information in the database.
     """
 
+    # number of objects saved per transaction by bulk_create()
+    BULK_CHUNK_SIZE = 5000
+
     def __init__(self):
         self.layer_version_objects = []
         self.layer_version_built = []
@@ -114,6 +117,15 @@ class ORMWrapper(object):
 
         return vars(self)[dictname][key]
 
+    @staticmethod
+    def bulk_create(clazz, objects):
+        """ Saves objects with bulk inserts, BULK_CHUNK_SIZE objects per transaction.
+            Note that the primary keys of the objects are not set.
+        """
+        for i in range(0, len(objects), ORMWrapper.BULK_CHUNK_SIZE):
+            with transaction.atomic():
+                clazz.objects.bulk_create(objects[i:i + ORMWrapper.BULK_CHUNK_SIZE])
+
     def get_similar_target_with_image_files(self, target):
         """
         Get a Target object "similar" to target; i.e. with the same target
@@ -301,6 +313,47 @@ class ORMWrapper(object):
             task_object.save()
         return task_object
 
+    def get_update_task_objects(self, build, tasks_information):
+        """ Same as calling get_update_task_object() for each of the tasks of
+            build, but the tasks which don't exist yet are saved with bulk
+            inserts first. Returns the task objects in the same order.
+        """
+        dictname = "objects_%s" % Task.__name__
+        if not dictname in vars(self).keys():
+            vars(self)[dictname] = {}
+        cached_tasks = vars(self)[dictname]
+
+        def _task_key(task_information):
+            return ORMWrapper._build_key(build=task_information['build'],
+                                         recipe=task_information['recipe'],
+                                         task_name=task_information['task_name'])
+
+        # like _cached_get_or_create(), assume that the tasks not in the
+        # cache are not in the database either
+        new_tasks = {}
+        recipes = {}
+        for task_information in tasks_information:
+            key = _task_key(task_information)
+            if key not in cached_tasks and key not in new_tasks:
+                new_tasks[key] = Task(**task_information)
+                recipes[task_information['recipe'].id] = task_information['recipe']
+
+        if new_tasks:
+            self.bulk_create(Task, list(new_tasks.values()))
+
+            # bulk inserts don't set the ids, so read the tasks back
+            for task_object in Task.objects.filter(build=build):
+                if task_object.recipe_id not in recipes:
+                    continue
+                task_object.build = build
+                task_object.recipe = recipes[task_object.recipe_id]
+                key = _task_key({'build': build, 'recipe': task_object.recipe, 'task_name': task_object.task_name})
+                if key in new_tasks:
+                    cached_tasks[key] = task_object
+
+        # the new tasks are now found in the cache, and already up to date
+        return [self.get_update_task_object(task_information) for task_information in tasks_information]
+
 
     def get_update_recipe_object(self, recipe_information, must_exist = False):
         assert 'layer_version' in recipe_information
@@ -463,6 +516,13 @@ class ORMWrapper(object):
         files = filedata['files']
         syms = filedata['syms']
 
+        def _parent_path(path):
+            return "/".join(path.split("/")[:len(path.split("/")) - 1])
+
+        def _directory_id(path):
+            # a KeyError here means the parent directory is missing from dirs
+            return dir_ids[_parent_path(path) or "/"]
+
         # always create the root directory as a special case;
         # note that this is never displayed, so the owner, group,
         # size, permission are irrelevant
@@ -473,40 +533,52 @@ class ORMWrapper(object):
                                             group = '',
                                             permission = '',
                                             inodetype = Target_File.ITYPE_DIRECTORY)
-        tf_obj.save()
 
-        # insert directories, ordered by name depth
-        for d in sorted(dirs, key=lambda x:len(x[-1].split("/"))):
-            (user, group, size) = d[1:4]
-            permission = d[0][1:]
+        # ids of the directories by path, so that the parent directory of
+        # every entry is known without looking it up
+        dir_ids = {'/': tf_obj.id}
+
+        # insert directories one level of depth at a time, as each level
+        # needs the ids of the one above it
+        levels = {}
+        for d in dirs:
             path = d[4].lstrip(".")
 
             # we already created the root directory, so ignore any
             # entry for it
             if len(path) == 0:
                 continue
-
-            parent_path = "/".join(path.split("/")[:len(path.split("/")) - 1])
-            if len(parent_path) == 0:
-                parent_path = "/"
-            parent_obj = self._cached_get(Target_File, target = target_obj, path = parent_path, inodetype = Target_File.ITYPE_DIRECTORY)
-            tf_obj = Target_File.objects.create(
-                        target = target_obj,
-                        path = path,
-                        size = size,
-                        inodetype = Target_File.ITYPE_DIRECTORY,
-                        permission = permission,
-                        owner = user,
-                        group = group,
-                        directory = parent_obj)
-
+            levels.setdefault(len(path.split("/")), []).append(d)
+
+        for depth in sorted(levels):
+            tf_objs = []
+            for d in levels[depth]:
+                (user, group, size) = d[1:4]
+                permission = d[0][1:]
+                path = d[4].lstrip(".")
+                tf_objs.append(Target_File(
+                            target = target_obj,
+                            path = path,
+                            size = size,
+                            inodetype = Target_File.ITYPE_DIRECTORY,
+                            permission = permission,
+                            owner = user,
+                            group = group,
+                            directory_id = _directory_id(path)))
+            self.bulk_create(Target_File, tf_objs)
+
+            # bulk inserts don't return the ids; the new directories are
+            # the ones of this target with higher ids than any seen so far
+            dir_ids.update(Target_File.objects.filter(target = target_obj,
+                                                      inodetype = Target_File.ITYPE_DIRECTORY,
+                                                      id__gt = max(dir_ids.values())).values_list('path', 'id'))
 
         # we insert files
+        tf_objs = []
         for d in files:
             (user, group, size) = d[1:4]
             permission = d[0][1:]
             path = d[4].lstrip(".")
-            parent_path = "/".join(path.split("/")[:len(path.split("/")) - 1])
             inodetype = Target_File.ITYPE_REGULAR
             if d[0].startswith('b'):
                 inodetype = Target_File.ITYPE_BLOCK
@@ -515,26 +587,29 @@ class ORMWrapper(object):
             if d[0].startswith('p'):
                 inodetype = Target_File.ITYPE_FIFO
 
-            tf_obj = Target_File.objects.create(
+            tf_objs.append(Target_File(
                         target = target_obj,
                         path = path,
                         size = size,
                         inodetype = inodetype,
                         permission = permission,
                         owner = user,
-                        group = group)
-            parent_obj = self._cached_get(Target_File, target = target_obj, path = parent_path, inodetype = Target_File.ITYPE_DIRECTORY)
-            tf_obj.directory = parent_obj
-            tf_obj.save()
-
-        # we insert symlinks
+                        group = group,
+                        directory_id = _directory_id(path)))
+        self.bulk_create(Target_File, tf_objs)
+
+        # we insert symlinks, pointing them at the directories and files
+        # by path
+        file_ids = dict(Target_File.objects.filter(target = target_obj).values_list('path', 'id'))
+        sym_targets = {}
+        tf_objs = []
         for d in syms:
             (user, group, size) = d[1:4]
             permission = d[0][1:]
             path = d[4].lstrip(".")
             filetarget_path = d[6]
 
-            parent_path = "/".join(path.split("/")[:len(path.split("/")) - 1])
+            parent_path = _parent_path(path)
             if not filetarget_path.startswith("/"):
                 # we have a relative path, get a normalized absolute one
                 filetarget_path = parent_path + "/" + filetarget_path
@@ -547,15 +622,12 @@ class ORMWrapper(object):
                         fcpl.append(i)
                 filetarget_path = "/".join(fcpl)
 
-            try:
-                filetarget_obj = Target_File.objects.get(target = target_obj, path = filetarget_path)
-            except Target_File.DoesNotExist:
-                # we might have an invalid link; no way to detect this. just set it to None
-                filetarget_obj = None
-
-            parent_obj = Target_File.objects.get(target = target_obj, path = parent_path, inodetype = Target_File.ITYPE_DIRECTORY)
+            # we might have an invalid link; no way to detect this. just set it to None
+            filetarget_id = file_ids.get(filetarget_path)
+            if filetarget_id is None:
+                sym_targets[path] = filetarget_path
 
-            tf_obj = Target_File.objects.create(
+            tf_objs.append(Target_File(
                         target = target_obj,
                         path = path,
                         size = size,
@@ -563,8 +635,18 @@ class ORMWrapper(object):
                         permission = permission,
                         owner = user,
                         group = group,
-                        directory = parent_obj,
-                        sym_target = filetarget_obj)
+                        directory_id = _directory_id(path),
+                        sym_target_id = filetarget_id))
+        self.bulk_create(Target_File, tf_objs)
+
+        # links to other links can only be pointed at them once those have ids
+        if sym_targets:
+            sym_ids = dict(Target_File.objects.filter(target = target_obj,
+                                                      inodetype = Target_File.ITYPE_SYMLINK).values_list('path', 'id'))
+            with transaction.atomic():
+                for path, filetarget_path in sym_targets.items():
+                    if filetarget_path in sym_ids:
+                        Target_File.objects.filter(id = sym_ids[path]).update(sym_target_id = sym_ids[filetarget_path])
 
 
     def save_target_package_information(self, build_obj, target_obj, packagedict, pkgpnmap, recipes, built_package=False):
@@ -939,21 +1021,17 @@ class BuildInfoHelper(object):
                 build_info['build_name'] = build_name
                 changed = True
 
-        if not build.machine:
-            build_info['machine'] = self.server.runCommand(["getVariable", "MACHINE"])[0]
-            changed = True
-
-        if not build.distro:
-            build_info['distro'] = self.server.runCommand(["getVariable", "DISTRO"])[0]
-            changed = True
-
-        if not build.distro_version:
-            build_info['distro_version'] = self.server.runCommand(["getVariable", "DISTRO_VERSION"])[0]
-            changed = True
-
-        if not build.bitbake_version:
-            build_info['bitbake_version'] = self.server.runCommand(["getVariable", "BB_VERSION"])[0]
-            changed = True
+        # fields which are legitimately empty on the server are fetched
+        # again every time, but only saved if they do change
+        for field, variable in (('machine', 'MACHINE'),
+                                ('distro', 'DISTRO'),
+                                ('distro_version', 'DISTRO_VERSION'),
+                                ('bitbake_version', 'BB_VERSION')):
+            if not getattr(build, field):
+                value = self.server.runCommand(["getVariable", variable])[0]
+                if value != getattr(build, field):
+                    build_info[field] = value
+                    changed = True
 
         if changed:
             self.orm_wrapper.update_build(self.internal_state['build'], build_info)
@@ -1416,9 +1494,7 @@ class BuildInfoHelper(object):
                     layer_version_obj.save()
 
         # save recipe information
-        self.internal_state['recipes'] = {}
-        for pn in event._depgraph['pn']:
-
+        def _save_a_recipe(pn):
             file_name = event._depgraph['pn'][pn]['filename'].split(":")[-1]
             pathflags = ":".join(sorted(event._depgraph['pn'][pn]['filename'].split(":")[:-1]))
             layer_version_obj = self._get_layer_version_for_path(file_name)
@@ -1475,6 +1551,13 @@ class BuildInfoHelper(object):
                         t.save()
             self.internal_state['recipes'][pn] = recipe
 
+        self.internal_state['recipes'] = {}
+        pns = list(event._depgraph['pn'])
+        for i in range(0, len(pns), ORMWrapper.BULK_CHUNK_SIZE):
+            with transaction.atomic():
+                for pn in pns[i:i + ORMWrapper.BULK_CHUNK_SIZE]:
+                    _save_a_recipe(pn)
+
         # we'll not get recipes for key w/ values listed in ASSUME_PROVIDED
 
         assume_provided = self.server.runCommand(["getVariable", "ASSUME_PROVIDED"])[0].split()
@@ -1504,10 +1587,10 @@ class BuildInfoHelper(object):
                                                dep_type=Recipe_Dependency.TYPE_DEPENDS)
                 recipedeps_objects.append(recipe_dep)
 
-        Recipe_Dependency.objects.bulk_create(recipedeps_objects)
+        self.orm_wrapper.bulk_create(Recipe_Dependency, recipedeps_objects)
 
         # save all task information
-        def _save_a_task(taskdesc):
+        def _get_a_task_information(taskdesc):
             spec = re.split(r'\.', taskdesc)
             pn = ".".join(spec[0:-1])
             taskname = spec[-1]
@@ -1516,26 +1599,28 @@ class BuildInfoHelper(object):
             recipe = self.internal_state['recipes'][pn]
             task_info = self._get_task_information(e, recipe)
             task_info['task_name'] = taskname
-            task_obj = self.orm_wrapper.get_update_task_object(task_info)
-            return task_obj
+            return task_info
 
-        # create tasks
-        tasks = {}
+        # create tasks, including the ones only found as dependencies as
+        # fetch tasks info is not collected previously
+        taskdescs = list(event._depgraph['tdepends'])
+        seen = set(taskdescs)
         for taskdesc in event._depgraph['tdepends']:
-            tasks[taskdesc] = _save_a_task(taskdesc)
+            for taskdep in event._depgraph['tdepends'][taskdesc]:
+                if taskdep not in seen:
+                    seen.add(taskdep)
+                    taskdescs.append(taskdep)
+        task_objs = self.orm_wrapper.get_update_task_objects(self.internal_state['build'],
+                        [_get_a_task_information(taskdesc) for taskdesc in taskdescs])
+        tasks = dict(zip(taskdescs, task_objs))
 
         # create dependencies between tasks
         taskdeps_objects = []
         for taskdesc in event._depgraph['tdepends']:
             target = tasks[taskdesc]
             for taskdep in event._depgraph['tdepends'][taskdesc]:
-                if taskdep not in tasks:
-                    # Fetch tasks info is not collected previously
-                    dep = _save_a_task(taskdep)
-                else:
-                    dep = tasks[taskdep]
-                taskdeps_objects.append(Task_Dependency( task = target, depends_on = dep ))
-        Task_Dependency.objects.bulk_create(taskdeps_objects)
+                taskdeps_objects.append(Task_Dependency( task = target, depends_on = tasks[taskdep] ))
+        self.orm_wrapper.bulk_create(Task_Dependency, taskdeps_objects)
 
         if len(errormsg) > 0:
             logger.warning("buildinfohelper: dependency info not identify recipes: \n%s", errormsg)
@@ -66,10 +66,10 @@ def parse_address(addr):
         return (ADDR_TYPE_TCP, (host, int(port)))
 
 
-def create_server(addr, dbname, *, sync=True):
+def create_server(addr, dbname, *, sync=True, readers=0, upstream=None, upstream_push=False):
     from . import server
-    db = setup_database(dbname, sync=sync)
-    s = server.Server(db)
+    db = server.Database(dbname, sync=sync, readers=readers)
+    s = server.Server(db, upstream=upstream, upstream_push=upstream_push)
 
     (typ, a) = parse_address(addr)
     if typ == ADDR_TYPE_UNIX:
@@ -91,3 +91,16 @@ def create_client(addr):
         c.connect_tcp(*a)
 
     return c
+
+
+def create_async_client(addr):
+    from . import client
+    c = client.AsyncClient()
+
+    (typ, a) = parse_address(addr)
+    if typ == ADDR_TYPE_UNIX:
+        c.connect_unix(*a)
+    else:
+        c.connect_tcp(*a)
+
+    return c
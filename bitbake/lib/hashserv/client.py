@@ -3,14 +3,20 @@
 # SPDX-License-Identifier: GPL-2.0-only
 #
 
+import asyncio
 import json
 import logging
 import socket
 import os
+import threading
 
 
 logger = logging.getLogger('hashserv.client')
 
+# The working directory is process wide, so only one thread at a time may
+# change it to connect to a unix socket
+_chdir_lock = threading.Lock()
+
 
 class HashConnectionError(Exception):
     pass
@@ -20,6 +26,11 @@ class Client(object):
     MODE_NORMAL = 0
     MODE_GET_STREAM = 1
 
+    # Maximum number of get-stream requests sent before reading back the
+    # replies. This bounds the amount of unread data in flight so neither
+    # side blocks on a full socket buffer
+    MAX_BATCH = 500
+
     def __init__(self):
         self._socket = None
         self.reader = None
@@ -41,12 +52,13 @@ class Client(object):
         def connect_sock():
             s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             # AF_UNIX has path length issues so chdir here to workaround
-            cwd = os.getcwd()
-            try:
-                os.chdir(os.path.dirname(path))
-                s.connect(os.path.basename(path))
-            finally:
-                os.chdir(cwd)
+            with _chdir_lock:
+                cwd = os.getcwd()
+                try:
+                    os.chdir(os.path.dirname(path))
+                    s.connect(os.path.basename(path))
+                finally:
+                    os.chdir(cwd)
             return s
 
         self._connect_sock = connect_sock
@@ -117,6 +129,22 @@ class Client(object):
 
         return self._send_wrapper(proc)
 
+    def send_stream_batch(self, msgs):
+        def proc():
+            for msg in msgs:
+                self.writer.write("%s\n" % msg)
+            self.writer.flush()
+
+            replies = []
+            for _ in msgs:
+                l = self.reader.readline()
+                if not l:
+                    raise HashConnectionError('Connection closed')
+                replies.append(l.rstrip())
+            return replies
+
+        return self._send_wrapper(proc)
+
     def _set_mode(self, new_mode):
         if new_mode == self.MODE_NORMAL and self.mode == self.MODE_GET_STREAM:
             r = self.send_stream('END')
@@ -138,6 +166,21 @@ class Client(object):
             return None
         return r
 
+    def get_unihash_batch(self, args):
+        """
+        Look up the unihashes for a list of (method, taskhash) pairs,
+        pipelining the requests over the get-stream protocol so a batch
+        costs one round trip per MAX_BATCH entries instead of one per entry.
+        Returns a list of unihashes (None for unknown entries) in the same
+        order as args.
+        """
+        self._set_mode(self.MODE_GET_STREAM)
+        result = []
+        for i in range(0, len(args), self.MAX_BATCH):
+            msgs = ['%s %s' % (method, taskhash) for method, taskhash in args[i:i + self.MAX_BATCH]]
+            result.extend(r or None for r in self.send_stream_batch(msgs))
+        return result
+
     def report_unihash(self, taskhash, method, outhash, unihash, extra={}):
         self._set_mode(self.MODE_NORMAL)
         m = extra.copy()
@@ -162,3 +205,114 @@ class Client(object):
     def reset_stats(self):
         self._set_mode(self.MODE_NORMAL)
         return self.send_message({'reset-stats': None})
+
+
+class AsyncClient(object):
+    """
+    A minimal asyncio client, used by a server to talk to its upstream
+    server without blocking its event loop
+    """
+    MODE_NORMAL = 0
+    MODE_GET_STREAM = 1
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.mode = self.MODE_NORMAL
+        self._connect = None
+
+    def connect_tcp(self, address, port):
+        async def connect():
+            return await asyncio.open_connection(address, port)
+
+        self._connect = connect
+
+    def connect_unix(self, path):
+        async def connect():
+            return await asyncio.open_unix_connection(path)
+
+        self._connect = connect
+
+    async def connect(self):
+        if self.writer is None:
+            self.reader, self.writer = await self._connect()
+            self.writer.write('OEHASHEQUIV 1.0\n\n'.encode('utf-8'))
+            await self.writer.drain()
+            self.mode = self.MODE_NORMAL
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = None
+            self.writer = None
+
+    async def _send_wrapper(self, proc):
+        try:
+            await self.connect()
+            return await proc()
+        except (OSError, HashConnectionError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            # Drop the connection so it is re-established on the next request
+            await self.close()
+            if not isinstance(e, HashConnectionError):
+                raise HashConnectionError(str(e))
+            raise e
+
+    async def _readline(self):
+        l = await self.reader.readline()
+        if not l:
+            raise HashConnectionError('Connection closed')
+        return l.decode('utf-8')
+
+    async def send_message(self, msg):
+        async def proc():
+            self.writer.write(('%s\n' % json.dumps(msg)).encode('utf-8'))
+            await self.writer.drain()
+            return json.loads(await self._readline())
+
+        return await self._send_wrapper(proc)
+
+    async def send_stream(self, msg):
+        async def proc():
+            self.writer.write(('%s\n' % msg).encode('utf-8'))
+            await self.writer.drain()
+            return (await self._readline()).rstrip()
+
+        return await self._send_wrapper(proc)
+
+    async def _set_mode(self, new_mode):
+        # Connect before checking the mode, since a new connection always
+        # starts in normal mode
+        try:
+            await self.connect()
+        except OSError as e:
+            await self.close()
+            raise HashConnectionError(str(e))
+
+        if new_mode == self.MODE_NORMAL and self.mode == self.MODE_GET_STREAM:
+            r = await self.send_stream('END')
+            if r != 'ok':
+                raise HashConnectionError('Bad response from server %r' % r)
+        elif new_mode == self.MODE_GET_STREAM and self.mode == self.MODE_NORMAL:
+            r = await self.send_message({'get-stream': None})
+            if r != 'ok':
+                raise HashConnectionError('Bad response from server %r' % r)
+        elif new_mode != self.mode:
+            raise Exception('Undefined mode transition %r -> %r' % (self.mode, new_mode))
+
+        self.mode = new_mode
+
+    async def get_unihash(self, method, taskhash):
+        await self._set_mode(self.MODE_GET_STREAM)
+        r = await self.send_stream('%s %s' % (method, taskhash))
+        if not r:
+            return None
+        return r
+
+    async def report_unihash(self, taskhash, method, outhash, unihash, extra={}):
+        await self._set_mode(self.MODE_NORMAL)
+        m = extra.copy()
+        m['taskhash'] = taskhash
+        m['method'] = method
+        m['outhash'] = outhash
+        m['unihash'] = unihash
+        return await self.send_message({'report': m})
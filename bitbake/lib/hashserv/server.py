@@ -6,13 +6,19 @@
 from contextlib import closing
 from datetime import datetime
 import asyncio
+import concurrent.futures
 import json
 import logging
 import math
 import os
+import queue
 import signal
 import socket
+import sqlite3
+import threading
 import time
+from . import setup_database, create_async_client
+from .client import HashConnectionError
 
 logger = logging.getLogger('hashserv.server')
 
@@ -107,12 +113,228 @@ class Stats(object):
         return {k: getattr(self, k) for k in ('num', 'total_time', 'max_time', 'average', 'stdev')}
 
 
+def _query_equivalent(cursor, method, taskhash):
+    cursor.execute('SELECT taskhash, method, unihash FROM tasks_v2 WHERE method=:method AND taskhash=:taskhash ORDER BY created ASC LIMIT 1',
+                   {'method': method, 'taskhash': taskhash})
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {k: row[k] for k in ('taskhash', 'method', 'unihash')}
+
+
+def _insert_task(cursor, data, outhash, unihash, ignore=False):
+    insert_data = {
+        'method': data['method'],
+        'outhash': outhash,
+        'taskhash': data['taskhash'],
+        'unihash': unihash,
+        'created': datetime.now()
+    }
+
+    for k in ('owner', 'PN', 'PV', 'PR', 'task', 'outhash_siginfo'):
+        if k in data:
+            insert_data[k] = data[k]
+
+    cursor.execute('''INSERT %sINTO tasks_v2 (%s) VALUES (%s)''' % (
+        'OR IGNORE ' if ignore else '',
+        ', '.join(sorted(insert_data.keys())),
+        ', '.join(':' + k for k in sorted(insert_data.keys()))),
+        insert_data)
+
+
+def _report(cursor, data):
+    cursor.execute('''
+        -- Find tasks with a matching outhash (that is, tasks that
+        -- are equivalent)
+        SELECT taskhash, method, unihash FROM tasks_v2 WHERE method=:method AND outhash=:outhash
+
+        -- If there is an exact match on the taskhash, return it.
+        -- Otherwise return the oldest matching outhash of any
+        -- taskhash
+        ORDER BY CASE WHEN taskhash=:taskhash THEN 1 ELSE 2 END,
+            created ASC
+
+        -- Only return one row
+        LIMIT 1
+        ''', {k: data[k] for k in ('method', 'outhash', 'taskhash')})
+
+    row = cursor.fetchone()
+
+    # If no matching outhash was found, or one *was* found but it
+    # wasn't an exact match on the taskhash, a new entry for this
+    # taskhash should be added
+    if row is None or row['taskhash'] != data['taskhash']:
+        # If a row matching the outhash was found, the unihash for
+        # the new taskhash should be the same as that one.
+        # Otherwise the caller provided unihash is used.
+        unihash = data['unihash']
+        if row is not None:
+            unihash = row['unihash']
+
+        _insert_task(cursor, data, data['outhash'], unihash)
+
+        logger.info('Adding taskhash %s with unihash %s',
+                    data['taskhash'], unihash)
+
+        return {
+            'taskhash': data['taskhash'],
+            'method': data['method'],
+            'unihash': unihash
+        }
+
+    return {k: row[k] for k in ('taskhash', 'method', 'unihash')}
+
+
+def _report_equiv(cursor, data):
+    _insert_task(cursor, data, "", data['unihash'], ignore=True)
+
+    # Fetch the unihash that will be reported for the taskhash. If the
+    # unihash matches, it means this row was inserted (or the mapping
+    # was already valid)
+    d = _query_equivalent(cursor, data['method'], data['taskhash'])
+
+    if d['unihash'] == data['unihash']:
+        logger.info('Adding taskhash equivalence for %s with unihash %s',
+                        data['taskhash'], d['unihash'])
+
+    return d
+
+
+class Database(object):
+    """
+    Keeps database writes off the asyncio event loop so that a slow commit
+    never stalls the connected clients. All writes go through a single
+    writer thread, which groups the writes queued while the previous
+    transaction was committing into a single transaction.
+
+    The database is in WAL mode so lookups never wait for the writer. By
+    default they run directly on the event loop using its own connection,
+    which is the fastest option when the database is in the page cache. If
+    readers is non-zero they are spread over a pool of that many threads
+    instead, each with its own connection.
+    """
+    MAX_WRITE_BATCH = 500
+
+    def __init__(self, dbname, *, sync=True, readers=0):
+        self.dbname = dbname
+        self.sync = sync
+
+        # Create the tables up front so errors are reported immediately
+        setup_database(dbname, sync=sync).close()
+
+        # An in memory database can't be shared between connections
+        self.shared = dbname != ':memory:'
+        self.num_readers = readers
+
+        # The threads are only started once the database is first used,
+        # since the server is usually created in one process and then
+        # forked to serve requests
+        self.readers = None
+        self.reader_local = threading.local()
+        self.reader_dbs = []
+        self.reader_lock = threading.Lock()
+        self.writer = None
+        self.write_queue = queue.Queue()
+
+    def _reader_db(self):
+        db = getattr(self.reader_local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.dbname, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            self.reader_local.db = db
+            with self.reader_lock:
+                self.reader_dbs.append(db)
+        return db
+
+    def _read(self, func, *args):
+        with closing(self._reader_db().cursor()) as cursor:
+            return func(cursor, *args)
+
+    def _write_thread(self):
+        db = setup_database(self.dbname, sync=self.sync)
+        done = False
+        while not done:
+            batch = [self.write_queue.get()]
+            while len(batch) < self.MAX_WRITE_BATCH:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            results = []
+            with closing(db.cursor()) as cursor:
+                for item in batch:
+                    if item is None:
+                        done = True
+                        continue
+                    future, func, args = item
+                    try:
+                        results.append((future, func(cursor, *args), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+
+            try:
+                db.commit()
+            except Exception as e:
+                results = [(future, None, e) for future, _, _ in results]
+
+            for future, result, exc in results:
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+
+        db.close()
+
+    def _submit_write(self, func, *args):
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_thread, name='hashserv-writer', daemon=True)
+            self.writer.start()
+        future = concurrent.futures.Future()
+        self.write_queue.put((future, func, args))
+        return asyncio.wrap_future(future)
+
+    async def _submit_read(self, func, *args):
+        if not self.shared:
+            return await self._submit_write(func, *args)
+        if not self.num_readers:
+            return self._read(func, *args)
+        if self.readers is None:
+            self.readers = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_readers)
+        return await asyncio.get_event_loop().run_in_executor(self.readers, self._read, func, *args)
+
+    async def query_equivalent(self, method, taskhash):
+        return await self._submit_read(_query_equivalent, method, taskhash)
+
+    async def report(self, data):
+        return await self._submit_write(_report, data)
+
+    async def report_equiv(self, data):
+        return await self._submit_write(_report_equiv, data)
+
+    def close(self):
+        if self.writer is not None:
+            self.write_queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.readers is not None:
+            self.readers.shutdown()
+            self.readers = None
+        with self.reader_lock:
+            for db in self.reader_dbs:
+                db.close()
+            self.reader_dbs = []
+
+
 class ServerClient(object):
-    def __init__(self, reader, writer, db, request_stats):
+    def __init__(self, reader, writer, db, request_stats, upstream=None, push_report=None):
         self.reader = reader
         self.writer = writer
         self.db = db
         self.request_stats = request_stats
+        self.upstream = upstream
+        self.upstream_client = None
+        self.push_report = push_report
 
     async def process_requests(self):
         try:
@@ -170,6 +392,8 @@ class ServerClient(object):
 
                 await self.writer.drain()
         finally:
+            if self.upstream_client is not None:
+                await self.upstream_client.close()
             self.writer.close()
 
     def write_message(self, msg):
@@ -195,14 +419,13 @@ class ServerClient(object):
         method = request['method']
         taskhash = request['taskhash']
 
-        row = self.query_equivalent(method, taskhash)
-        if row is not None:
-            logger.debug('Found equivalent task %s -> %s', (row['taskhash'], row['unihash']))
-            d = {k: row[k] for k in ('taskhash', 'method', 'unihash')}
+        d = await self.db.query_equivalent(method, taskhash)
+        if d is None:
+            d = await self.query_upstream(method, taskhash)
+        if d is not None:
+            logger.debug('Found equivalent task %s -> %s', (d['taskhash'], d['unihash']))
 
-            self.write_message(d)
-        else:
-            self.write_message(None)
+        self.write_message(d)
 
     async def handle_get_stream(self, request):
         self.write_message('ok')
@@ -228,7 +451,9 @@ class ServerClient(object):
 
                 (method, taskhash) = l.split()
                 #logger.debug('Looking up %s %s' % (method, taskhash))
-                row = self.query_equivalent(method, taskhash)
+                row = await self.db.query_equivalent(method, taskhash)
+                if row is None and self.upstream is not None:
+                    row = await self.query_upstream(method, taskhash)
                 if row is not None:
                     msg = ('%s\n' % row['unihash']).encode('utf-8')
                     #logger.debug('Found equivalent task %s -> %s', (row['taskhash'], row['unihash']))
@@ -243,101 +468,41 @@ class ServerClient(object):
             await self.writer.drain()
 
     async def handle_report(self, data):
-        with closing(self.db.cursor()) as cursor:
-            cursor.execute('''
-                -- Find tasks with a matching outhash (that is, tasks that
-                -- are equivalent)
-                SELECT taskhash, method, unihash FROM tasks_v2 WHERE method=:method AND outhash=:outhash
-
-                -- If there is an exact match on the taskhash, return it.
-                -- Otherwise return the oldest matching outhash of any
-                -- taskhash
-                ORDER BY CASE WHEN taskhash=:taskhash THEN 1 ELSE 2 END,
-                    created ASC
-
-                -- Only return one row
-                LIMIT 1
-                ''', {k: data[k] for k in ('method', 'outhash', 'taskhash')})
-
-            row = cursor.fetchone()
-
-            # If no matching outhash was found, or one *was* found but it
-            # wasn't an exact match on the taskhash, a new entry for this
-            # taskhash should be added
-            if row is None or row['taskhash'] != data['taskhash']:
-                # If a row matching the outhash was found, the unihash for
-                # the new taskhash should be the same as that one.
-                # Otherwise the caller provided unihash is used.
-                unihash = data['unihash']
-                if row is not None:
-                    unihash = row['unihash']
-
-                insert_data = {
-                    'method': data['method'],
-                    'outhash': data['outhash'],
-                    'taskhash': data['taskhash'],
-                    'unihash': unihash,
-                    'created': datetime.now()
-                }
-
-                for k in ('owner', 'PN', 'PV', 'PR', 'task', 'outhash_siginfo'):
-                    if k in data:
-                        insert_data[k] = data[k]
-
-                cursor.execute('''INSERT INTO tasks_v2 (%s) VALUES (%s)''' % (
-                    ', '.join(sorted(insert_data.keys())),
-                    ', '.join(':' + k for k in sorted(insert_data.keys()))),
-                    insert_data)
-
-                self.db.commit()
-
-                logger.info('Adding taskhash %s with unihash %s',
-                            data['taskhash'], unihash)
-
-                d = {
-                    'taskhash': data['taskhash'],
-                    'method': data['method'],
-                    'unihash': unihash
-                }
-            else:
-                d = {k: row[k] for k in ('taskhash', 'method', 'unihash')}
-
+        d = await self.db.report(data)
+        if self.push_report is not None:
+            self.push_report(data)
         self.write_message(d)
 
     async def handle_equivreport(self, data):
-        with closing(self.db.cursor()) as cursor:
-            insert_data = {
-                'method': data['method'],
-                'outhash': "",
-                'taskhash': data['taskhash'],
-                'unihash': data['unihash'],
-                'created': datetime.now()
-            }
-
-            for k in ('owner', 'PN', 'PV', 'PR', 'task', 'outhash_siginfo'):
-                if k in data:
-                    insert_data[k] = data[k]
-
-            cursor.execute('''INSERT OR IGNORE INTO tasks_v2 (%s) VALUES (%s)''' % (
-                ', '.join(sorted(insert_data.keys())),
-                ', '.join(':' + k for k in sorted(insert_data.keys()))),
-                insert_data)
-
-            self.db.commit()
+        d = await self.db.report_equiv(data)
+        self.write_message(d)
 
-            # Fetch the unihash that will be reported for the taskhash. If the
-            # unihash matches, it means this row was inserted (or the mapping
-            # was already valid)
-            row = self.query_equivalent(data['method'], data['taskhash'])
+    async def query_upstream(self, method, taskhash):
+        """
+        Look up a taskhash missing from the local database on the upstream
+        server. Any answer is stored locally so later lookups don't need to
+        leave the site.
+        """
+        if self.upstream is None:
+            return None
 
-            if row['unihash'] == data['unihash']:
-                logger.info('Adding taskhash equivalence for %s with unihash %s',
-                                data['taskhash'], row['unihash'])
+        if self.upstream_client is None:
+            self.upstream_client = create_async_client(self.upstream)
 
-            d = {k: row[k] for k in ('taskhash', 'method', 'unihash')}
+        try:
+            unihash = await self.upstream_client.get_unihash(method, taskhash)
+        except HashConnectionError as e:
+            logger.warning('Error talking to upstream server %s: %s' % (self.upstream, e))
+            return None
 
-        self.write_message(d)
+        if unihash is None:
+            return None
 
+        return await self.db.report_equiv({
+            'method': method,
+            'taskhash': taskhash,
+            'unihash': unihash,
+        })
 
     async def handle_get_stats(self, request):
         d = {
@@ -354,21 +519,18 @@ class ServerClient(object):
         self.request_stats.reset()
         self.write_message(d)
 
-    def query_equivalent(self, method, taskhash):
-        # This is part of the inner loop and must be as fast as possible
-        try:
-            cursor = self.db.cursor()
-            cursor.execute('SELECT taskhash, method, unihash FROM tasks_v2 WHERE method=:method AND taskhash=:taskhash ORDER BY created ASC LIMIT 1',
-                           {'method': method, 'taskhash': taskhash})
-            return cursor.fetchone()
-        except:
-            cursor.close()
-
 
 class Server(object):
-    def __init__(self, db, loop=None):
+    # How long to wait on shutdown for queued reports to reach upstream
+    UPSTREAM_FLUSH_TIMEOUT = 10
+
+    def __init__(self, db, loop=None, upstream=None, upstream_push=False):
         self.request_stats = Stats()
         self.db = db
+        self.upstream = upstream
+        self.upstream_push = upstream and upstream_push
+        self.push_queue = None
+        self.push_task = None
 
         if loop is None:
             self.loop = asyncio.new_event_loop()
@@ -419,7 +581,8 @@ class Server(object):
     async def handle_client(self, reader, writer):
         # writer.transport.set_write_buffer_limits(0)
         try:
-            client = ServerClient(reader, writer, self.db, self.request_stats)
+            client = ServerClient(reader, writer, self.db, self.request_stats, self.upstream,
+                                  self.push_report if self.upstream_push else None)
             await client.process_requests()
         except Exception as e:
             import traceback
@@ -428,6 +591,41 @@ class Server(object):
             writer.close()
         logger.info('Client disconnected')
 
+    def push_report(self, data):
+        """
+        Queue a locally reported task to be sent upstream in the background
+        """
+        if self.push_queue is None:
+            self.push_queue = asyncio.Queue()
+            self.push_task = asyncio.ensure_future(self.push_worker())
+        self.push_queue.put_nowait(data)
+
+    async def push_worker(self):
+        client = create_async_client(self.upstream)
+        try:
+            while True:
+                data = await self.push_queue.get()
+                try:
+                    extra = {k: data[k] for k in ('owner', 'PN', 'PV', 'PR', 'task', 'outhash_siginfo') if k in data}
+                    await client.report_unihash(data['taskhash'], data['method'], data['outhash'], data['unihash'], extra)
+                except HashConnectionError as e:
+                    logger.warning('Unable to push %s to upstream server %s: %s' % (data['taskhash'], self.upstream, e))
+                finally:
+                    self.push_queue.task_done()
+        finally:
+            await client.close()
+
+    async def flush_upstream(self):
+        try:
+            await asyncio.wait_for(self.push_queue.join(), self.UPSTREAM_FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning('Timed out pushing %d reports to upstream server %s' % (self.push_queue.qsize(), self.upstream))
+        self.push_task.cancel()
+        try:
+            await self.push_task
+        except asyncio.CancelledError:
+            pass
+
     def serve_forever(self):
         def signal_handler():
             self.loop.stop()
@@ -443,6 +641,11 @@ class Server(object):
         self.loop.run_until_complete(self.server.wait_closed())
         logger.info('Server shutting down')
 
+        if self.push_task is not None:
+            self.loop.run_until_complete(self.flush_upstream())
+
+        self.db.close()
+
         if self.close_loop:
             self.loop.close()
 
@@ -9,39 +9,69 @@ from . import create_server, create_client
 import hashlib
 import logging
 import multiprocessing
+import os
 import sys
 import tempfile
 import threading
+import time
 import unittest
 
 
+class ServerProcess(object):
+    def __init__(self, address, process):
+        self.address = address
+        self.process = process
+
+
 class TestHashEquivalenceServer(object):
     METHOD = 'TestMethod'
 
-    def _run_server(self):
+    def _run_server(self, addr, dbname, kwargs, conn):
         # logging.basicConfig(level=logging.DEBUG, filename='bbhashserv.log', filemode='w',
         #                     format='%(levelname)s %(filename)s:%(lineno)d %(message)s')
-        self.server.serve_forever()
+        server = create_server(addr, dbname, **kwargs)
+        conn.send(server.address)
+        conn.close()
+        server.serve_forever()
+
+    def start_server(self, dbname, **kwargs):
+        # The server is created in its own process so no other process
+        # inherits the listening socket. Otherwise connections to a stopped
+        # server would hang instead of being refused
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=self._run_server,
+                                          args=(self.get_server_addr(dbname), os.path.join(self.temp_dir.name, dbname), kwargs, writer))
+        process.start()
+        writer.close()
+
+        server = ServerProcess(reader.recv(), process)
+        reader.close()
+        self.servers.append(server)
+        return server
+
+    def stop_server(self, server):
+        if server.process.is_alive():
+            server.process.terminate()
+            server.process.join()
 
     def setUp(self):
         if sys.version_info < (3, 5, 0):
             self.skipTest('Python 3.5 or later required')
 
         self.temp_dir = tempfile.TemporaryDirectory(prefix='bb-hashserv')
-        self.dbfile = os.path.join(self.temp_dir.name, 'db.sqlite')
+        self.servers = []
+        self.clients = []
 
-        self.server = create_server(self.get_server_addr(), self.dbfile)
-        self.server_thread = multiprocessing.Process(target=self._run_server)
-        self.server_thread.start()
+        self.server = self.start_server('db.sqlite')
         self.client = create_client(self.server.address)
+        self.clients.append(self.client)
 
     def tearDown(self):
-        # Shutdown server
-        s = getattr(self, 'server', None)
-        if s is not None:
-            self.server_thread.terminate()
-            self.server_thread.join()
-        self.client.close()
+        # Shutdown servers
+        for server in self.servers:
+            self.stop_server(server)
+        for client in self.clients:
+            client.close()
         self.temp_dir.cleanup()
 
     def test_create_hash(self):
@@ -99,33 +129,211 @@ class TestHashEquivalenceServer(object):
         result = self.client.get_unihash(self.METHOD, taskhash)
         self.assertEqual(result, unihash)
 
-    def test_stress(self):
-        def query_server(failures):
-            client = Client(self.server.address)
+    def test_get_unihash_batch(self):
+        # Tests that a batch of lookups returns the same as individual ones,
+        # including across multiple pipelined chunks
+        self.client.MAX_BATCH = 3
+        args = []
+        expected = []
+        for i in range(10):
+            taskhash = hashlib.sha256(('batch%d' % i).encode('utf-8')).hexdigest()
+            args.append((self.METHOD, taskhash))
+            if i % 2:
+                unihash = hashlib.sha256(('unihash%d' % i).encode('utf-8')).hexdigest()
+                self.client.report_unihash(taskhash, self.METHOD, taskhash, unihash)
+                expected.append(unihash)
+            else:
+                expected.append(None)
+
+        result = self.client.get_unihash_batch(args)
+        self.assertEqual(result, expected)
+
+        # The client is still usable in stream mode afterwards
+        self.assertEqual(self.client.get_unihash(*args[1]), expected[1])
+        self.assertEqual(self.client.get_unihash_batch([]), [])
+
+    def test_upstream_lookup(self):
+        # Tests that a server falls back to its upstream server on a miss and
+        # keeps the answer once the upstream server has gone
+        taskhash = '4bfbf53bd7bb6c3fc4bd7b72ceed2c4b4fc7fe3f'
+        outhash = '5a3b0c6a4cc0b42d79ba56f49a3dc4f5b2e6ea6e7a4b12adbfdc31d5cc8e4d92'
+        unihash = 'a13b5e3f1e5d6b4e6f1c9b7a8d2c0e4f3b5a6d7c'
+        self.client.report_unihash(taskhash, self.METHOD, outhash, unihash)
+
+        local = self.start_server('local.sqlite', upstream=self.server.address)
+        local_client = create_client(local.address)
+        self.clients.append(local_client)
+
+        self.assertEqual(local_client.get_unihash(self.METHOD, taskhash), unihash)
+        self.assertIsNone(local_client.get_unihash(self.METHOD, 'ffffffffffffffffffffffffffffffffffffffff'))
+
+        self.stop_server(self.server)
+
+        # The answer is now served from the local database
+        self.assertEqual(local_client.get_unihash(self.METHOD, taskhash), unihash)
+        self.assertEqual(local_client.get_unihash_batch([(self.METHOD, taskhash)]), [unihash])
+
+        # Unknown hashes still work without the upstream server
+        self.assertIsNone(local_client.get_unihash(self.METHOD, 'eeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee'))
+
+    def test_upstream_down(self):
+        # Tests that misses are still answered once the upstream server has
+        # gone, including ones that have to reconnect to it
+        local = self.start_server('local.sqlite', upstream=self.server.address)
+        local_client = create_client(local.address)
+        self.clients.append(local_client)
+
+        self.assertIsNone(local_client.get_unihash(self.METHOD, 'ffffffffffffffffffffffffffffffffffffffff'))
+        sock = local_client._socket
+
+        self.stop_server(self.server)
+
+        self.assertIsNone(local_client.get_unihash(self.METHOD, 'eeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee'))
+        self.assertIsNone(local_client.get_unihash(self.METHOD, 'dddddddddddddddddddddddddddddddddddddddd'))
+
+        # The local server kept the connection open throughout
+        self.assertIs(local_client._socket, sock)
+
+    def test_upstream_push(self):
+        # Tests that tasks reported to a server are pushed to its upstream
+        # server in the background
+        local = self.start_server('local.sqlite', upstream=self.server.address, upstream_push=True)
+        local_client = create_client(local.address)
+        self.clients.append(local_client)
+
+        taskhash = '6f9e2a3b4c5d6e7f8091a2b3c4d5e6f708192a3b'
+        outhash = '0d1e2f3a4b5c6d7e8f90a1b2c3d4e5f60718293a4b5c6d7e8f90a1b2c3d4e5f6'
+        unihash = '1a2b3c4d5e6f708192a3b4c5d6e7f8091a2b3c4d'
+        result = local_client.report_unihash(taskhash, self.METHOD, outhash, unihash)
+        self.assertEqual(result['unihash'], unihash)
+
+        for _ in range(50):
+            result = self.client.get_unihash(self.METHOD, taskhash)
+            if result is not None:
+                break
+            time.sleep(0.1)
+        self.assertEqual(result, unihash)
+
+    def stress(self, server):
+        """
+        Run hundreds of clients querying the server alongside clients
+        reporting to it. Returns the latencies of the queries and of the
+        reports, and the total time taken
+        """
+        NUM_CLIENTS = 200
+        NUM_REPORTERS = 10
+        NUM_QUERIES = 250
+
+        def query_server(failures, latencies):
+            client = create_client(server.address)
             try:
-                for i in range(1000):
+                for i in range(NUM_QUERIES):
                     taskhash = hashlib.sha256()
                     taskhash.update(str(i).encode('utf-8'))
                     taskhash = taskhash.hexdigest()
+                    start = time.perf_counter()
                     result = client.get_unihash(self.METHOD, taskhash)
+                    latencies.append(time.perf_counter() - start)
                     if result != taskhash:
                         failures.append("taskhash mismatch: %s != %s" % (result, taskhash))
+            except Exception as e:
+                failures.append(str(e))
+            finally:
+                client.close()
+
+        def report_server(failures, latencies, n):
+            # Reporters run alongside the queries so the lookups have to make
+            # progress while the server is committing reports
+            client = create_client(server.address)
+            try:
+                for i in range(NUM_QUERIES):
+                    taskhash = hashlib.sha256()
+                    taskhash.update(('report%d-%d' % (n, i)).encode('utf-8'))
+                    taskhash = taskhash.hexdigest()
+                    start = time.perf_counter()
+                    result = client.report_unihash(taskhash, self.METHOD, taskhash, taskhash)
+                    latencies.append(time.perf_counter() - start)
+                    if result['unihash'] != taskhash:
+                        failures.append("unihash mismatch: %s != %s" % (result['unihash'], taskhash))
+            except Exception as e:
+                failures.append(str(e))
             finally:
                 client.close()
 
         # Report hashes
-        for i in range(1000):
+        client = create_client(server.address)
+        self.clients.append(client)
+        for i in range(NUM_QUERIES):
             taskhash = hashlib.sha256()
             taskhash.update(str(i).encode('utf-8'))
             taskhash = taskhash.hexdigest()
-            self.client.report_unihash(taskhash, self.METHOD, taskhash, taskhash)
+            client.report_unihash(taskhash, self.METHOD, taskhash, taskhash)
 
         failures = []
-        threads = [threading.Thread(target=query_server, args=(failures,)) for t in range(100)]
+        query_latencies = []
+        report_latencies = []
+        threads = [threading.Thread(target=query_server, args=(failures, query_latencies)) for t in range(NUM_CLIENTS)]
+        threads.extend(threading.Thread(target=report_server, args=(failures, report_latencies, t)) for t in range(NUM_REPORTERS))
 
+        start = time.perf_counter()
         for t in threads:
             t.start()
 
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        self.assertFalse(failures)
+        self.assertEqual(len(query_latencies), NUM_CLIENTS * NUM_QUERIES)
+        self.assertEqual(len(report_latencies), NUM_REPORTERS * NUM_QUERIES)
+        return query_latencies, report_latencies, elapsed
+
+    def test_stress(self):
+        self.stress(self.server)
+
+    @unittest.skipUnless(os.environ.get("BB_RUN_BENCHMARKS") == "yes", "benchmark")
+    def test_benchmark_stress(self):
+        def percentile(samples, p):
+            return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+        for readers in (0, 4):
+            server = self.start_server('benchmark%d.sqlite' % readers, readers=readers)
+            query_latencies, report_latencies, elapsed = self.stress(server)
+            query_latencies.sort()
+            report_latencies.sort()
+            print("\n%d readers: %d requests in %.2fs, get p50 %.2fms p99 %.2fms, report p50 %.2fms p99 %.2fms" % (
+                readers, len(query_latencies) + len(report_latencies), elapsed,
+                percentile(query_latencies, 50) * 1000, percentile(query_latencies, 99) * 1000,
+                percentile(report_latencies, 50) * 1000, percentile(report_latencies, 99) * 1000))
+
+    def test_stress_readers(self):
+        # Tests that lookups served from a pool of reader threads see the
+        # reported hashes
+        server = self.start_server('readers.sqlite', readers=4)
+        client = create_client(server.address)
+        self.clients.append(client)
+
+        def query_server(failures):
+            client = create_client(server.address)
+            try:
+                for i in range(100):
+                    taskhash = hashlib.sha256(str(i).encode('utf-8')).hexdigest()
+                    result = client.get_unihash(self.METHOD, taskhash)
+                    if result != taskhash:
+                        failures.append("taskhash mismatch: %s != %s" % (result, taskhash))
+            except Exception as e:
+                failures.append(str(e))
+            finally:
+                client.close()
+
+        for i in range(100):
+            taskhash = hashlib.sha256(str(i).encode('utf-8')).hexdigest()
+            client.report_unihash(taskhash, self.METHOD, taskhash, taskhash)
+
+        failures = []
+        threads = [threading.Thread(target=query_server, args=(failures,)) for t in range(20)]
+        for t in threads:
+            t.start()
         for t in threads:
             t.join()
 
@@ -133,10 +341,10 @@ class TestHashEquivalenceServer(object):
 
 
 class TestHashEquivalenceUnixServer(TestHashEquivalenceServer, unittest.TestCase):
-    def get_server_addr(self):
-        return "unix://" + os.path.join(self.temp_dir.name, 'sock')
+    def get_server_addr(self, dbname):
+        return "unix://" + os.path.join(self.temp_dir.name, dbname + '.sock')
 
 
 class TestHashEquivalenceTCPServer(TestHashEquivalenceServer, unittest.TestCase):
-    def get_server_addr(self):
+    def get_server_addr(self, dbname):
         return "localhost:0"
@@ -0,0 +1,133 @@
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import json
+import logging
+import socket
+
+logger = logging.getLogger("BitBake.PRserv")
+
+
+class PRConnectionError(Exception):
+    pass
+
+
+class PRProtocolError(PRConnectionError):
+    """
+    The server doesn't speak this protocol, most likely because it is an
+    older, XML-RPC based, PR server
+    """
+    pass
+
+
+class PRClient(object):
+    """
+    Client for the PR service streaming protocol. After a short greeting
+    every request is a single line of JSON answered by a single line of
+    JSON, over a connection that is kept open between requests.
+    """
+    PROTOCOL = 'PRSERVICE 1.0'
+
+    # Maximum number of lookups sent in one get-prs request
+    MAX_BATCH = 1000
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._socket = None
+        self.reader = None
+        self.writer = None
+
+    def connect(self):
+        if self._socket is None:
+            s = socket.create_connection((self.host, self.port))
+            s.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self._socket = s
+
+            self.reader = self._socket.makefile('r', encoding='utf-8')
+            self.writer = self._socket.makefile('w', encoding='utf-8')
+
+            self.writer.write('%s\n\n' % self.PROTOCOL)
+            self.writer.flush()
+
+        return self._socket
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            self.reader = None
+            self.writer = None
+
+    def send_message(self, msg):
+        count = 0
+        while True:
+            try:
+                self.connect()
+                self.writer.write('%s\n' % json.dumps(msg))
+                self.writer.flush()
+
+                l = self.reader.readline()
+                if not l or not l.endswith('\n'):
+                    raise PRConnectionError('Connection closed')
+
+                # An XML-RPC server answers the greeting with an HTTP error
+                if l.startswith(('HTTP/', '<')):
+                    raise PRProtocolError('PR server %s:%s does not support the %s protocol. '
+                                          'It is probably an older XML-RPC based server, which '
+                                          'needs to be upgraded to the same version of bitbake '
+                                          'as this client.' % (self.host, self.port, self.PROTOCOL))
+
+                reply = json.loads(l)
+                break
+            except PRProtocolError:
+                self.close()
+                raise
+            except (OSError, PRConnectionError, json.JSONDecodeError, UnicodeDecodeError) as e:
+                logger.warning('Error talking to PR server %s:%s: %s' % (self.host, self.port, e))
+                self.close()
+                if count >= 3:
+                    if not isinstance(e, PRConnectionError):
+                        raise PRConnectionError(str(e))
+                    raise e
+                count += 1
+
+        if isinstance(reply, dict) and 'error' in reply:
+            raise PRConnectionError(reply['error'])
+        return reply
+
+    def getPR(self, version, pkgarch, checksum):
+        return self.send_message({'get-pr': {'version': version, 'pkgarch': pkgarch, 'checksum': checksum}})
+
+    def getPRs(self, queries):
+        """
+        Look up the PR values for a list of (version, pkgarch, checksum)
+        tuples. Returns a list of values (None where the lookup failed) in
+        the same order as queries. All the new values handed out by one
+        request are committed in a single transaction.
+        """
+        result = []
+        for i in range(0, len(queries), self.MAX_BATCH):
+            result.extend(self.send_message({'get-prs': [list(q) for q in queries[i:i + self.MAX_BATCH]]}))
+        return result
+
+    def importone(self, version, pkgarch, checksum, value):
+        return self.send_message({'import-one': {'version': version, 'pkgarch': pkgarch, 'checksum': checksum, 'value': value}})
+
+    def export(self, version=None, pkgarch=None, checksum=None, colinfo=True):
+        reply = self.send_message({'export': {'version': version, 'pkgarch': pkgarch, 'checksum': checksum, 'colinfo': colinfo}})
+        if reply is None:
+            return None
+        (metainfo, datainfo) = reply
+        return (metainfo, datainfo)
+
+    def dump_db(self):
+        return self.send_message({'dump-db': None})
+
+    def ping(self):
+        return self.send_message({'ping': None})
+
+    def quit(self):
+        return self.send_message({'quit': None})
@@ -30,6 +30,13 @@ if sqlversion[0] < 3 or (sqlversion[0] == 3 and sqlversion[1] < 3):
 #
 
 class PRTable(object):
+    """
+    A table of PR values. All the rows are held in memory so lookups never
+    touch the database. New values are queued and only written out by
+    write(), so the writes of many requests can share a single transaction.
+    export() and dump_db() read the database, so any pending rows should be
+    written out first.
+    """
     def __init__(self, conn, table, nohist):
         self.conn = conn
         self.nohist = nohist
@@ -46,6 +53,14 @@ class PRTable(object):
                     value INTEGER, \
                     PRIMARY KEY (version, pkgarch, checksum));" % self.table)
 
+        # (version, pkgarch, checksum) -> value and (version, pkgarch) -> max value
+        self.values = {}
+        self.max_values = {}
+        # Rows changed since the last take_pending()
+        self.pending = {}
+        for row in self._execute("SELECT version, pkgarch, checksum, value FROM %s;" % self.table):
+            self._set(row[0], row[1], row[2], row[3])
+
     def _execute(self, *query):
         """Execute a query, waiting to acquire a lock if necessary"""
         start = time.time()
@@ -58,68 +73,57 @@ class PRTable(object):
                     continue
                 raise exc
 
+    def _set(self, version, pkgarch, checksum, value):
+        self.values[(version, pkgarch, checksum)] = value
+        if value is not None and value > self.max_values.get((version, pkgarch), -1):
+            self.max_values[(version, pkgarch)] = value
+
+    def _store(self, version, pkgarch, checksum, value):
+        self._set(version, pkgarch, checksum, value)
+        self.pending[(version, pkgarch, checksum)] = value
+        self.dirty = True
+
+    def take_pending(self):
+        """
+        Return the rows changed since the last call and forget them. The
+        caller becomes responsible for passing them to write().
+        """
+        rows = [key + (value,) for (key, value) in self.pending.items()]
+        self.pending = {}
+        self.dirty = False
+        return rows
+
+    def write(self, rows):
+        """Write the given rows and commit them in one transaction"""
+        if rows:
+            self.conn.executemany("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?);" % self.table, rows)
+        self.sync()
+
     def sync(self):
         self.conn.commit()
         self._execute("BEGIN EXCLUSIVE TRANSACTION")
 
     def sync_if_dirty(self):
         if self.dirty:
-            self.sync()
-            self.dirty = False
+            self.write(self.take_pending())
+
+    def _next_value(self, version, pkgarch):
+        return self.max_values.get((version, pkgarch), -1) + 1
 
     def _getValueHist(self, version, pkgarch, checksum):
-        data=self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=?;" % self.table,
-                           (version, pkgarch, checksum))
-        row=data.fetchone()
-        if row is not None:
-            return row[0]
-        else:
-            #no value found, try to insert
-            try:
-                self._execute("INSERT INTO %s VALUES (?, ?, ?, (select ifnull(max(value)+1,0) from %s where version=? AND pkgarch=?));"
-                           % (self.table,self.table),
-                           (version,pkgarch, checksum,version, pkgarch))
-            except sqlite3.IntegrityError as exc:
-                logger.error(str(exc))
-
-            self.dirty = True
-
-            data=self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=?;" % self.table,
-                               (version, pkgarch, checksum))
-            row=data.fetchone()
-            if row is not None:
-                return row[0]
-            else:
-                raise prserv.NotFoundError
+        value = self.values.get((version, pkgarch, checksum))
+        if value is None:
+            value = self._next_value(version, pkgarch)
+            self._store(version, pkgarch, checksum, value)
+        return value
 
     def _getValueNohist(self, version, pkgarch, checksum):
-        data=self._execute("SELECT value FROM %s \
-                            WHERE version=? AND pkgarch=? AND checksum=? AND \
-                            value >= (select max(value) from %s where version=? AND pkgarch=?);" 
-                            % (self.table, self.table),
-                            (version, pkgarch, checksum, version, pkgarch))
-        row=data.fetchone()
-        if row is not None:
-            return row[0]
-        else:
-            #no value found, try to insert
-            try:
-                self._execute("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, (select ifnull(max(value)+1,0) from %s where version=? AND pkgarch=?));"
-                               % (self.table,self.table),
-                               (version, pkgarch, checksum, version, pkgarch))
-            except sqlite3.IntegrityError as exc:
-                logger.error(str(exc))
-                self.conn.rollback()
-
-            self.dirty = True
-
-            data=self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=?;" % self.table,
-                               (version, pkgarch, checksum))
-            row=data.fetchone()
-            if row is not None:
-                return row[0]
-            else:
-                raise prserv.NotFoundError
+        value = self.values.get((version, pkgarch, checksum))
+        if value is None or value < self.max_values.get((version, pkgarch), -1):
+            # Unknown, or not the latest value, so hand out a new one
+            value = self._next_value(version, pkgarch)
+            self._store(version, pkgarch, checksum, value)
+        return value
 
     def getValue(self, version, pkgarch, checksum):
         if self.nohist:
@@ -128,52 +132,18 @@ class PRTable(object):
             return self._getValueHist(version, pkgarch, checksum)
 
     def _importHist(self, version, pkgarch, checksum, value):
-        val = None 
-        data = self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=?;" % self.table,
-                           (version, pkgarch, checksum))
-        row = data.fetchone()
-        if row is not None:
-            val=row[0]
-        else:
-            #no value found, try to insert
-            try:
-                self._execute("INSERT INTO %s VALUES (?, ?, ?, ?);"  % (self.table),
-                           (version, pkgarch, checksum, value))
-            except sqlite3.IntegrityError as exc:
-                logger.error(str(exc))
-
-            self.dirty = True
-
-            data = self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=?;" % self.table,
-                           (version, pkgarch, checksum))
-            row = data.fetchone()
-            if row is not None:
-                val = row[0]
+        val = self.values.get((version, pkgarch, checksum))
+        if val is None:
+            self._store(version, pkgarch, checksum, value)
+            val = value
         return val
 
     def _importNohist(self, version, pkgarch, checksum, value):
-        try:
-            #try to insert
-            self._execute("INSERT INTO %s VALUES (?, ?, ?, ?);"  % (self.table),
-                           (version, pkgarch, checksum,value))
-        except sqlite3.IntegrityError as exc:
-            #already have the record, try to update
-            try:
-                self._execute("UPDATE %s SET value=? WHERE version=? AND pkgarch=? AND checksum=? AND value<?"  
-                              % (self.table),
-                               (value,version,pkgarch,checksum,value))
-            except sqlite3.IntegrityError as exc:
-                logger.error(str(exc))
-
-        self.dirty = True
-
-        data = self._execute("SELECT value FROM %s WHERE version=? AND pkgarch=? AND checksum=? AND value>=?;" % self.table,
-                            (version,pkgarch,checksum,value))
-        row=data.fetchone()
-        if row is not None:
-            return row[0]
-        else:
-            return None
+        val = self.values.get((version, pkgarch, checksum))
+        if val is None or val < value:
+            self._store(version, pkgarch, checksum, value)
+            val = value
+        return val
 
     def importone(self, version, pkgarch, checksum, value):
         if self.nohist:
@@ -4,17 +4,18 @@
 
 import os,sys,logging
 import signal, time
-from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
-import threading
-import queue
+import asyncio
+import concurrent.futures
+import json
 import socket
 import io
 import sqlite3
-import bb.server.xmlrpcclient
+import bb.msg
+import bb.utils
 import prserv
+import prserv.client
 import prserv.db
 import errno
-import select
 
 logger = logging.getLogger("BitBake.PRserv")
 
@@ -22,27 +23,28 @@ if sys.hexversion < 0x020600F0:
     print("Sorry, python 2.6 or later is required.")
     sys.exit(1)
 
-class Handler(SimpleXMLRPCRequestHandler):
-    def _dispatch(self,method,params):
-        try:
-            value=self.server.funcs[method](*params)
-        except:
-            import traceback
-            traceback.print_exc()
-            raise
-        return value
-
 PIDPREFIX = "/tmp/PRServer_%s_%s.pid"
 singleton = None
 
 
-class PRServer(SimpleXMLRPCServer):
+class PRServer(object):
+    """
+    PR service using the same kind of line based streaming protocol as
+    hashserv. Clients are served from an asyncio event loop and lookups are
+    answered from the in-memory index of the PR table. New values are
+    written by a separate thread, which commits all the values handed out
+    while it was busy with the previous transaction in one go, and a reply
+    is only sent once the values it contains have been committed.
+    """
     def __init__(self, dbfile, logfile, interface, daemon=True):
         ''' constructor '''
         try:
-            SimpleXMLRPCServer.__init__(self, interface,
-                                        logRequests=False, allow_none=True)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(interface)
+            self.socket.listen(128)
         except socket.error:
+            self.socket.close()
             ip=socket.gethostbyname(interface[0])
             port=interface[1]
             msg="PR Server unable to bind to %s:%s\n" % (ip, port)
@@ -52,68 +54,9 @@ class PRServer(SimpleXMLRPCServer):
         self.dbfile=dbfile
         self.daemon=daemon
         self.logfile=logfile
-        self.working_thread=None
         self.host, self.port = self.socket.getsockname()
         self.pidfile=PIDPREFIX % (self.host, self.port)
-
-        self.register_function(self.getPR, "getPR")
-        self.register_function(self.quit, "quit")
-        self.register_function(self.ping, "ping")
-        self.register_function(self.export, "export")
-        self.register_function(self.dump_db, "dump_db")
-        self.register_function(self.importone, "importone")
-        self.register_introspection_functions()
-
-        self.quitpipein, self.quitpipeout = os.pipe()
-
-        self.requestqueue = queue.Queue()
-        self.handlerthread = threading.Thread(target = self.process_request_thread)
-        self.handlerthread.daemon = False
-
-    def process_request_thread(self):
-        """Same as in BaseServer but as a thread.
-
-        In addition, exception handling is done here.
-
-        """
-        iter_count = 1
-        # 60 iterations between syncs or sync if dirty every ~30 seconds
-        iterations_between_sync = 60
-
-        bb.utils.set_process_name("PRServ Handler")
-
-        while not self.quitflag:
-            try:
-                (request, client_address) = self.requestqueue.get(True, 30)
-            except queue.Empty:
-                self.table.sync_if_dirty()
-                continue
-            if request is None:
-                continue
-            try:
-                self.finish_request(request, client_address)
-                self.shutdown_request(request)
-                iter_count = (iter_count + 1) % iterations_between_sync
-                if iter_count == 0:
-                    self.table.sync_if_dirty()
-            except:
-                self.handle_error(request, client_address)
-                self.shutdown_request(request)
-                self.table.sync()
-            self.table.sync_if_dirty()
-
-    def sigint_handler(self, signum, stack):
-        if self.table:
-            self.table.sync()
-
-    def sigterm_handler(self, signum, stack):
-        if self.table:
-            self.table.sync()
-        self.quit()
-        self.requestqueue.put((None, None))
-
-    def process_request(self, request, client_address):
-        self.requestqueue.put((request, client_address))
+        self.quitflag = False
 
     def export(self, version=None, pkgarch=None, checksum=None, colinfo=True):
         try:
@@ -133,7 +76,6 @@ class PRServer(SimpleXMLRPCServer):
         """
         buff = io.StringIO()
         try:
-            self.table.sync()
             self.table.dump_db(buff)
             return buff.getvalue()
         except Exception as exc:
@@ -157,22 +99,147 @@ class PRServer(SimpleXMLRPCServer):
         except prserv.NotFoundError:
             logger.error("can not find value for (%s, %s)",version, checksum)
             return None
-        except sqlite3.Error as exc:
-            logger.error(str(exc))
-            return None
 
     def quit(self):
-        self.quitflag=True
-        os.write(self.quitpipeout, b"q")
-        os.close(self.quitpipeout)
-        return
+        self.quitflag = True
+        self.loop.stop()
+
+    async def commit(self):
+        """
+        Wait until every value handed out so far has been committed
+        """
+        future = self.next_commit
+        if future is None:
+            future = self.next_commit = self.loop.create_future()
+            if self.commit_task is None:
+                self.commit_task = asyncio.ensure_future(self.commit_worker())
+        await asyncio.shield(future)
+
+    async def commit_worker(self):
+        try:
+            while self.next_commit is not None:
+                future, self.next_commit = self.next_commit, None
+                rows = self.table.take_pending()
+                try:
+                    await self.loop.run_in_executor(self.writer, self.table.write, rows)
+                    future.set_result(None)
+                except Exception as e:
+                    logger.error("Unable to commit %d PR values: %s" % (len(rows), str(e)))
+                    future.set_exception(e)
+        finally:
+            self.commit_task = None
+
+    async def sync_values(self):
+        # Reply once the values are in the database, and also when the
+        # values were handed out by another request whose commit is still
+        # running
+        if self.table.dirty or self.commit_task is not None:
+            await self.commit()
+
+    async def read_db(self, func, *args):
+        # The database is only used by the writer thread, so write out the
+        # pending values there first and then run func after them
+        rows = self.table.take_pending()
+        def read():
+            self.table.write(rows)
+            return func(*args)
+        return await self.loop.run_in_executor(self.writer, read)
+
+    async def handle_get_pr(self, request):
+        value = self.getPR(request['version'], request['pkgarch'], request['checksum'])
+        await self.sync_values()
+        return value
+
+    async def handle_get_prs(self, request):
+        values = [self.getPR(version, pkgarch, checksum) for (version, pkgarch, checksum) in request]
+        await self.sync_values()
+        return values
+
+    async def handle_import_one(self, request):
+        value = self.importone(request['version'], request['pkgarch'], request['checksum'], request['value'])
+        await self.sync_values()
+        return value
+
+    async def handle_export(self, request):
+        return await self.read_db(self.export, request['version'], request['pkgarch'], request['checksum'], request['colinfo'])
+
+    async def handle_dump_db(self, request):
+        return await self.read_db(self.dump_db)
+
+    async def handle_ping(self, request):
+        return self.ping()
+
+    async def handle_quit(self, request):
+        self.loop.call_soon(self.quit)
+        return 'ok'
+
+    async def process_requests(self, reader, writer):
+        handlers = {
+            'get-pr': self.handle_get_pr,
+            'get-prs': self.handle_get_prs,
+            'import-one': self.handle_import_one,
+            'export': self.handle_export,
+            'dump-db': self.handle_dump_db,
+            'ping': self.handle_ping,
+            'quit': self.handle_quit,
+        }
+
+        try:
+            # Read the protocol and version, then the headers up to an empty
+            # line. No headers are implemented yet.
+            protocol = await reader.readline()
+            protocol = protocol.decode('utf-8').rstrip()
+            if protocol != prserv.client.PRClient.PROTOCOL:
+                if protocol.endswith(('HTTP/1.0', 'HTTP/1.1')):
+                    # An XML-RPC client from an older version of bitbake.
+                    # The reason is shown in the client's ProtocolError.
+                    logger.warning('Rejected XML-RPC request from an older PR service client')
+                    writer.write(b'HTTP/1.0 400 This PR server no longer supports XML-RPC, '
+                                 b'upgrade the client to the same version of bitbake\r\n'
+                                 b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                    await writer.drain()
+                return
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if not line.rstrip():
+                    break
+
+            while True:
+                l = await reader.readline()
+                if not l:
+                    break
+
+                d = json.loads(l.decode('utf-8'))
+                for k in handlers.keys():
+                    if k in d:
+                        try:
+                            reply = await handlers[k](d[k])
+                        except sqlite3.Error as exc:
+                            logger.error(str(exc))
+                            reply = None
+                        break
+                else:
+                    logger.warning("Unrecognized command %r" % d)
+                    reply = {'error': 'Unrecognized command'}
+
+                writer.write(('%s\n' % json.dumps(reply)).encode('utf-8'))
+                await writer.drain()
+        except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+            logger.error('Bad message from client: %s' % str(exc))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def handle_client(self, reader, writer):
+        task = asyncio.ensure_future(self.process_requests(reader, writer))
+        self.clients.add(task)
+        task.add_done_callback(self.clients.discard)
 
     def work_forever(self,):
         self.quitflag = False
-        # This timeout applies to the poll in TCPServer, we need the select 
-        # below to wake on our quit pipe closing. We only ever call into handle_request
-        # if there is data there.
-        self.timeout = 0.01
 
         bb.utils.set_process_name("PRServ")
 
@@ -183,18 +250,31 @@ class PRServer(SimpleXMLRPCServer):
         logger.info("Started PRServer with DBfile: %s, IP: %s, PORT: %s, PID: %s" %
                      (self.dbfile, self.host, self.port, str(os.getpid())))
 
-        self.handlerthread.start()
-        while not self.quitflag:
-            ready = select.select([self.fileno(), self.quitpipein], [], [], 30)
-            if self.quitflag:
-                break
-            if self.fileno() in ready[0]:
-                self.handle_request()
-        self.handlerthread.join()
-        self.db.disconnect()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # The database is only used from this thread once the loop is running
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.next_commit = None
+        self.commit_task = None
+        self.clients = set()
+
+        self.loop.add_signal_handler(signal.SIGTERM, self.quit)
+        self.loop.add_signal_handler(signal.SIGINT, lambda: asyncio.ensure_future(self.commit()))
+
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, sock=self.socket))
+        self.loop.run_forever()
+
         logger.info("PRServer: stopping...")
-        self.server_close()
-        os.close(self.quitpipein)
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        for task in list(self.clients):
+            task.cancel()
+        if self.clients:
+            self.loop.run_until_complete(asyncio.wait(list(self.clients)))
+        self.loop.run_until_complete(self.commit())
+        self.writer.shutdown()
+        self.db.disconnect()
+        self.loop.close()
         return
 
     def start(self):
@@ -253,8 +333,6 @@ class PRServer(SimpleXMLRPCServer):
         os._exit(0)
 
     def cleanup_handles(self):
-        signal.signal(signal.SIGINT, self.sigint_handler)
-        signal.signal(signal.SIGTERM, self.sigterm_handler)
         os.chdir("/")
 
         sys.stdout.flush()
@@ -321,7 +399,7 @@ class PRServerConnection(object):
             host, port = singleton.getinfo()
         self.host = host
         self.port = port
-        self.connection, self.transport = bb.server.xmlrpcclient._create_server(self.host, self.port)
+        self.connection = prserv.client.PRClient(self.host, self.port)
 
     def terminate(self):
         try:
@@ -329,10 +407,14 @@ class PRServerConnection(object):
             self.connection.quit()
         except Exception as exc:
             sys.stderr.write("%s\n" % str(exc))
+        self.connection.close()
 
     def getPR(self, version, pkgarch, checksum):
         return self.connection.getPR(version, pkgarch, checksum)
 
+    def getPRs(self, queries):
+        return self.connection.getPRs(queries)
+
     def ping(self):
         return self.connection.ping()
 
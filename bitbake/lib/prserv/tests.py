@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import prserv.client
+import prserv.db
+import prserv.serv
+
+
+class TestPRTable(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='bb-prserv')
+        self.dbfile = os.path.join(self.temp_dir.name, 'prserv.sqlite3')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def open_table(self, nohist=True):
+        db = prserv.db.PRData(self.dbfile, nohist=nohist)
+        self.addCleanup(db.disconnect)
+        return db['PRMAIN']
+
+    def test_nohist(self):
+        table = self.open_table()
+        self.assertEqual(table.getValue('1.0', 'x86', 'a'), 0)
+        self.assertEqual(table.getValue('1.0', 'x86', 'b'), 1)
+        self.assertEqual(table.getValue('1.0', 'x86', 'b'), 1)
+        # Going back to an old checksum never decrements the value
+        self.assertEqual(table.getValue('1.0', 'x86', 'a'), 2)
+        self.assertEqual(table.getValue('1.0', 'arm', 'a'), 0)
+        self.assertEqual(table.importone('1.0', 'x86', 'c', 10), 10)
+        self.assertEqual(table.importone('1.0', 'x86', 'c', 5), 10)
+        self.assertEqual(table.getValue('1.0', 'x86', 'd'), 11)
+
+    def test_hist(self):
+        table = self.open_table(nohist=False)
+        self.assertEqual(table.getValue('1.0', 'x86', 'a'), 0)
+        self.assertEqual(table.getValue('1.0', 'x86', 'b'), 1)
+        self.assertEqual(table.getValue('1.0', 'x86', 'a'), 0)
+        self.assertEqual(table.importone('1.0', 'x86', 'a', 10), 0)
+        self.assertEqual(table.importone('1.0', 'x86', 'c', 10), 10)
+
+    def test_persistence(self):
+        table = self.open_table()
+        table.getValue('1.0', 'x86', 'a')
+        table.getValue('1.0', 'x86', 'b')
+        self.assertTrue(table.dirty)
+        rows = table.take_pending()
+        self.assertFalse(table.dirty)
+        self.assertEqual(sorted(rows), [('1.0', 'x86', 'a', 0), ('1.0', 'x86', 'b', 1)])
+        table.write(rows)
+        table.conn.close()
+
+        # The values are loaded back into the index
+        table = self.open_table()
+        self.assertEqual(table.getValue('1.0', 'x86', 'b'), 1)
+        self.assertEqual(table.getValue('1.0', 'x86', 'c'), 2)
+        self.assertEqual(table.export(None, None, None, False)[1],
+                         [{'version': '1.0', 'pkgarch': 'x86', 'checksum': 'b', 'value': 1}])
+
+
+class TestPRServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix='bb-prserv')
+        self.dbfile = os.path.join(self.temp_dir.name, 'prserv.sqlite3')
+        self.logfile = os.path.join(self.temp_dir.name, 'prserv.log')
+        self.start_server()
+
+    def tearDown(self):
+        self.stop_server()
+        self.temp_dir.cleanup()
+
+    def start_server(self):
+        self.server = prserv.serv.PRServer(self.dbfile, self.logfile, ('localhost', 0), daemon=False)
+        self.server.start()
+        self.conn = prserv.serv.PRServerConnection(*self.server.getinfo())
+
+    def stop_server(self):
+        if self.server is not None:
+            self.conn.terminate()
+            os.waitpid(self.server.pid, 0)
+            self.server = None
+
+    def test_getpr(self):
+        self.assertTrue(self.conn.ping())
+        self.assertEqual(self.conn.getPR('1.0', 'x86', 'a'), 0)
+        self.assertEqual(self.conn.getPR('1.0', 'x86', 'b'), 1)
+        self.assertEqual(self.conn.getPR('1.0', 'x86', 'b'), 1)
+        self.assertEqual(self.conn.getPR('1.0', 'x86', 'a'), 2)
+
+    def test_getprs(self):
+        self.conn.connection.MAX_BATCH = 3
+        queries = [('1.0', 'x86', str(i // 2)) for i in range(10)]
+        self.assertEqual(self.conn.getPRs(queries), [0, 0, 1, 1, 2, 2, 3, 3, 4, 4])
+        self.assertEqual(self.conn.getPRs([]), [])
+        self.assertEqual(self.conn.getPR('1.0', 'x86', '4'), 4)
+
+    def test_export_import(self):
+        self.conn.getPR('1.0', 'x86', 'a')
+        self.assertEqual(self.conn.importone('1.0', 'arm', 'b', 7), 7)
+        (metainfo, datainfo) = self.conn.export(None, None, None, True)
+        self.assertEqual(metainfo['tbl_name'], 'PRMAIN_nohist')
+        self.assertEqual(sorted((d['pkgarch'], d['checksum'], d['value']) for d in datainfo),
+                         [('arm', 'b', 7), ('x86', 'a', 0)])
+        self.assertIn('PRMAIN_nohist', self.conn.dump_db())
+
+    def test_restart(self):
+        self.conn.getPRs([('1.0', 'x86', 'a'), ('1.0', 'x86', 'b')])
+        self.stop_server()
+
+        # Every value handed out was committed before the reply was sent
+        with sqlite3.connect(self.dbfile) as db:
+            rows = db.execute('SELECT checksum, value FROM PRMAIN_nohist ORDER BY value').fetchall()
+        self.assertEqual(rows, [('a', 0), ('b', 1)])
+
+        self.start_server()
+        self.assertEqual(self.conn.getPR('1.0', 'x86', 'c'), 2)
+
+    def test_concurrent(self):
+        NUM_CLIENTS = 20
+        NUM_QUERIES = 50
+        results = []
+        lock = threading.Lock()
+
+        def query_server(n):
+            conn = prserv.serv.PRServerConnection(*self.server.getinfo())
+            values = [conn.getPR('1.0', 'x86', 'c%d-%d' % (n, i)) for i in range(NUM_QUERIES)]
+            conn.connection.close()
+            with lock:
+                results.extend(values)
+
+        threads = [threading.Thread(target=query_server, args=(n,)) for n in range(NUM_CLIENTS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Every new checksum got its own value
+        self.assertEqual(sorted(results), list(range(NUM_CLIENTS * NUM_QUERIES)))
+
+    def test_xmlrpc_client(self):
+        # A client from before the streaming protocol gets a clear error
+        import xmlrpc.client
+        proxy = xmlrpc.client.ServerProxy('http://%s:%d/' % self.server.getinfo())
+        with self.assertRaises(xmlrpc.client.ProtocolError) as cm:
+            proxy.ping()
+        self.assertIn('no longer supports XML-RPC', cm.exception.errmsg)
+        # The server is still usable
+        self.assertTrue(self.conn.ping())
+
+
+class TestPRClient(unittest.TestCase):
+    def test_xmlrpc_server(self):
+        # Talking to a server from before the streaming protocol fails
+        # straight away with a clear error
+        from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+        class QuietHandler(SimpleXMLRPCRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        server = SimpleXMLRPCServer(('localhost', 0), requestHandler=QuietHandler, logRequests=False)
+        server.register_function(lambda: True, 'ping')
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = prserv.client.PRClient(*server.server_address)
+        self.addCleanup(client.close)
+        with self.assertRaises(prserv.client.PRProtocolError) as cm:
+            client.ping()
+        self.assertIn('XML-RPC', str(cm.exception))
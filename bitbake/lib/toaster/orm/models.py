@@ -1072,13 +1072,6 @@ class Task(models.Model):
 
     search_allowed_fields = [ "recipe__name", "recipe__version", "task_name", "logfile" ]
 
-    def __init__(self, *args, **kwargs):
-        super(Task, self).__init__(*args, **kwargs)
-        try:
-            self._helptext = HelpText.objects.get(key=self.task_name, area=HelpText.VARIABLE, build=self.build).text
-        except HelpText.DoesNotExist:
-            self._helptext = None
-
     def get_related_setscene(self):
         return Task.objects.filter(task_executed=True, build = self.build, recipe = self.recipe, task_name=self.task_name+"_setscene")
 
@@ -1100,6 +1093,12 @@ class Task(models.Model):
         return "Not Executed"
 
     def get_description(self):
+        # Looked up on first use rather than for every Task instantiated
+        if not hasattr(self, '_helptext'):
+            try:
+                self._helptext = HelpText.objects.get(key=self.task_name, area=HelpText.VARIABLE, build=self.build).text
+            except HelpText.DoesNotExist:
+                self._helptext = None
         return self._helptext
 
     build = models.ForeignKey(Build, related_name='task_build')
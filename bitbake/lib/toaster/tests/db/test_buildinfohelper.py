@@ -0,0 +1,213 @@
+#! /usr/bin/env python3
+#
+# BitBake Toaster Implementation
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+"""Test storing build information through buildinfohelper's ORMWrapper"""
+
+from django.test import TestCase
+from django.utils import timezone
+
+# puts bitbake's lib directory on sys.path
+import bldcontrol.bbcontroller
+
+from bb.ui.buildinfohelper import BuildInfoHelper, ORMWrapper
+from orm.models import Project, Build, Target, Target_File
+from orm.models import Layer, Layer_Version, Task, Task_Dependency
+
+
+def entry(mode, path, size=4096):
+    """An entry of files-in-image.txt, as split by toaster.bbclass"""
+    return [mode, "root", "root", str(size), "." + path]
+
+def symlink(path, target):
+    return entry("lrwxrwxrwx", path, len(target)) + ["->", target]
+
+
+class SaveTargetFileInformation(TestCase):
+    """Test storing the files of an image"""
+
+    def setUp(self):
+        project = Project.objects.get_or_create_default_project()
+        now = timezone.now()
+        self.build = Build.objects.create(project=project,
+                                          started_on=now,
+                                          completed_on=now)
+        self.target = Target.objects.create(build=self.build,
+                                            target="core-image-minimal",
+                                            is_image=True)
+
+    def _save(self, dirs, files, syms):
+        filedata = {'dirs': dirs, 'files': files, 'syms': syms}
+        ORMWrapper().save_target_file_information(self.build, self.target, filedata)
+
+    def _stored(self):
+        stored = {}
+        for tf in Target_File.objects.filter(target=self.target).select_related('directory', 'sym_target'):
+            stored[tf.path] = (tf.inodetype,
+                               tf.directory.path if tf.directory else None,
+                               tf.sym_target.path if tf.sym_target else None)
+        return stored
+
+    def test_save_target_file_information(self):
+        """Test the directory and symlink target of each entry"""
+        dirs = [entry("drwxr-xr-x", path) for path in
+                ("", "/usr/lib/modules", "/bin", "/etc", "/etc/init.d",
+                 "/usr", "/usr/lib", "/dev")]
+        files = [entry("-rwxr-xr-x", "/bin/busybox", 500000),
+                 entry("-rw-r--r--", "/etc/hostname", 10),
+                 entry("-rwxr-xr-x", "/usr/lib/libz.so.1.2.11", 90000),
+                 entry("crw-rw-rw-", "/dev/null", 0),
+                 entry("prw-r--r--", "/dev/initctl", 0),
+                 entry("-rw-r--r--", "/version", 20)]
+        syms = [symlink("/bin/sh", "busybox"),
+                symlink("/usr/lib/libz.so", "libz.so.1"),
+                symlink("/usr/lib/libz.so.1", "libz.so.1.2.11"),
+                symlink("/lib", "usr/lib"),
+                symlink("/etc/init.d/rcS", "../../bin/busybox"),
+                symlink("/etc/mtab", "/proc/mounts")]
+        self._save(dirs, files, syms)
+
+        self.assertEqual(self._stored(), {
+            "/": (Target_File.ITYPE_DIRECTORY, None, None),
+            "/bin": (Target_File.ITYPE_DIRECTORY, "/", None),
+            "/dev": (Target_File.ITYPE_DIRECTORY, "/", None),
+            "/etc": (Target_File.ITYPE_DIRECTORY, "/", None),
+            "/etc/init.d": (Target_File.ITYPE_DIRECTORY, "/etc", None),
+            "/usr": (Target_File.ITYPE_DIRECTORY, "/", None),
+            "/usr/lib": (Target_File.ITYPE_DIRECTORY, "/usr", None),
+            "/usr/lib/modules": (Target_File.ITYPE_DIRECTORY, "/usr/lib", None),
+            "/bin/busybox": (Target_File.ITYPE_REGULAR, "/bin", None),
+            "/etc/hostname": (Target_File.ITYPE_REGULAR, "/etc", None),
+            "/usr/lib/libz.so.1.2.11": (Target_File.ITYPE_REGULAR, "/usr/lib", None),
+            "/dev/null": (Target_File.ITYPE_CHARACTER, "/dev", None),
+            "/dev/initctl": (Target_File.ITYPE_FIFO, "/dev", None),
+            "/version": (Target_File.ITYPE_REGULAR, "/", None),
+            "/bin/sh": (Target_File.ITYPE_SYMLINK, "/bin", "/bin/busybox"),
+            "/usr/lib/libz.so": (Target_File.ITYPE_SYMLINK, "/usr/lib", "/usr/lib/libz.so.1"),
+            "/usr/lib/libz.so.1": (Target_File.ITYPE_SYMLINK, "/usr/lib", "/usr/lib/libz.so.1.2.11"),
+            "/lib": (Target_File.ITYPE_SYMLINK, "/", "/usr/lib"),
+            "/etc/init.d/rcS": (Target_File.ITYPE_SYMLINK, "/etc/init.d", "/bin/busybox"),
+            "/etc/mtab": (Target_File.ITYPE_SYMLINK, "/etc", None),
+        })
+
+    def test_missing_directory(self):
+        """Test a KeyError is raised for entries in unknown directories"""
+        with self.assertRaises(KeyError):
+            self._save([], [entry("-rw-r--r--", "/etc/hostname", 10)], [])
+
+    def test_save_large_image(self):
+        """Test storing an image with many directories, files and symlinks"""
+        dirs = []
+        files = []
+        syms = []
+        for i in range(50):
+            for j in range(50):
+                path = "/usr/share/dir%d/subdir%d" % (i, j)
+                files.extend(entry("-rw-r--r--", "%s/file%d" % (path, k), k) for k in range(20))
+                syms.append(symlink("%s/link" % path, "file0"))
+                dirs.append(entry("drwxr-xr-x", path))
+            dirs.append(entry("drwxr-xr-x", "/usr/share/dir%d" % i))
+        dirs.extend(entry("drwxr-xr-x", path) for path in ("/usr", "/usr/share"))
+
+        self._save(dirs, files, syms)
+
+        self.assertEqual(Target_File.objects.filter(target=self.target).count(),
+                         1 + len(dirs) + len(files) + len(syms))
+        link = Target_File.objects.get(target=self.target, path="/usr/share/dir49/subdir49/link")
+        self.assertEqual(link.directory.path, "/usr/share/dir49/subdir49")
+        self.assertEqual(link.sym_target.path, "/usr/share/dir49/subdir49/file0")
+
+
+class ServerStub(object):
+    """Answers the getVariable commands of BuildInfoHelper"""
+
+    def __init__(self, variables):
+        self.variables = variables
+
+    def runCommand(self, command):
+        assert command[0] == "getVariable"
+        return self.variables.get(command[1], ""), None
+
+
+class DepgraphEvent(object):
+    """The parts of a DepTreeGenerated event used by buildinfohelper"""
+
+    def __init__(self, depgraph):
+        self._depgraph = depgraph
+
+
+class StoreDependencyInformation(TestCase):
+    """Test storing the tasks and task dependencies of a depgraph"""
+
+    def setUp(self):
+        project = Project.objects.get_or_create_default_project()
+        now = timezone.now()
+        self.build = Build.objects.create(project=project,
+                                          started_on=now,
+                                          completed_on=now)
+        layer = Layer.objects.create(name="meta")
+        self.layer_version = Layer_Version.objects.create(layer=layer,
+                                                          build=self.build,
+                                                          local_path="/layers/meta")
+        self.helper = BuildInfoHelper(ServerStub({"BUILDNAME": "20161017000000"}))
+        self.helper.internal_state['build'] = self.build
+        self.helper.orm_wrapper.layer_version_objects.append(self.layer_version)
+
+    def _recipe(self, file_path):
+        return self.helper.orm_wrapper.get_update_recipe_object({
+            'layer_version': self.layer_version,
+            'file_path': file_path,
+            'pathflags': ''})
+
+    def _tasks(self):
+        return {"%s.%s" % (task.recipe.name, task.task_name): task
+                for task in Task.objects.filter(build=self.build)}
+
+    def test_store_dependency_information(self):
+        """Test tasks only found as dependencies and tasks already known are stored once"""
+        # a task stored before the depgraph arrives, as done for the tasks
+        # the build has already started
+        zlib = self._recipe("recipes/zlib/zlib_1.2.11.bb")
+        known = self.helper.orm_wrapper.get_update_task_object({
+            'build': self.build,
+            'recipe': zlib,
+            'task_name': 'do_configure'})
+
+        depgraph = {
+            'layer-priorities': [],
+            'pn': {
+                'zlib': {'filename': "/layers/meta/recipes/zlib/zlib_1.2.11.bb",
+                         'version': ":1.2.11-r0"},
+                'quilt-native': {'filename': "virtual:native:/layers/meta/recipes/quilt/quilt_0.66.bb",
+                                 'version': ":0.66-r0"},
+            },
+            'depends': {'zlib': ['quilt-native'], 'quilt-native': []},
+            # zlib.do_fetch and quilt-native.do_populate_sysroot are only
+            # found as dependencies
+            'tdepends': {
+                'zlib.do_configure': ['zlib.do_fetch', 'quilt-native.do_populate_sysroot'],
+                'zlib.do_compile': ['zlib.do_configure'],
+            },
+        }
+        self.helper.store_dependency_information(DepgraphEvent(depgraph))
+
+        self.assertEqual(Task.objects.filter(build=self.build).count(), 4)
+        tasks = self._tasks()
+        self.assertEqual(sorted(tasks), ['quilt-native.do_populate_sysroot',
+                                         'zlib.do_compile',
+                                         'zlib.do_configure',
+                                         'zlib.do_fetch'])
+        self.assertEqual(tasks['zlib.do_configure'].id, known.id)
+        self.assertEqual(tasks['zlib.do_configure'].recipe.id, zlib.id)
+        for task in tasks.values():
+            self.assertEqual(task.outcome, Task.OUTCOME_NA)
+
+        deps = sorted(("%s.%s" % (dep.task.recipe.name, dep.task.task_name),
+                       "%s.%s" % (dep.depends_on.recipe.name, dep.depends_on.task_name))
+                      for dep in Task_Dependency.objects.filter(task__build=self.build))
+        self.assertEqual(deps, [('zlib.do_compile', 'zlib.do_configure'),
+                                ('zlib.do_configure', 'quilt-native.do_populate_sysroot'),
+                                ('zlib.do_configure', 'zlib.do_fetch')])
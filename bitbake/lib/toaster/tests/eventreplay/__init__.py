@@ -16,6 +16,7 @@ using toaster-eventreplay script
 """
 
 import os
+import time
 
 from subprocess import getstatusoutput
 from pathlib import Path
@@ -23,6 +24,7 @@ from pathlib import Path
 from django.test import TestCase
 
 from orm.models import Target_Installed_Package, Package, Build
+from orm.models import Task, Task_Dependency, Target_File
 
 class EventReplay(TestCase):
     """Base class for eventreplay test cases"""
@@ -83,3 +85,21 @@ class ZlibEventReplay(EventReplay):
 
         self.assertEqual(Build.objects.last().target_set.last().target, "zlib")
         self.assertTrue('zlib' in Package.objects.values_list('name', flat=True))
+
+class ReplayBenchmark(EventReplay):
+    """Measure how long storing the events of each log takes"""
+
+    def test_replay_time(self):
+        """Replay all the event logs found in EVENTREPLAY_DIR"""
+        eventfiles = sorted(Path(self.eventplay_dir).glob("*.events"))
+        self.assertTrue(eventfiles, "No event logs in %s" % self.eventplay_dir)
+        for eventfile in eventfiles:
+            start = time.time()
+            self._replay(eventfile.name)
+            elapsed = time.time() - start
+            build = Build.objects.last()
+            print("\nReplayed %s in %.2fs: %d tasks, %d task dependencies, %d target files"
+                  % (eventfile.name, elapsed,
+                     Task.objects.filter(build=build).count(),
+                     Task_Dependency.objects.filter(task__build=build).count(),
+                     Target_File.objects.filter(target__build=build).count()))
@@ -4,11 +4,43 @@
 # Implements system state sampling. Called by buildstats.bbclass.
 # Because it is a real Python module, it can hold persistent state,
 # like open log files and the time of the last sampling.
+#
+# Also writes the build's event log, see write_record().
 
+import importlib.util
+import json
+import os
 import time
 import re
 import bb.event
 
+def _load_reader():
+    # The event log format is defined in scripts/lib/buildstats.py, which
+    # has the same module name as this one, so it is loaded by path
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "scripts", "lib", "buildstats.py")
+    spec = importlib.util.spec_from_file_location("scripts_buildstats", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+_reader = _load_reader()
+EVENT_LOG = _reader.EVENT_LOG
+read_event_log = _reader.read_event_log
+
+def write_record(bsdir, record):
+    """
+    Append a record to the event log of the build. Tasks run in parallel
+    processes which all log to the same file, so the record is written
+    with a single write() to a file opened with O_APPEND; the kernel then
+    never interleaves it with the records of other processes.
+    """
+    data = (json.dumps(record, sort_keys=True) + "\n").encode("utf-8")
+    fd = os.open(os.path.join(bsdir, EVENT_LOG), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
 class SystemStats:
     def __init__(self, d):
         bn = d.getVar('BUILDNAME')
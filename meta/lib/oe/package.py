@@ -70,20 +70,38 @@ def is_kernel_module_signed(path):
 # 8 - shared library
 # 16 - kernel module
 def is_elf(path):
+    import oe.qa
+
     exec_type = 0
-    result = subprocess.check_output(["file", "-b", path], stderr=subprocess.STDOUT).decode("utf-8")
+    # Like file(1), don't follow symlinks
+    if os.path.islink(path):
+        return (path, exec_type)
+
+    with oe.qa.ELFFile(path) as elf:
+        try:
+            elf.open()
+        except (IOError, oe.qa.NotELFFileError):
+            return (path, exec_type)
 
-    if "ELF" in result:
         exec_type |= 1
-        if "not stripped" not in result:
-            exec_type |= 2
-        if "executable" in result:
-            exec_type |= 4
-        if "shared" in result:
-            exec_type |= 8
-        if "relocatable" in result:
-            if path.endswith(".ko") and path.find("/lib/modules/") != -1 and is_kernel_module(path):
-                exec_type |= 16
+        elf_type = elf.elfType()
+        try:
+            if not elf.hasSymtab():
+                exec_type |= 2
+            if elf_type == oe.qa.ELFFile.ET_EXEC:
+                exec_type |= 4
+            elif elf_type == oe.qa.ELFFile.ET_DYN:
+                # file(1) reports position independent executables as
+                # "pie executable" rather than "shared object"
+                if elf.dynamic().flags_1 & oe.qa.ELFFile.DF_1_PIE:
+                    exec_type |= 4
+                else:
+                    exec_type |= 8
+            elif elf_type == oe.qa.ELFFile.ET_REL:
+                if path.endswith(".ko") and path.find("/lib/modules/") != -1 and is_kernel_module(path):
+                    exec_type |= 16
+        except oe.qa.NotELFFileError as e:
+            bb.note(str(e))
     return (path, exec_type)
 
 def is_static_lib(path):
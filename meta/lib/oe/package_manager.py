@@ -17,6 +17,7 @@ import string
 from oe.gpg_sign import get_signer
 import hashlib
 import fnmatch
+import time
 
 # this can be used by all PM backends to create the index files in parallel
 def create_index(arg):
@@ -427,12 +428,60 @@ class PackageManager(object, metaclass=ABCMeta):
                 self._handle_intercept_failure(registered_pkgs)
 
 
+    def _intercept_depends(self, postinst_intercept_hook):
+        """
+        Return the names of the intercept hooks that must have completed
+        before the given one runs, listed on its "##DEPENDS:" line
+        """
+        with open(postinst_intercept_hook) as intercept:
+            for line in intercept.read().split("\n"):
+                m = re.match(r"^##DEPENDS:(.*)", line)
+                if m is not None:
+                    return m.group(1).split()
+        return []
+
+    def _run_intercept(self, script_full):
+        start = time.time()
+        p = subprocess.run(script_full, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return (p.returncode, p.stdout.decode("utf-8"), time.time() - start)
+
+    def _handle_intercept_result(self, script, script_full, returncode, output, populate_sdk):
+        if returncode == 0:
+            if output: bb.note(output)
+            return
+
+        bb.note("Exit code %d. Output:\n%s" % (returncode, output))
+        if populate_sdk == 'host':
+            bb.fatal("The postinstall intercept hook '%s' failed, details in %s/log.do_%s" % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
+        elif populate_sdk == 'target':
+            if "qemuwrapper: qemu usermode is not supported" in output:
+                bb.note("The postinstall intercept hook '%s' could not be executed due to missing qemu usermode support, details in %s/log.do_%s"
+                        % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
+            else:
+                bb.fatal("The postinstall intercept hook '%s' failed, details in %s/log.do_%s" % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
+        else:
+            if "qemuwrapper: qemu usermode is not supported" in output:
+                bb.note("The postinstall intercept hook '%s' could not be executed due to missing qemu usermode support, details in %s/log.do_%s"
+                        % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
+                self._postpone_to_first_boot(script_full)
+            else:
+                bb.fatal("The postinstall intercept hook '%s' failed, details in %s/log.do_%s" % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
+
     def run_intercepts(self, populate_sdk=None):
+        """
+        Run the intercept hooks registered by the postinstall scriptlets.
+        Hooks run concurrently, up to BB_NUMBER_THREADS at a time, except
+        that a hook only starts once the hooks named on its "##DEPENDS:"
+        line, and their multilib variants, have completed.
+        """
+        import concurrent.futures
+
         intercepts_dir = self.intercepts_dir
 
         bb.note("Running intercept scripts:")
         os.environ['D'] = self.target_rootfs
         os.environ['STAGING_DIR_NATIVE'] = self.d.getVar('STAGING_DIR_NATIVE')
+        scripts = {}
         for script in os.listdir(intercepts_dir):
             script_full = os.path.join(intercepts_dir, script)
 
@@ -449,28 +498,36 @@ class PackageManager(object, metaclass=ABCMeta):
                                 % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
                 continue
 
-            bb.note("> Executing %s intercept ..." % script)
-
-            try:
-                output = subprocess.check_output(script_full, stderr=subprocess.STDOUT)
-                if output: bb.note(output.decode("utf-8"))
-            except subprocess.CalledProcessError as e:
-                bb.note("Exit code %d. Output:\n%s" % (e.returncode, e.output.decode("utf-8")))
-                if populate_sdk == 'host':
-                    bb.fatal("The postinstall intercept hook '%s' failed, details in %s/log.do_%s" % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
-                elif populate_sdk == 'target':
-                    if "qemuwrapper: qemu usermode is not supported" in e.output.decode("utf-8"):
-                        bb.note("The postinstall intercept hook '%s' could not be executed due to missing qemu usermode support, details in %s/log.do_%s"
-                                % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
-                    else:
-                        bb.fatal("The postinstall intercept hook '%s' failed, details in %s/log.do_%s" % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
-                else:
-                    if "qemuwrapper: qemu usermode is not supported" in e.output.decode("utf-8"):
-                        bb.note("The postinstall intercept hook '%s' could not be executed due to missing qemu usermode support, details in %s/log.do_%s"
-                                % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
-                        self._postpone_to_first_boot(script_full)
-                    else:
-                        bb.fatal("The postinstall intercept hook '%s' failed, details in %s/log.do_%s" % (script, self.d.getVar('T'), self.d.getVar('BB_CURRENTTASK')))
+            scripts[script] = script_full
+
+        # Dependencies on hooks which aren't used in this rootfs are ignored
+        pending = {}
+        for script, script_full in scripts.items():
+            pending[script] = set()
+            for dep in self._intercept_depends(script_full):
+                pending[script].update(s for s in scripts if s == dep or s.startswith(dep + "-"))
+            pending[script].discard(script)
+
+        jobs = int(self.d.getVar("BB_NUMBER_THREADS") or oe.utils.cpu_count())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            running = {}
+            while pending or running:
+                for script in sorted(s for s in pending if not pending[s]):
+                    del pending[script]
+                    bb.note("> Executing %s intercept ..." % script)
+                    running[executor.submit(self._run_intercept, scripts[script])] = script
+
+                if not running:
+                    bb.fatal("Circular dependency between the postinstall intercept hooks %s" % ", ".join(sorted(pending)))
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in sorted(done, key=lambda f: running[f]):
+                    script = running.pop(future)
+                    (returncode, output, elapsed) = future.result()
+                    bb.note("< %s intercept finished in %.2fs" % (script, elapsed))
+                    self._handle_intercept_result(script, scripts[script], returncode, output, populate_sdk)
+                    for deps in pending.values():
+                        deps.discard(script)
 
     @abstractmethod
     def update(self):
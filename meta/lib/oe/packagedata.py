@@ -3,6 +3,7 @@
 #
 
 import codecs
+import contextlib
 import os
 
 def packaged(pkg, d):
@@ -96,3 +97,199 @@ def recipename(pkg, d):
     """Return the recipe name for the given binary package name."""
 
     return pkgmap(d).get(pkg)
+
+#
+# Index of the files in each runtime package, used to answer path queries
+# without reading every pkgdata file. The index is a cache of the FILES_INFO
+# and PKG_* entries of ${PKGDATA_DIR}/runtime/*: each package records the
+# mtime and size of its pkgdata file, and packages whose file changed or
+# disappeared are refreshed before the index is queried.
+#
+FILES_INDEX = "files-index.sqlite"
+FILES_INDEX_VERSION = 1
+
+def _files_index_connect(pkgdata_dir):
+    import sqlite3
+
+    conn = sqlite3.connect(os.path.join(pkgdata_dir, FILES_INDEX), timeout=60, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != FILES_INDEX_VERSION:
+            conn.execute("DROP TABLE IF EXISTS packages")
+            conn.execute("DROP TABLE IF EXISTS files")
+            conn.execute("CREATE TABLE packages (pkg TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, pkgname TEXT, hasfiles INTEGER)")
+            conn.execute("CREATE TABLE files (path TEXT, pkg TEXT, size INTEGER)")
+            conn.execute("CREATE INDEX files_path ON files (path)")
+            conn.execute("CREATE INDEX files_pkg ON files (pkg)")
+            conn.execute("PRAGMA user_version = %d" % FILES_INDEX_VERSION)
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        conn.close()
+        raise
+    return conn
+
+def _read_files_index_entry(fn, pkg):
+    """
+    Return (runtime package name, {path: size}) from the pkgdata file of
+    the given package. Either may be None if the file has no such entry.
+    """
+    import json
+
+    pkgname = None
+    files = None
+    with open(fn, 'r') as f:
+        for line in f:
+            if line.startswith('FILES_INFO:'):
+                files = json.loads(line.split(':', 1)[1].strip())
+            elif pkgname is None and line.startswith('PKG_%s:' % pkg):
+                fields = line.rstrip().split(': ')
+                if fields[0] == 'PKG_%s' % pkg:
+                    pkgname = fields[1]
+    return (pkgname, files)
+
+def _update_files_index(conn, pkgdata_dir, pkgs=None):
+    runtime = os.path.join(pkgdata_dir, 'runtime')
+    current = {}
+    if pkgs is None:
+        try:
+            with os.scandir(runtime) as it:
+                for entry in it:
+                    if entry.name.endswith('.packaged') or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    current[entry.name] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+    else:
+        for pkg in pkgs:
+            try:
+                st = os.stat(os.path.join(runtime, pkg))
+                current[pkg] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        indexed = {}
+        for (pkg, mtime, size) in conn.execute("SELECT pkg, mtime, size FROM packages"):
+            if pkgs is None or pkg in pkgs:
+                indexed[pkg] = (mtime, size)
+
+        stale = set(pkg for pkg in indexed if indexed[pkg] != current.get(pkg))
+        for pkg in stale:
+            conn.execute("DELETE FROM packages WHERE pkg = ?", (pkg,))
+            conn.execute("DELETE FROM files WHERE pkg = ?", (pkg,))
+
+        for pkg in sorted(current):
+            if pkg in indexed and pkg not in stale:
+                continue
+            try:
+                (pkgname, files) = _read_files_index_entry(os.path.join(runtime, pkg), pkg)
+            except FileNotFoundError:
+                continue
+            conn.execute("INSERT INTO packages VALUES (?, ?, ?, ?, ?)",
+                         (pkg, current[pkg][0], current[pkg][1], pkgname, files is not None))
+            if files:
+                conn.executemany("INSERT INTO files VALUES (?, ?, ?)",
+                                 ((path, pkg, size) for (path, size) in files.items()))
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+
+def update_files_index(pkgdata_dir, pkgs=None):
+    """
+    Create or refresh the files index of the given pkgdata directory. If
+    pkgs is given only those runtime packages are refreshed.
+    """
+    conn = _files_index_connect(pkgdata_dir)
+    try:
+        _update_files_index(conn, pkgdata_dir, pkgs)
+    finally:
+        conn.close()
+
+class FilesIndex(object):
+    """
+    Read access to the files index of a pkgdata directory, refreshed when
+    opened. Use FilesIndex.open(), which returns None if the directory has
+    no index or it can't be refreshed, in which case callers should read
+    the pkgdata files directly.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    @classmethod
+    def open(cls, pkgdata_dir):
+        import sqlite3
+
+        if not os.path.exists(os.path.join(pkgdata_dir, FILES_INDEX)):
+            return None
+        try:
+            conn = _files_index_connect(pkgdata_dir)
+        except sqlite3.Error:
+            return None
+        try:
+            _update_files_index(conn, pkgdata_dir)
+        except (sqlite3.Error, OSError, ValueError):
+            conn.close()
+            return None
+        return cls(conn)
+
+    def close(self):
+        self.conn.close()
+
+    def find_path(self, pattern):
+        """
+        Return a sorted list of (package, path) for the packaged paths
+        matching the given fnmatch pattern
+        """
+        import fnmatch
+
+        prefix = pattern
+        for (i, c) in enumerate(pattern):
+            if c in '*?[':
+                prefix = pattern[:i]
+                break
+        else:
+            return list(self.conn.execute("SELECT pkg, path FROM files WHERE path = ? ORDER BY pkg, path", (pattern,)))
+
+        if prefix:
+            rows = self.conn.execute("SELECT pkg, path FROM files WHERE path >= ? AND path < ? ORDER BY pkg, path",
+                                     (prefix, prefix + '\U0010ffff'))
+        else:
+            rows = self.conn.execute("SELECT pkg, path FROM files ORDER BY pkg, path")
+        return [(pkg, path) for (pkg, path) in rows if fnmatch.fnmatchcase(path, pattern)]
+
+    def pkgname(self, pkg):
+        """
+        Return the runtime name of the given package, or None if it is
+        not known
+        """
+        row = self.conn.execute("SELECT pkgname FROM packages WHERE pkg = ?", (pkg,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def files(self, pkg):
+        """
+        Return {path: size} for the files in the given package, or None if
+        its pkgdata has no FILES_INFO entry
+        """
+        row = self.conn.execute("SELECT hasfiles FROM packages WHERE pkg = ?", (pkg,)).fetchone()
+        if not row or not row[0]:
+            return None
+        return dict(self.conn.execute("SELECT path, size FROM files WHERE pkg = ?", (pkg,)))
+
+@contextlib.contextmanager
+def files_index(pkgdata_dir):
+    """
+    Context manager giving the result of FilesIndex.open() for a pkgdata
+    directory, which may be None, and closing the index afterwards
+    """
+    index = FilesIndex.open(pkgdata_dir)
+    try:
+        yield index
+    finally:
+        if index:
+            index.close()
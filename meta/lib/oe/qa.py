@@ -31,8 +31,33 @@ class ELFFile:
     EI_DATA_LSB  = 1
     EI_DATA_MSB  = 2
 
+    E_TYPE       = 0x10
+
+    # possible values for e_type
+    ET_REL  = 1
+    ET_EXEC = 2
+    ET_DYN  = 3
+
     PT_INTERP = 3
 
+    # section types
+    SHT_SYMTAB  = 2
+    SHT_DYNAMIC = 6
+
+    # dynamic section tags
+    DT_NULL       = 0
+    DT_NEEDED     = 1
+    DT_SYMTAB     = 6
+    DT_SONAME     = 14
+    DT_RPATH      = 15
+    DT_TEXTREL    = 22
+    DT_RUNPATH    = 29
+    DT_GNU_HASH   = 0x6ffffef5
+    DT_FLAGS_1    = 0x6ffffffb
+    DT_MIPS_XHASH = 0x70000036
+
+    DF_1_PIE = 0x08000000
+
     def my_assert(self, expectation, result):
         if not expectation == result:
             #print "'%x','%x' %s" % (ord(expectation), ord(result), self.name)
@@ -42,6 +67,8 @@ class ELFFile:
         self.name = name
         self.objdump_output = {}
         self.data = None
+        self._sections = None
+        self._dynamic = None
 
     # Context Manager functions to close the mmap explicitly
     def __enter__(self):
@@ -106,6 +133,18 @@ class ELFFile:
     def getWord(self, offset):
         return struct.unpack_from(self.getStructEndian() + "i", self.data, offset)[0]
 
+    def getAddr(self, offset):
+        return struct.unpack_from(self.getStructEndian() + (self.bits == 32 and "I" or "Q"), self.data, offset)[0]
+
+    def getString(self, offset):
+        end = self.data.find(b"\0", offset)
+        if end == -1:
+            raise NotELFFileError("%s has an unterminated string" % self.name)
+        return self.data[offset:end].decode("utf-8", errors="replace")
+
+    def elfType(self):
+        return self.getShort(ELFFile.E_TYPE)
+
     def isDynamic(self):
         """
         Return True if there is a .interp segment (therefore dynamically
@@ -128,6 +167,142 @@ class ELFFile:
         """
         return self.getShort(ELFFile.E_MACHINE)
 
+    def sections(self):
+        """
+        Return the section headers as a list of ELFSection, parsed once
+        from the mapped file.
+        """
+        if self._sections is not None:
+            return self._sections
+
+        sections = []
+        try:
+            shoff = self.getAddr(self.bits == 32 and 0x20 or 0x28)
+            shentsize = self.getShort(self.bits == 32 and 0x2E or 0x3A)
+            shnum = self.getShort(self.bits == 32 and 0x30 or 0x3C)
+            shstrndx = self.getShort(self.bits == 32 and 0x32 or 0x3E)
+            if not shoff:
+                shnum = 0
+
+            if self.bits == 32:
+                fmt = self.getStructEndian() + "IIIIIIIIII"
+            else:
+                fmt = self.getStructEndian() + "IIQQQQIIQQ"
+
+            headers = []
+            for i in range(0, shnum):
+                (name, sh_type, flags, addr, offset, size, link, info, align, entsize) = \
+                    struct.unpack_from(fmt, self.data, shoff + i * shentsize)
+                headers.append((name, sh_type, offset, size, link, entsize))
+
+            strtab = headers[shstrndx][2] if shstrndx < len(headers) else None
+            for (name, sh_type, offset, size, link, entsize) in headers:
+                if strtab is not None:
+                    name = self.getString(strtab + name)
+                else:
+                    name = ""
+                sections.append(ELFSection(name, sh_type, offset, size, link, entsize))
+        except struct.error:
+            raise NotELFFileError("%s has truncated section headers" % self.name)
+
+        self._sections = sections
+        return self._sections
+
+    def hasSymtab(self):
+        """
+        Return True if the file has a symbol table, i.e. is not stripped.
+        """
+        return any(s.type == ELFFile.SHT_SYMTAB for s in self.sections())
+
+    def _parse_dynamic(self):
+        dynamic = ELFDynamic()
+        sections = self.sections()
+        if self.bits == 32:
+            fmt = self.getStructEndian() + "iI"
+        else:
+            fmt = self.getStructEndian() + "qQ"
+        entsize = struct.calcsize(fmt)
+
+        for section in sections:
+            if section.type != ELFFile.SHT_DYNAMIC:
+                continue
+            if section.link >= len(sections):
+                raise NotELFFileError("%s has a bad dynamic string table" % self.name)
+            strtab = sections[section.link].offset
+            try:
+                for offset in range(section.offset, section.offset + section.size, entsize):
+                    (tag, val) = struct.unpack_from(fmt, self.data, offset)
+                    if tag == ELFFile.DT_NULL:
+                        break
+                    dynamic.tags.add(tag)
+                    if tag == ELFFile.DT_NEEDED:
+                        dynamic.needed.append(self.getString(strtab + val))
+                    elif tag == ELFFile.DT_SONAME:
+                        dynamic.soname = self.getString(strtab + val)
+                    elif tag == ELFFile.DT_RPATH:
+                        dynamic.rpath = self.getString(strtab + val)
+                    elif tag == ELFFile.DT_RUNPATH:
+                        dynamic.runpath = self.getString(strtab + val)
+                    elif tag == ELFFile.DT_FLAGS_1:
+                        dynamic.flags_1 = val
+            except struct.error:
+                raise NotELFFileError("%s has a truncated dynamic section" % self.name)
+        return dynamic
+
+    def _parse_objdump_dynamic(self, d):
+        import re
+
+        names = {
+            "NEEDED": ELFFile.DT_NEEDED,
+            "SYMTAB": ELFFile.DT_SYMTAB,
+            "SONAME": ELFFile.DT_SONAME,
+            "RPATH": ELFFile.DT_RPATH,
+            "TEXTREL": ELFFile.DT_TEXTREL,
+            "RUNPATH": ELFFile.DT_RUNPATH,
+            "GNU_HASH": ELFFile.DT_GNU_HASH,
+            "MIPS_XHASH": ELFFile.DT_MIPS_XHASH,
+        }
+        dynamic = ELFDynamic()
+        dynamic_re = re.compile(r"\s+([A-Z0-9_]+)\s+([^\s]*)")
+        for line in self.run_objdump("-p", d).split("\n"):
+            m = dynamic_re.match(line)
+            if not m or m.group(1) not in names:
+                continue
+            tag = names[m.group(1)]
+            dynamic.tags.add(tag)
+            if tag == ELFFile.DT_NEEDED:
+                dynamic.needed.append(m.group(2))
+            elif tag == ELFFile.DT_SONAME:
+                dynamic.soname = m.group(2)
+            elif tag == ELFFile.DT_RPATH:
+                dynamic.rpath = m.group(2)
+            elif tag == ELFFile.DT_RUNPATH:
+                dynamic.runpath = m.group(2)
+        return dynamic
+
+    def dynamic(self, d=None):
+        """
+        Return the contents of the dynamic section as an ELFDynamic. It is
+        parsed once from the mapped file and shared between all the callers.
+
+        If the file can't be parsed and QA_ELF_OBJDUMP_FALLBACK is enabled,
+        the output of "objdump -p" is used instead.
+        """
+        if self._dynamic is not None:
+            return self._dynamic
+
+        try:
+            self._dynamic = self._parse_dynamic()
+        except NotELFFileError as e:
+            import bb
+            if d and bb.utils.to_boolean(d.getVar("QA_ELF_OBJDUMP_FALLBACK")):
+                bb.note("%s, falling back to objdump" % e)
+                self._dynamic = self._parse_objdump_dynamic(d)
+            else:
+                bb.note(str(e))
+                self._dynamic = ELFDynamic()
+        return self._dynamic
+
     def run_objdump(self, cmd, d):
         import bb.process
         import sys
@@ -149,6 +324,31 @@ class ELFFile:
             bb.note("%s %s %s failed: %s" % (objdump, cmd, self.name, e))
             return ""
 
+class ELFSection:
+    def __init__(self, name, type, offset, size, link, entsize):
+        self.name = name
+        self.type = type
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.entsize = entsize
+
+class ELFDynamic:
+    """
+    The entries of an ELF dynamic section which are used by the QA checks
+    and shared library detection. tags is the set of all the tags found.
+    """
+    def __init__(self):
+        self.tags = set()
+        self.needed = []
+        self.soname = None
+        self.rpath = None
+        self.runpath = None
+        self.flags_1 = 0
+
+    def has(self, tag):
+        return tag in self.tags
+
 def elf_machine_to_string(machine):
     """
     Return the name of a given ELF e_machine field or the hex value as a string
@@ -170,6 +370,83 @@ def elf_machine_to_string(machine):
     except:
         return "Unknown (%s)" % repr(machine)
 
+def has_gnu_hash(elf, d):
+    """
+    Return whether elf has the symbol hash table expected from linking with
+    --hash-style=gnu. Objects without dynamic symbols don't need one, and
+    musl doesn't support GNU_HASH on MIPS.
+    """
+    dynamic = elf.dynamic(d)
+    if not dynamic.has(ELFFile.DT_SYMTAB):
+        return True
+    if dynamic.has(ELFFile.DT_GNU_HASH) or dynamic.has(ELFFile.DT_MIPS_XHASH):
+        return True
+    return elf_machine_to_string(elf.machine()) == "MIPS" and d.getVar('TCLIBC') == "musl"
+
+# Below this many files, forking the worker processes costs more than
+# running the tests serially
+PARALLEL_FILES_THRESHOLD = 200
+
+def check_files(files, d, threshold=PARALLEL_FILES_THRESHOLD):
+    """
+    Run per-file QA tests. files is a list of (path, package, warnfuncs,
+    errorfuncs) and each test is called as func(path, package, d, elf,
+    messages), with elf set to None for non-ELF files.
+
+    If there are at least threshold files, they are spread over
+    BB_NUMBER_THREADS processes with oe.utils.multiprocess_launch(). Either
+    way the messages are merged in file order, so the result does not
+    depend on how the files were checked.
+
+    Returns a dict of (warnings, errors) message dicts for each package,
+    and a dict of the time spent in each test.
+    """
+    import time
+    import oe.utils
+
+    def check_file(index):
+        path, package, warnfuncs, errorfuncs = files[index]
+        warnings = {}
+        errors = {}
+        timings = {}
+        elf = ELFFile(path)
+        try:
+            elf.open()
+        except (IOError, NotELFFileError):
+            # IOError can happen if the packaging control files disappear,
+            elf = None
+        for (funcs, messages) in ((warnfuncs, warnings), (errorfuncs, errors)):
+            for func in funcs:
+                start = time.time()
+                func(path, package, d, elf, messages)
+                timings[func.__name__] = timings.get(func.__name__, 0) + time.time() - start
+        return (index, warnings, errors, timings)
+
+    if len(files) < threshold:
+        results = [check_file(i) for i in range(len(files))]
+    else:
+        results = oe.utils.multiprocess_launch(check_file, range(len(files)), d)
+        results.sort(key=lambda r: r[0])
+
+    def add_messages(messages, new):
+        for section in new:
+            if section in messages:
+                messages[section] = messages[section] + "\n" + new[section]
+            else:
+                messages[section] = new[section]
+
+    packages = {}
+    total_timings = {}
+    for (index, warnings, errors, timings) in results:
+        package = files[index][1]
+        if package not in packages:
+            packages[package] = ({}, {})
+        add_messages(packages[package][0], warnings)
+        add_messages(packages[package][1], errors)
+        for name in timings:
+            total_timings[name] = total_timings.get(name, 0) + timings[name]
+    return packages, total_timings
+
 if __name__ == "__main__":
     import sys
 
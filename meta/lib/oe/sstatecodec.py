@@ -0,0 +1,88 @@
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# Compression codecs for shared state archives.
+#
+# The codec an archive was written with is identified from the magic bytes
+# at the start of the file, so archives keep their usual names whatever
+# SSTATE_COMPRESSION was set to when they were created, and a build can
+# restore objects written by builds using a different setting.
+#
+
+import bb.utils
+
+class UnsupportedArchiveError(Exception):
+    pass
+
+class Codec(object):
+    def __init__(self, name, magic, programs):
+        self.name = name
+        self.magic = magic
+        # List of (executable, tar --use-compress-program argument) in
+        # order of preference. "{threads}" is replaced by the number of
+        # threads to use. tar adds "-d" itself when extracting.
+        self.programs = programs
+
+    def program(self, path, threads):
+        """
+        Return the command to pass to tar's --use-compress-program option
+        for this codec, using the first of the programs found in path, or
+        None if none of them are available.
+        """
+        for (exe, cmd) in self.programs:
+            if bb.utils.which(path, exe, executable=True):
+                return cmd.format(threads=threads)
+        return None
+
+CODECS = {
+    "gz": Codec("gz", b"\x1f\x8b", [("pigz", "pigz -p {threads}"), ("gzip", "gzip")]),
+    "xz": Codec("xz", b"\xfd7zXZ\x00", [("xz", "xz -T {threads}")]),
+    "zstd": Codec("zstd", b"\x28\xb5\x2f\xfd", [("zstd", "zstd -q -T{threads}")]),
+    "lz4": Codec("lz4", b"\x04\x22\x4d\x18", [("lz4", "lz4 -q -c")]),
+}
+
+DEFAULT_CODEC = "gz"
+
+def get_codec(name):
+    if name not in CODECS:
+        bb.fatal("Unknown sstate compression '%s', expected one of: %s" % (name, " ".join(sorted(CODECS))))
+    return CODECS[name]
+
+def detect(filename):
+    """
+    Return the name of the codec the given archive was compressed with, or
+    None if it isn't recognised.
+    """
+    with open(filename, "rb") as f:
+        header = f.read(max(len(c.magic) for c in CODECS.values()))
+    for codec in CODECS.values():
+        if header.startswith(codec.magic):
+            return codec.name
+    return None
+
+def compress_program(name, path, threads):
+    """
+    Return (codec name, program) to create an archive compressed with the
+    named codec. If no program for the codec is available the default
+    codec is used instead, so the caller should check the returned name.
+    """
+    program = get_codec(name).program(path, threads)
+    if program is None:
+        name = DEFAULT_CODEC
+        program = CODECS[name].program(path, threads)
+    return (name, program)
+
+def decompress_program(filename, path, threads):
+    """
+    Return the program to extract the given archive with. Raises
+    UnsupportedArchiveError if the archive uses an unknown codec or one
+    whose program isn't available.
+    """
+    name = detect(filename)
+    if name is None:
+        raise UnsupportedArchiveError("%s is not compressed with a known sstate codec" % filename)
+    program = CODECS[name].program(path, threads)
+    if program is None:
+        raise UnsupportedArchiveError("%s is compressed with %s, but none of %s is available"
+                                      % (filename, name, ", ".join(exe for (exe, _) in CODECS[name].programs)))
+    return program
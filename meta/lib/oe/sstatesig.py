@@ -215,6 +215,17 @@ class SignatureGeneratorOEBasicHashMixIn(object):
             return self.lockedhashes[tid]
         return super().get_unihash(tid)
 
+    def get_unihashes(self, tids):
+        result = {}
+        query = []
+        for tid in tids:
+            if tid in self.lockedhashes and self.lockedhashes[tid] and not self._internal:
+                result[tid] = self.lockedhashes[tid]
+            else:
+                query.append(tid)
+        result.update(super().get_unihashes(query))
+        return result
+
     def dump_sigtask(self, fn, task, stampbase, runtime):
         tid = fn + ":" + task
         if tid in self.lockedhashes and self.lockedhashes[tid]:
@@ -456,17 +467,70 @@ def find_sstate_manifest(taskdata, taskdata2, taskname, d, multilibcache):
     bb.warn("Manifest %s not found in %s (variant '%s')?" % (manifest, d2.expand(" ".join(pkgarchs)), variant))
     return None, d2
 
+def sstate_mirror_index(mirror, indexname, d):
+    """
+    Download the index of the objects available on an sstate mirror, as
+    written by scripts/gen-sstate-index. Returns the set of object paths,
+    relative to the mirror, or None if the mirror has no index.
+    """
+    import tempfile
+    import bb.fetch2
+
+    # Download into an empty directory so a stale index from an earlier
+    # build is never picked up instead of the mirror's one
+    with tempfile.TemporaryDirectory(prefix="sstate-index-") as tmpdir:
+        indexdata = bb.data.createCopy(d)
+        indexdata.setVar('FILESPATH', tmpdir)
+        indexdata.setVar('DL_DIR', tmpdir)
+        indexdata.setVar('PREMIRRORS', "%s %s" % mirror)
+
+        srcuri = 'file://{0};downloadfilename={0}'.format(indexname)
+        try:
+            fetcher = bb.fetch2.Fetch([srcuri], indexdata, cache=False)
+            fetcher.download()
+            with open(fetcher.localpath(srcuri)) as f:
+                index = set(line.strip() for line in f if line.strip())
+        except (bb.fetch2.BBFetchException, OSError) as e:
+            bb.debug(2, "SState: No object index on mirror %s: %s" % (mirror[1], e))
+            return None
+
+    bb.debug(2, "SState: Loaded index of %d objects from mirror %s" % (len(index), mirror[1]))
+    return index
+
+def sstate_mirror_indexes(mirrors, indexname, d):
+    """
+    Download the object indexes of a list of sstate mirrors, as returned by
+    bb.fetch2.mirror_from_string(). Returns the set of objects listed in any
+    of the indexes and the list of mirrors without an index, which objects
+    still have to be checked on one by one.
+    """
+    available = set()
+    unindexed = []
+    for mirror in mirrors:
+        index = sstate_mirror_index(mirror, indexname, d)
+        if index is None:
+            unindexed.append(mirror)
+        else:
+            available |= index
+    return available, unindexed
+
 def OEOuthashBasic(path, sigfile, task, d):
     """
     Basic output hash function
 
     Calculates the output hash of a task by hashing all output file metadata,
     and file contents.
+
+    Files are stat'ed and hashed by a pool of BB_NUMBER_THREADS threads, but
+    the result is assembled in directory walk order so that the hash does not
+    depend on the number of threads.
     """
     import hashlib
     import stat
     import pwd
     import grp
+    import mmap
+    from concurrent.futures import ThreadPoolExecutor
 
     def update_hash(s):
         s = s.encode('utf-8')
@@ -478,6 +542,113 @@ def OEOuthashBasic(path, sigfile, task, d):
     prev_dir = os.getcwd()
     include_owners = os.environ.get('PSEUDO_DISABLED') == '0'
     extra_content = d.getVar('HASHEQUIV_HASH_VERSION')
+    num_threads = int(d.getVar("BB_NUMBER_THREADS") or os.cpu_count() or 1)
+
+    def hash_file(path, size):
+        fh = hashlib.sha256()
+        with open(path, 'rb') as f:
+            # hashlib drops the GIL for large buffers, so hash big files
+            # from a mapping in one go rather than in small chunks
+            if size >= 1024 * 1024:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    fh.update(m)
+            else:
+                fh.update(f.read())
+        return fh.hexdigest()
+
+    def process(path):
+        s = os.lstat(path)
+        entry = []
+
+        if stat.S_ISDIR(s.st_mode):
+            entry.append('d')
+        elif stat.S_ISCHR(s.st_mode):
+            entry.append('c')
+        elif stat.S_ISBLK(s.st_mode):
+            entry.append('b')
+        elif stat.S_ISSOCK(s.st_mode):
+            entry.append('s')
+        elif stat.S_ISLNK(s.st_mode):
+            entry.append('l')
+        elif stat.S_ISFIFO(s.st_mode):
+            entry.append('p')
+        else:
+            entry.append('-')
+
+        def add_perm(mask, on, off='-'):
+            if mask & s.st_mode:
+                entry.append(on)
+            else:
+                entry.append(off)
+
+        add_perm(stat.S_IRUSR, 'r')
+        add_perm(stat.S_IWUSR, 'w')
+        if stat.S_ISUID & s.st_mode:
+            add_perm(stat.S_IXUSR, 's', 'S')
+        else:
+            add_perm(stat.S_IXUSR, 'x')
+
+        add_perm(stat.S_IRGRP, 'r')
+        add_perm(stat.S_IWGRP, 'w')
+        if stat.S_ISGID & s.st_mode:
+            add_perm(stat.S_IXGRP, 's', 'S')
+        else:
+            add_perm(stat.S_IXGRP, 'x')
+
+        add_perm(stat.S_IROTH, 'r')
+        add_perm(stat.S_IWOTH, 'w')
+        if stat.S_ISVTX & s.st_mode:
+            entry.append('t')
+        else:
+            add_perm(stat.S_IXOTH, 'x')
+
+        if include_owners:
+            try:
+                entry.append(" %10s" % pwd.getpwuid(s.st_uid).pw_name)
+                entry.append(" %10s" % grp.getgrgid(s.st_gid).gr_name)
+            except KeyError:
+                bb.warn("KeyError in %s" % path)
+                raise
+
+        entry.append(" ")
+        if stat.S_ISBLK(s.st_mode) or stat.S_ISCHR(s.st_mode):
+            entry.append("%9s" % ("%d.%d" % (os.major(s.st_rdev), os.minor(s.st_rdev))))
+        else:
+            entry.append(" " * 9)
+
+        entry.append(" ")
+        if stat.S_ISREG(s.st_mode):
+            entry.append("%10d" % s.st_size)
+        else:
+            entry.append(" " * 10)
+
+        entry.append(" ")
+        if stat.S_ISREG(s.st_mode):
+            # Hash file contents
+            entry.append(hash_file(path, s.st_size))
+        else:
+            entry.append(" " * 64)
+
+        entry.append(" %s" % path)
+
+        if stat.S_ISLNK(s.st_mode):
+            entry.append(" -> %s" % os.readlink(path))
+
+        entry.append("\n")
+        return "".join(entry)
+
+    def walk():
+        for root, dirs, files in os.walk('.', topdown=True):
+            # Sort directories to ensure consistent ordering when recursing
+            dirs.sort()
+            files.sort()
+
+            # Process this directory and all its child files
+            yield root
+            for f in files:
+                if f == 'fixmepath':
+                    continue
+                yield os.path.join(root, f)
 
     try:
         os.chdir(path)
@@ -493,100 +664,13 @@ def OEOuthashBasic(path, sigfile, task, d):
         update_hash("SSTATE_PKGSPEC=%s\n" % d.getVar('SSTATE_PKGSPEC'))
         update_hash("task=%s\n" % task)
 
-        for root, dirs, files in os.walk('.', topdown=True):
-            # Sort directories to ensure consistent ordering when recursing
-            dirs.sort()
-            files.sort()
-
-            def process(path):
-                s = os.lstat(path)
-
-                if stat.S_ISDIR(s.st_mode):
-                    update_hash('d')
-                elif stat.S_ISCHR(s.st_mode):
-                    update_hash('c')
-                elif stat.S_ISBLK(s.st_mode):
-                    update_hash('b')
-                elif stat.S_ISSOCK(s.st_mode):
-                    update_hash('s')
-                elif stat.S_ISLNK(s.st_mode):
-                    update_hash('l')
-                elif stat.S_ISFIFO(s.st_mode):
-                    update_hash('p')
-                else:
-                    update_hash('-')
-
-                def add_perm(mask, on, off='-'):
-                    if mask & s.st_mode:
-                        update_hash(on)
-                    else:
-                        update_hash(off)
-
-                add_perm(stat.S_IRUSR, 'r')
-                add_perm(stat.S_IWUSR, 'w')
-                if stat.S_ISUID & s.st_mode:
-                    add_perm(stat.S_IXUSR, 's', 'S')
-                else:
-                    add_perm(stat.S_IXUSR, 'x')
-
-                add_perm(stat.S_IRGRP, 'r')
-                add_perm(stat.S_IWGRP, 'w')
-                if stat.S_ISGID & s.st_mode:
-                    add_perm(stat.S_IXGRP, 's', 'S')
-                else:
-                    add_perm(stat.S_IXGRP, 'x')
-
-                add_perm(stat.S_IROTH, 'r')
-                add_perm(stat.S_IWOTH, 'w')
-                if stat.S_ISVTX & s.st_mode:
-                    update_hash('t')
-                else:
-                    add_perm(stat.S_IXOTH, 'x')
-
-                if include_owners:
-                    try:
-                        update_hash(" %10s" % pwd.getpwuid(s.st_uid).pw_name)
-                        update_hash(" %10s" % grp.getgrgid(s.st_gid).gr_name)
-                    except KeyError:
-                        bb.warn("KeyError in %s" % path)
-                        raise
-
-                update_hash(" ")
-                if stat.S_ISBLK(s.st_mode) or stat.S_ISCHR(s.st_mode):
-                    update_hash("%9s" % ("%d.%d" % (os.major(s.st_rdev), os.minor(s.st_rdev))))
-                else:
-                    update_hash(" " * 9)
-
-                update_hash(" ")
-                if stat.S_ISREG(s.st_mode):
-                    update_hash("%10d" % s.st_size)
-                else:
-                    update_hash(" " * 10)
-
-                update_hash(" ")
-                fh = hashlib.sha256()
-                if stat.S_ISREG(s.st_mode):
-                    # Hash file contents
-                    with open(path, 'rb') as d:
-                        for chunk in iter(lambda: d.read(4096), b""):
-                            fh.update(chunk)
-                    update_hash(fh.hexdigest())
-                else:
-                    update_hash(" " * len(fh.hexdigest()))
-
-                update_hash(" %s" % path)
-
-                if stat.S_ISLNK(s.st_mode):
-                    update_hash(" -> %s" % os.readlink(path))
-
-                update_hash("\n")
-
-            # Process this directory and all its child files
-            process(root)
-            for f in files:
-                if f == 'fixmepath':
-                    continue
-                process(os.path.join(root, f))
+        if num_threads > 1:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                for entry in executor.map(process, walk()):
+                    update_hash(entry)
+        else:
+            for entry in map(process, walk()):
+                update_hash(entry)
     finally:
         os.chdir(prev_dir)
 
@@ -263,72 +263,95 @@ def execute_pre_post_process(d, cmds):
             bb.note("Executing %s ..." % cmd)
             bb.build.exec_func(cmd, d)
 
-# For each item in items, call the function 'target' with item as the first 
+# For each item in items, call the function 'target' with item as the first
 # argument, extraargs as the other arguments and handle any exceptions in the
 # parent thread
+#
+# The items are handed out in chunks to a pool of up to BB_NUMBER_THREADS
+# forked workers, so target, items and extraargs don't need to be picklable.
+# Each worker sends back the results of a whole chunk at once. Once any item
+# has failed, no more chunks are handed out, and the errors of the chunks
+# which were already running are reported together.
 def multiprocess_launch(target, items, d, extraargs=None):
+    import multiprocessing.connection
 
-    class ProcessLaunch(multiprocessing.Process):
-        def __init__(self, *args, **kwargs):
-            multiprocessing.Process.__init__(self, *args, **kwargs)
-            self._pconn, self._cconn = multiprocessing.Pipe()
-            self._exception = None
-            self._result = None
+    items = list(items)
+    if not items:
+        return []
 
-        def run(self):
+    max_process = int(d.getVar("BB_NUMBER_THREADS") or os.cpu_count() or 1)
+    nproc = min(max_process, len(items))
+    chunksize = max(1, min(100, len(items) // (nproc * 4)))
+    chunks = [range(i, min(i + chunksize, len(items))) for i in range(0, len(items), chunksize)]
+    chunks.reverse()
+
+    def run_chunk(chunk):
+        results = []
+        errors = []
+        for i in chunk:
+            args = (items[i],)
+            if extraargs is not None:
+                args = args + extraargs
             try:
-                ret = self._target(*self._args, **self._kwargs)
-                self._cconn.send((None, ret))
+                ret = target(*args)
+                if ret:
+                    results.append(ret)
             except Exception as e:
-                tb = traceback.format_exc()
-                self._cconn.send((e, tb))
-
-        def update(self):
-            if self._pconn.poll():
-                (e, tb) = self._pconn.recv()
-                if e is not None:
-                    self._exception = (e, tb)
-                else:
-                    self._result = tb
-
-        @property
-        def exception(self):
-            self.update()
-            return self._exception
-
-        @property
-        def result(self):
-            self.update()
-            return self._result
+                errors.append((e, traceback.format_exc()))
+                break
+        return (results, errors)
 
-    max_process = int(d.getVar("BB_NUMBER_THREADS") or os.cpu_count() or 1)
-    launched = []
+    def worker(conn):
+        while True:
+            chunk = conn.recv()
+            if chunk is None:
+                break
+            conn.send(run_chunk(chunk))
+
+    workers = {}
     errors = []
     results = []
-    items = list(items)
-    while (items and not errors) or launched:
-        if not errors and items and len(launched) < max_process:
-            args = (items.pop(),)
-            if extraargs is not None:
-                args = args + extraargs
-            p = ProcessLaunch(target=target, args=args)
+    try:
+        for _ in range(nproc):
+            pconn, cconn = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=worker, args=(cconn,))
             p.start()
-            launched.append(p)
-        for q in launched:
-            # Have to manually call update() to avoid deadlocks. The pipe can be full and
-            # transfer stalled until we try and read the results object but the subprocess won't exit
-            # as it still has data to write (https://bugs.python.org/issue8426)
-            q.update()
-            # The finished processes are joined when calling is_alive()
-            if not q.is_alive():
-                if q.exception:
-                    errors.append(q.exception)
-                if q.result:
-                    results.append(q.result)
-                launched.remove(q)
-    # Paranoia doesn't hurt
-    for p in launched:
-        p.join()
+            cconn.close()
+            pconn.send(chunks.pop())
+            workers[pconn] = p
+            if not chunks:
+                break
+
+        sentinels = dict((p.sentinel, conn) for conn, p in workers.items())
+        busy = set(workers)
+        while busy:
+            waitfor = list(busy) + [workers[c].sentinel for c in busy]
+            for ready in multiprocessing.connection.wait(waitfor):
+                conn = sentinels.get(ready, ready)
+                if conn not in busy:
+                    continue
+                try:
+                    (r, e) = conn.recv()
+                    results.extend(r)
+                    errors.extend(e)
+                except EOFError:
+                    # The worker died without sending anything back
+                    workers[conn].join()
+                    errors.append((Exception("Worker process exited with code %s" % workers[conn].exitcode), ""))
+                busy.discard(conn)
+                if chunks and not errors and workers[conn].is_alive():
+                    conn.send(chunks.pop())
+                    busy.add(conn)
+    finally:
+        for conn, p in workers.items():
+            if p.is_alive():
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+            p.join()
+            conn.close()
+
     if errors:
         msg = ""
         for (e, tb) in errors:
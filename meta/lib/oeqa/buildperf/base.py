@@ -20,6 +20,7 @@ from multiprocessing import Process
 from multiprocessing import SimpleQueue
 from xml.dom import minidom
 
+from buildstats import EVENT_LOG, read_event_log
 import oe.path
 from oeqa.utils.commands import CommandError, runCmd, get_bb_vars
 from oeqa.utils.git import GitError, GitRepo
@@ -441,6 +442,38 @@ class BuildPerfTestCase(unittest.TestCase):
                         "archiving the last one", self.name)
         bs_dir = os.path.join(self.bb_vars['BUILDSTATS_BASE'], bs_dirs[-1])
 
+        def log_to_json(path):
+            """Convert the tasks of a buildstats event log into json format"""
+            recipes = OrderedDict()
+            for record in read_event_log(path):
+                if record['type'] != 'task' or record['start_time'] is None:
+                    continue
+                if record['pf'] not in recipes:
+                    name, epoch, version, revision = split_nevr(record['pf'])
+                    recipes[record['pf']] = OrderedDict((('name', name),
+                                                         ('epoch', epoch),
+                                                         ('version', version),
+                                                         ('revision', revision),
+                                                         ('tasks', OrderedDict())))
+                bs_json = OrderedDict()
+                start_time = datetime.utcfromtimestamp(record['start_time'])
+                bs_json['start_time'] = start_time
+                bs_json['status'] = record['status']
+                bs_json['elapsed_time'] = datetime.utcfromtimestamp(record['end_time']) - start_time
+                rusage = OrderedDict()
+                for ru_type in ('rusage', 'child_rusage'):
+                    for ru_key, val in record.get(ru_type, {}).items():
+                        rusage[ru_key] = rusage.get(ru_key, 0) + val
+                bs_json['rusage'] = rusage
+                bs_json['iostat'] = OrderedDict(record.get('iostat', {}))
+                recipes[record['pf']]['tasks'][record['task']] = bs_json
+            return list(recipes.values())
+
+        event_log = os.path.join(bs_dir, EVENT_LOG)
+        if os.path.isfile(event_log):
+            self.buildstats[measurement_name] = log_to_json(event_log)
+            return
+
         buildstats = []
         for fname in os.listdir(bs_dir):
             recipe_dir = os.path.join(bs_dir, fname)
@@ -0,0 +1,123 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+from unittest.case import TestCase
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+basepath = os.path.abspath(os.path.dirname(__file__) + '/../../../../../../')
+
+def load_scripts_buildstats():
+    # scripts/lib/buildstats.py has the same module name as meta/lib/buildstats.py
+    spec = importlib.util.spec_from_file_location("scripts_buildstats", basepath + "/scripts/lib/buildstats.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def task_record(pf, task, start):
+    rusages = ["ru_utime", "ru_stime", "ru_maxrss", "ru_minflt", "ru_majflt", "ru_inblock", "ru_oublock", "ru_nvcsw", "ru_nivcsw"]
+    return {
+        'type': 'task',
+        'pf': pf,
+        'task': task,
+        'start_time': start,
+        'end_time': start + 2.5,
+        'status': 'PASSED',
+        'cpu': {'utime': 10, 'stime': 2, 'cutime': 30, 'cstime': 4},
+        'iostat': {'read_bytes': 4096, 'write_bytes': 8192},
+        'rusage': dict((r, 1.5 if r in ('ru_utime', 'ru_stime') else 3) for r in rusages),
+        'child_rusage': dict((r, 0.5 if r in ('ru_utime', 'ru_stime') else 7) for r in rusages),
+    }
+
+def write_task_file(path, record):
+    # Same format as write_task_data() in buildstats.bbclass
+    with open(path, "w") as f:
+        f.write("Event: TaskStarted \n")
+        f.write("Started: %0.2f \n" % record['start_time'])
+        f.write("%s: %s\n" % (record['pf'], record['task']))
+        f.write("Elapsed time: %0.2f seconds\n" % (record['end_time'] - record['start_time']))
+        for i in ('utime', 'stime', 'cutime', 'cstime'):
+            f.write("%s: %s\n" % (i, record['cpu'][i]))
+        for i in record['iostat']:
+            f.write("IO %s: %s\n" % (i, record['iostat'][i]))
+        for i in record['rusage']:
+            f.write("rusage %s: %s\n" % (i, record['rusage'][i]))
+        for i in record['child_rusage']:
+            f.write("Child rusage %s: %s\n" % (i, record['child_rusage'][i]))
+        f.write("Status: %s \n" % record['status'])
+        f.write("Ended: %0.2f \n" % record['end_time'])
+
+def write_records(bsdir, worker, count):
+    import buildstats
+    for i in range(count):
+        buildstats.write_record(bsdir, task_record("worker%d-1.0-r0" % worker, "do_task%d" % i, 100.0 + i))
+
+class TestBuildstatsEventLog(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.bsdir = tempfile.mkdtemp(prefix="oelib-buildstats-")
+        open(os.path.join(self.bsdir, "build_stats"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.bsdir)
+
+    def test_concurrent_writers(self):
+        scripts_buildstats = load_scripts_buildstats()
+        procs = [multiprocessing.Process(target=write_records, args=(self.bsdir, n, 200)) for n in range(8)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+        bs = scripts_buildstats.BuildStats.from_dir(self.bsdir)
+        self.assertEqual(len(bs), 8)
+        self.assertEqual(bs.num_tasks, 8 * 200)
+
+    def test_incomplete_record(self):
+        import buildstats
+        scripts_buildstats = load_scripts_buildstats()
+        buildstats.write_record(self.bsdir, {'type': 'build-started', 'host': 'test', 'time': 100.0})
+        buildstats.write_record(self.bsdir, task_record("foo-1.0-r0", "do_compile", 100.0))
+        with open(os.path.join(self.bsdir, buildstats.EVENT_LOG), "a") as f:
+            f.write('{"type": "task", "pf": "foo-1.0-r0"')
+
+        bs = scripts_buildstats.BuildStats.from_dir(self.bsdir)
+        self.assertEqual(list(bs.keys()), ["foo"])
+        self.assertEqual(bs["foo"].evr, "1.0-r0")
+        self.assertEqual(bs["foo"].tasks["do_compile"].walltime, 2.5)
+        self.assertEqual(bs["foo"].tasks["do_compile"].cputime, 4.0)
+
+    def test_load_matches_task_files(self):
+        import buildstats
+        scripts_buildstats = load_scripts_buildstats()
+        tasks = ["do_fetch", "do_unpack", "do_patch", "do_configure", "do_compile", "do_install",
+                 "do_package", "do_packagedata", "do_package_write_rpm", "do_populate_sysroot"]
+
+        # A log and task files with the same contents
+        filesdir = os.path.join(self.bsdir, "files")
+        os.makedirs(filesdir)
+        open(os.path.join(filesdir, "build_stats"), "w").close()
+        for n in range(200):
+            pf = "recipe%d-1.%d-r0" % (n, n)
+            os.makedirs(os.path.join(filesdir, pf))
+            for i, task in enumerate(tasks):
+                record = task_record(pf, task, 1000.0 + n + i)
+                buildstats.write_record(self.bsdir, record)
+                write_task_file(os.path.join(filesdir, pf, task), record)
+
+        from_log = scripts_buildstats.BuildStats.from_dir(self.bsdir)
+        from_files = scripts_buildstats.BuildStats.from_dir(filesdir)
+
+        self.assertEqual(from_log.num_tasks, 200 * len(tasks))
+        self.assertEqual(sorted(from_log.keys()), sorted(from_files.keys()))
+        for name, recipe in from_files.items():
+            self.assertEqual(from_log[name].nevr, recipe.nevr)
+            for task, data in recipe.tasks.items():
+                self.assertEqual(dict(from_log[name].tasks[task]), dict(data))
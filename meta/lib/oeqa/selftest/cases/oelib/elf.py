@@ -3,8 +3,63 @@
 #
 
 from unittest.case import TestCase
+import struct
+import tempfile
 import oe.qa
 
+def make_elf(bits, endian, e_type, dynamic, symtab=False, machine=None):
+    """
+    Build a minimal ELF file with a .dynamic section holding the given
+    (tag, value) pairs. String values are added to .dynstr.
+    """
+    e = endian == oe.qa.ELFFile.EI_DATA_LSB and "<" or ">"
+
+    dynstr = b"\0"
+    entries = []
+    for (tag, value) in dynamic:
+        if isinstance(value, str):
+            offset = len(dynstr)
+            dynstr += value.encode("utf-8") + b"\0"
+            value = offset
+        entries.append((tag, value))
+    entries.append((oe.qa.ELFFile.DT_NULL, 0))
+    dynfmt = e + (bits == 32 and "iI" or "qQ")
+    dyn = b"".join(struct.pack(dynfmt, tag, value) for (tag, value) in entries)
+
+    names = [".dynstr", ".dynamic", ".shstrtab"]
+    if symtab:
+        names.append(".symtab")
+    shstrtab = b"\0"
+    nameoffsets = {}
+    for name in names:
+        nameoffsets[name] = len(shstrtab)
+        shstrtab += name.encode("utf-8") + b"\0"
+
+    ehsize = bits == 32 and 52 or 64
+    shentsize = bits == 32 and 40 or 64
+    dynstr_off = ehsize
+    dyn_off = dynstr_off + len(dynstr)
+    shstrtab_off = dyn_off + len(dyn)
+    shoff = shstrtab_off + len(shstrtab)
+
+    shfmt = e + (bits == 32 and "IIIIIIIIII" or "IIQQQQIIQQ")
+    sections = [struct.pack(shfmt, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+                struct.pack(shfmt, nameoffsets[".dynstr"], 3, 0, 0, dynstr_off, len(dynstr), 0, 0, 1, 0),
+                struct.pack(shfmt, nameoffsets[".dynamic"], oe.qa.ELFFile.SHT_DYNAMIC, 0, 0, dyn_off, len(dyn), 1, 0, 8, struct.calcsize(dynfmt)),
+                struct.pack(shfmt, nameoffsets[".shstrtab"], 3, 0, 0, shstrtab_off, len(shstrtab), 0, 0, 1, 0)]
+    if symtab:
+        sections.append(struct.pack(shfmt, nameoffsets[".symtab"], oe.qa.ELFFile.SHT_SYMTAB, 0, 0, 0, 0, 1, 0, 8, 0))
+
+    if machine is None:
+        machine = bits == 32 and 0x28 or 0x3E
+    ident = b"\x7fELF" + bytes([bits == 32 and 1 or 2, endian, 1, 0]) + b"\0" * 8
+    if bits == 32:
+        header = ident + struct.pack(e + "HHIIIIIHHHHHH", e_type, machine, 1, 0, 0, shoff, 0, ehsize, 0, 0, shentsize, len(sections), 3)
+    else:
+        header = ident + struct.pack(e + "HHIQQQIHHHHHH", e_type, machine, 1, 0, 0, shoff, 0, ehsize, 0, 0, shentsize, len(sections), 3)
+
+    return header + dynstr + dyn + shstrtab + b"".join(sections)
+
 class TestElf(TestCase):
     def test_machine_name(self):
         """
@@ -24,3 +79,139 @@ class TestElf(TestCase):
         self.assertEqual(oe.qa.elf_machine_to_string(0x00), "Unknown (0)")
         self.assertEqual(oe.qa.elf_machine_to_string(0xDEADBEEF), "Unknown (3735928559)")
         self.assertEqual(oe.qa.elf_machine_to_string("foobar"), "Unknown ('foobar')")
+
+    def check_dynamic(self, bits, endian):
+        data = make_elf(bits, endian, oe.qa.ELFFile.ET_DYN, [
+            (oe.qa.ELFFile.DT_NEEDED, "libc.so.6"),
+            (oe.qa.ELFFile.DT_NEEDED, "libm.so.6"),
+            (oe.qa.ELFFile.DT_SONAME, "libfoo.so.1"),
+            (oe.qa.ELFFile.DT_RPATH, "/usr/lib/foo"),
+            (oe.qa.ELFFile.DT_TEXTREL, 0),
+            (oe.qa.ELFFile.DT_GNU_HASH, 0x1000),
+        ])
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with oe.qa.ELFFile(f.name) as elf:
+                elf.open()
+                self.assertEqual(elf.abiSize(), bits)
+                self.assertEqual(elf.elfType(), oe.qa.ELFFile.ET_DYN)
+                self.assertEqual([s.name for s in elf.sections()], ["", ".dynstr", ".dynamic", ".shstrtab"])
+                self.assertFalse(elf.hasSymtab())
+
+                dynamic = elf.dynamic()
+                self.assertEqual(dynamic.needed, ["libc.so.6", "libm.so.6"])
+                self.assertEqual(dynamic.soname, "libfoo.so.1")
+                self.assertEqual(dynamic.rpath, "/usr/lib/foo")
+                self.assertIsNone(dynamic.runpath)
+                self.assertTrue(dynamic.has(oe.qa.ELFFile.DT_TEXTREL))
+                self.assertTrue(dynamic.has(oe.qa.ELFFile.DT_GNU_HASH))
+                self.assertFalse(dynamic.has(oe.qa.ELFFile.DT_SYMTAB))
+                # Parsed once and shared
+                self.assertIs(elf.dynamic(), dynamic)
+
+    def test_dynamic_64_lsb(self):
+        self.check_dynamic(64, oe.qa.ELFFile.EI_DATA_LSB)
+
+    def test_dynamic_32_msb(self):
+        self.check_dynamic(32, oe.qa.ELFFile.EI_DATA_MSB)
+
+    def test_symtab(self):
+        data = make_elf(64, oe.qa.ELFFile.EI_DATA_LSB, oe.qa.ELFFile.ET_EXEC, [], symtab=True)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with oe.qa.ELFFile(f.name) as elf:
+                elf.open()
+                self.assertTrue(elf.hasSymtab())
+                self.assertEqual(elf.dynamic().needed, [])
+
+    def test_truncated(self):
+        data = make_elf(64, oe.qa.ELFFile.EI_DATA_LSB, oe.qa.ELFFile.ET_DYN,
+                        [(oe.qa.ELFFile.DT_NEEDED, "libc.so.6")])
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data[:-10])
+            f.flush()
+            with oe.qa.ELFFile(f.name) as elf:
+                elf.open()
+                with self.assertRaises(oe.qa.NotELFFileError):
+                    elf.sections()
+
+class TestHashStyle(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.d = bb.data_smart.DataSmart()
+        self.d.setVar("TCLIBC", "glibc")
+
+    def has_gnu_hash(self, dynamic, machine=None):
+        data = make_elf(32, oe.qa.ELFFile.EI_DATA_LSB, oe.qa.ELFFile.ET_DYN, dynamic, machine=machine)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with oe.qa.ELFFile(f.name) as elf:
+                elf.open()
+                return oe.qa.has_gnu_hash(elf, self.d)
+
+    def test_has_gnu_hash(self):
+        symtab = (oe.qa.ELFFile.DT_SYMTAB, 0x100)
+        self.assertTrue(self.has_gnu_hash([symtab, (oe.qa.ELFFile.DT_GNU_HASH, 0x200)]))
+        self.assertTrue(self.has_gnu_hash([symtab, (oe.qa.ELFFile.DT_MIPS_XHASH, 0x200)]))
+        self.assertFalse(self.has_gnu_hash([symtab]))
+        # Nothing to hash without dynamic symbols
+        self.assertTrue(self.has_gnu_hash([(oe.qa.ELFFile.DT_NEEDED, "libc.so.6")]))
+
+    def test_mips_musl(self):
+        symtab = (oe.qa.ELFFile.DT_SYMTAB, 0x100)
+        self.assertFalse(self.has_gnu_hash([symtab], machine=0x08))
+        self.d.setVar("TCLIBC", "musl")
+        self.assertTrue(self.has_gnu_hash([symtab], machine=0x08))
+        self.assertFalse(self.has_gnu_hash([symtab]))
+
+class TestCheckFiles(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        self.tempdir = tempfile.TemporaryDirectory(prefix="oelib-qa-")
+        self.d = bb.data_smart.DataSmart()
+        self.d.setVar("BB_NUMBER_THREADS", "4")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_parallel_matches_serial(self):
+        import os
+
+        def check_name(path, name, d, elf, messages):
+            if path.endswith("3"):
+                messages["name"] = "%s: %s" % (name, os.path.basename(path))
+
+        def check_needed(path, name, d, elf, messages):
+            if elf:
+                messages["needed"] = "%s: %s needs %s" % (name, os.path.basename(path), elf.dynamic().needed)
+
+        files = []
+        for i in range(300):
+            path = os.path.join(self.tempdir.name, "file%d" % i)
+            with open(path, "wb") as f:
+                if i % 2:
+                    f.write(make_elf(64, oe.qa.ELFFile.EI_DATA_LSB, oe.qa.ELFFile.ET_DYN,
+                                     [(oe.qa.ELFFile.DT_NEEDED, "lib%d.so" % i)]))
+                else:
+                    f.write(b"not an ELF file")
+            files.append((path, "pkg%d" % (i % 3), [check_name], [check_needed]))
+
+        serial, serialtimings = oe.qa.check_files(files, self.d, threshold=len(files) + 1)
+        parallel, paralleltimings = oe.qa.check_files(files, self.d, threshold=0)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(sorted(paralleltimings), ["check_name", "check_needed"])
+
+        # Messages are merged in file order
+        warnings, errors = serial["pkg1"]
+        self.assertEqual(warnings["name"].splitlines(), ["pkg1: file%d" % i for i in range(300) if i % 3 == 1 and str(i).endswith("3")])
+        self.assertEqual(errors["needed"].splitlines()[0], "pkg1: file1 needs ['lib1.so']")
+        self.assertEqual(len(errors["needed"].splitlines()), 50)
@@ -0,0 +1,92 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+from unittest.case import TestCase
+import os
+import shutil
+import tempfile
+
+class TestRunIntercepts(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        from oe.package_manager import PackageManager
+
+        self.tempdir = tempfile.mkdtemp(prefix="oelib-intercepts-")
+        self.hooksdir = os.path.join(self.tempdir, "hooks")
+        self.rootfs = os.path.join(self.tempdir, "rootfs")
+        os.makedirs(self.hooksdir)
+        os.makedirs(self.rootfs)
+
+        self.d = bb.data_smart.DataSmart()
+        self.d.setVar("WORKDIR", self.tempdir)
+        self.d.setVar("T", self.tempdir)
+        self.d.setVar("STAGING_DIR_NATIVE", self.tempdir)
+        self.d.setVar("BB_CURRENTTASK", "rootfs")
+        self.d.setVar("BB_NUMBER_THREADS", "4")
+
+        # A package manager backend doing nothing but running intercepts
+        self.failed = []
+        methods = dict((name, lambda self, *args, **kwargs: None) for name in PackageManager.__abstractmethods__)
+        methods["_handle_intercept_failure"] = lambda pm, pkgs: self.failed.append(pkgs)
+        self.pmclass = type("InterceptPM", (PackageManager,), methods)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def add_hook(self, name, body, depends=None):
+        path = os.path.join(self.hooksdir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\nset -e\n")
+            if depends:
+                f.write("##DEPENDS: %s\n" % depends)
+            f.write(body + "\n##PKGS: pkg-%s \n" % name)
+        os.chmod(path, 0o755)
+
+    def run_intercepts(self, populate_sdk=None):
+        hooks = " ".join(os.path.join(self.hooksdir, h) for h in sorted(os.listdir(self.hooksdir)))
+        self.d.setVar("POSTINST_INTERCEPTS", hooks)
+        pm = self.pmclass(self.d, self.rootfs)
+        pm.run_intercepts(populate_sdk)
+
+    def test_concurrent(self):
+        # Each hook waits until all of them have started, which only
+        # succeeds if they run at the same time
+        wait = ("touch $D/%s.started; i=0; "
+                "while [ ! -e $D/slow1.started -o ! -e $D/slow2.started -o ! -e $D/slow3.started ]; do "
+                "i=$(expr $i + 1); [ $i -lt 300 ]; sleep 0.1; done; touch $D/%s")
+        for name in ("slow1", "slow2", "slow3"):
+            self.add_hook(name, wait % (name, name))
+        self.run_intercepts()
+        for name in ("slow1", "slow2", "slow3"):
+            self.assertTrue(os.path.exists(os.path.join(self.rootfs, name)))
+
+    def test_depends(self):
+        self.add_hook("first", "sleep 1; touch $D/first")
+        # Runs after first and its multilib variant
+        self.add_hook("second", "test -e $D/first; test -e $D/first-lib32; touch $D/second", "first missing")
+        self.add_hook("first-lib32", "sleep 1; touch $D/first-lib32")
+        self.add_hook("third", "test -e $D/second", "second")
+        self.run_intercepts()
+
+    def test_circular(self):
+        import bb
+        self.add_hook("a", "true", "b")
+        self.add_hook("b", "true", "a")
+        with self.assertRaises(bb.BBHandledException):
+            self.run_intercepts()
+
+    def test_failure(self):
+        import bb
+        self.add_hook("ok", "true")
+        self.add_hook("broken", "echo oops; exit 1")
+        with self.assertRaises(bb.BBHandledException):
+            self.run_intercepts()
+
+    def test_postpone(self):
+        self.add_hook("noqemu", "echo 'qemuwrapper: qemu usermode is not supported'; exit 1")
+        self.run_intercepts()
+        self.assertEqual(self.failed, ["pkg-noqemu"])
@@ -0,0 +1,70 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+from unittest.case import TestCase
+import json
+import os
+import shutil
+import tempfile
+import oe.packagedata
+
+class TestFilesIndex(TestCase):
+    def setUp(self):
+        self.pkgdata_dir = tempfile.mkdtemp(prefix="oelib-pkgdata-")
+        os.makedirs(os.path.join(self.pkgdata_dir, "runtime"))
+
+    def tearDown(self):
+        shutil.rmtree(self.pkgdata_dir)
+
+    def write_pkg(self, pkg, files, pkgname=None):
+        with open(os.path.join(self.pkgdata_dir, "runtime", pkg), "w") as f:
+            f.write("PN: foo\n")
+            f.write("PKG_%s: %s\n" % (pkg, pkgname or pkg))
+            if files is not None:
+                f.write("FILES_INFO: %s\n" % json.dumps(files, sort_keys=True))
+        open(os.path.join(self.pkgdata_dir, "runtime", pkg + ".packaged"), "w").close()
+
+    def test_no_index(self):
+        self.write_pkg("foo", {"/usr/bin/foo": 10})
+        self.assertIsNone(oe.packagedata.FilesIndex.open(self.pkgdata_dir))
+
+    def test_queries(self):
+        self.write_pkg("foo", {"/usr/bin/foo": 10, "/usr/lib/libfoo.so.1": 20}, "libfoo1")
+        self.write_pkg("foo-dev", {"/usr/lib/libfoo.so": 0})
+        self.write_pkg("foo-empty", None)
+        oe.packagedata.update_files_index(self.pkgdata_dir)
+
+        index = oe.packagedata.FilesIndex.open(self.pkgdata_dir)
+        self.assertIsNotNone(index)
+        try:
+            self.assertEqual(index.find_path("/usr/bin/foo"), [("foo", "/usr/bin/foo")])
+            self.assertEqual(index.find_path("/usr/lib/libfoo.so*"),
+                             [("foo", "/usr/lib/libfoo.so.1"), ("foo-dev", "/usr/lib/libfoo.so")])
+            self.assertEqual(index.find_path("*/foo"), [("foo", "/usr/bin/foo")])
+            self.assertEqual(index.find_path("/nonexistent"), [])
+            self.assertEqual(index.pkgname("foo"), "libfoo1")
+            self.assertIsNone(index.pkgname("bar"))
+            self.assertEqual(index.files("foo"), {"/usr/bin/foo": 10, "/usr/lib/libfoo.so.1": 20})
+            self.assertIsNone(index.files("foo-empty"))
+        finally:
+            index.close()
+
+    def test_refresh(self):
+        self.write_pkg("foo", {"/usr/bin/foo": 10})
+        self.write_pkg("bar", {"/usr/bin/bar": 10})
+        oe.packagedata.update_files_index(self.pkgdata_dir, ["foo"])
+
+        # Packages missing from the index, changed or removed since it was
+        # written are picked up when it is opened
+        self.write_pkg("foo", {"/usr/bin/foo2": 100})
+        os.utime(os.path.join(self.pkgdata_dir, "runtime", "foo"), ns=(0, 0))
+        self.write_pkg("baz", {"/usr/bin/baz": 10})
+        os.unlink(os.path.join(self.pkgdata_dir, "runtime", "bar"))
+
+        index = oe.packagedata.FilesIndex.open(self.pkgdata_dir)
+        try:
+            self.assertEqual(index.find_path("/usr/bin/*"), [("baz", "/usr/bin/baz"), ("foo", "/usr/bin/foo2")])
+            self.assertIsNone(index.pkgname("bar"))
+        finally:
+            index.close()
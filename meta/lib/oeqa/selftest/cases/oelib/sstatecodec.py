@@ -0,0 +1,86 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+from unittest.case import TestCase
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+class TestSstateCodec(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatecodec
+
+        self.tempdir = tempfile.mkdtemp(prefix="oelib-sstatecodec-")
+        self.path = os.environ.get("PATH")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_tree(self, root, files, size):
+        os.makedirs(os.path.join(root, "usr", "lib"))
+        seed = b"sstate"
+        for i in range(files):
+            data = b""
+            while len(data) < size:
+                seed = hashlib.sha256(seed).digest()
+                # Repeat each digest so the data compresses like real objects
+                data += seed * 8 + bytes(256)
+            with open(os.path.join(root, "usr", "lib", "file%d" % i), "wb") as f:
+                f.write(data[:size])
+
+    def pack(self, codec, root):
+        import oe.sstatecodec
+        (used, program) = oe.sstatecodec.compress_program(codec, self.path, 4)
+        archive = os.path.join(self.tempdir, "sstate-%s.tgz" % codec)
+        subprocess.check_call(["tar", "-I", program, "-cS", "-f", archive, "."], cwd=root)
+        return (used, archive)
+
+    def unpack(self, archive, dest):
+        import oe.sstatecodec
+        program = oe.sstatecodec.decompress_program(archive, self.path, 4)
+        os.makedirs(dest)
+        subprocess.check_call(["tar", "-I", program, "-xf", archive], cwd=dest)
+
+    def available(self):
+        import oe.sstatecodec
+        return [name for (name, codec) in sorted(oe.sstatecodec.CODECS.items())
+                if codec.program(self.path, 1)]
+
+    def test_unknown_codec(self):
+        import oe.sstatecodec
+        archive = os.path.join(self.tempdir, "sstate.tgz")
+        with open(archive, "wb") as f:
+            f.write(b"not an archive")
+        self.assertIsNone(oe.sstatecodec.detect(archive))
+        with self.assertRaises(oe.sstatecodec.UnsupportedArchiveError):
+            oe.sstatecodec.decompress_program(archive, self.path, 1)
+
+    def test_fallback(self):
+        import oe.sstatecodec
+        emptypath = os.path.join(self.tempdir, "bin")
+        os.makedirs(emptypath)
+        os.symlink(shutil.which("gzip"), os.path.join(emptypath, "gzip"))
+        self.assertEqual(oe.sstatecodec.compress_program("xz", emptypath, 1), ("gz", "gzip"))
+
+    def test_roundtrip(self):
+        import oe.sstatecodec
+        root = os.path.join(self.tempdir, "tree")
+        self.make_tree(root, 5, 10000)
+        for codec in self.available():
+            with self.subTest(codec=codec):
+                (used, archive) = self.pack(codec, root)
+                self.assertEqual(used, codec)
+                self.assertEqual(oe.sstatecodec.detect(archive), codec)
+                dest = os.path.join(self.tempdir, "restore-%s" % codec)
+                self.unpack(archive, dest)
+                for i in range(5):
+                    name = os.path.join("usr", "lib", "file%d" % i)
+                    with open(os.path.join(root, name), "rb") as a, open(os.path.join(dest, name), "rb") as b:
+                        self.assertEqual(a.read(), b.read())
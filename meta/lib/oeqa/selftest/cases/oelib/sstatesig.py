@@ -0,0 +1,199 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+from unittest.case import TestCase
+import hashlib
+import io
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+
+basepath = os.path.abspath(os.path.dirname(__file__) + '/../../../../../../')
+
+class TestOutHash(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatesig
+
+        self.tempdir = tempfile.mkdtemp(prefix="oelib-outhash-")
+        self.d = bb.data_smart.DataSmart()
+        self.d.setVar("SSTATE_PKGSPEC", "sstate:foo::1.0:r0::3:")
+        self.old_pseudo = os.environ.pop("PSEUDO_DISABLED", None)
+
+    def tearDown(self):
+        if self.old_pseudo is not None:
+            os.environ["PSEUDO_DISABLED"] = self.old_pseudo
+        shutil.rmtree(self.tempdir)
+
+    def content(self, name, size):
+        data = b""
+        seed = name.encode("utf-8")
+        while len(data) < size:
+            seed = hashlib.sha256(seed).digest()
+            data += seed * 64
+        return data[:size]
+
+    def make_tree(self, root, dirs, files_per_dir, size):
+        os.makedirs(root)
+        for i in range(dirs):
+            subdir = os.path.join(root, "usr", "lib%d" % i)
+            os.makedirs(subdir)
+            os.chmod(subdir, 0o755)
+            for j in range(files_per_dir):
+                path = os.path.join(subdir, "file%d" % j)
+                with open(path, "wb") as f:
+                    f.write(self.content(os.path.relpath(path, root), size * (j % 3)))
+                os.chmod(path, 0o644)
+        os.chmod(os.path.join(root, "usr"), 0o755)
+        os.chmod(root, 0o755)
+
+    def make_special_tree(self, root):
+        self.make_tree(root, 2, 3, 10000)
+        big = os.path.join(root, "usr", "lib0", "big")
+        with open(big, "wb") as f:
+            f.write(self.content("big", 3 * 1024 * 1024 + 7))
+        os.chmod(big, 0o4755)
+        sticky = os.path.join(root, "usr", "tmp")
+        os.mkdir(sticky)
+        os.chmod(sticky, 0o1777)
+        sgid = os.path.join(root, "usr", "lib1", "sgid")
+        open(sgid, "wb").close()
+        os.chmod(sgid, 0o2640)
+        os.symlink("lib0/big", os.path.join(root, "usr", "link"))
+        os.mkfifo(os.path.join(root, "usr", "fifo"), 0o600)
+        os.chmod(os.path.join(root, "usr", "fifo"), 0o600)
+        with open(os.path.join(root, "usr", "lib1", "fixmepath"), "w") as f:
+            f.write("ignored")
+
+    def outhash(self, root, threads=None, sigfile=None):
+        import oe.sstatesig
+        if threads is not None:
+            self.d.setVar("BB_NUMBER_THREADS", str(threads))
+        return oe.sstatesig.OEOuthashBasic(root, sigfile, "do_package", self.d)
+
+    def test_outhash_unchanged(self):
+        # The output hash must not change, otherwise existing hash
+        # equivalence data becomes useless
+        root = os.path.join(self.tempdir, "tree")
+        self.make_special_tree(root)
+        expected = "53fd78e1369b6a9f10c3ad60a20c57c7578ba1aa1306fcd1184af22455e971fb"
+        self.assertEqual(self.outhash(root, 1), expected)
+        self.assertEqual(self.outhash(root, 8), expected)
+
+    def test_outhash_sigfile(self):
+        root = os.path.join(self.tempdir, "tree")
+        self.make_special_tree(root)
+        sigfile = io.BytesIO()
+        h = self.outhash(root, 4, sigfile)
+        self.assertEqual(hashlib.sha256(sigfile.getvalue()).hexdigest(), h)
+        lines = sigfile.getvalue().decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "OEOuthashBasic")
+        self.assertIn("drwxrwxrwt", "\n".join(lines))
+        self.assertNotIn("fixmepath", "\n".join(lines))
+
+    def test_outhash_cwd(self):
+        root = os.path.join(self.tempdir, "tree")
+        self.make_tree(root, 1, 1, 10)
+        cwd = os.getcwd()
+        self.outhash(root, 2)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_outhash_threads(self):
+        # Many files spread over the pool must hash the same as serially
+        root = os.path.join(self.tempdir, "tree")
+        self.make_tree(root, 10, 40, 4096)
+        self.assertEqual(self.outhash(root, 1), self.outhash(root, 8))
+
+class TestMirrorIndex(TestCase):
+    def setUp(self):
+        try:
+            import bb
+        except ImportError:
+            self.skipTest("Cannot import bb")
+        import oe.sstatesig
+
+        self.tempdir = tempfile.mkdtemp(prefix="oelib-sstateindex-")
+        self.d = bb.data.init()
+        self.d.setVar("PERSISTENT_DIR", os.path.join(self.tempdir, "persistent"))
+        self.d.setVar("BB_NO_NETWORK", "1")
+        self.objects = ["%02x/%02x/sstate:foo:core2-64-poky-linux:1.0:r0:core2-64:3:%064x_package.tgz" % (i, i, i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_mirror(self, name, objects):
+        mirror = os.path.join(self.tempdir, name)
+        for o in objects:
+            path = os.path.join(mirror, o)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(o)
+        # Only sstate objects are listed
+        open(os.path.join(mirror, "README"), "w").close()
+        return mirror
+
+    def gen_index(self, mirror):
+        subprocess.check_output([os.path.join(basepath, "scripts", "gen-sstate-index"), mirror], stderr=subprocess.STDOUT)
+
+    def mirrors(self, *dirs):
+        return [("file://.*", "file://%s/PATH" % mirror) for mirror in dirs]
+
+    def test_index(self):
+        import oe.sstatesig
+        mirror = self.make_mirror("mirror", self.objects[:3])
+        self.gen_index(mirror)
+        with open(os.path.join(mirror, "sstate-index.txt")) as f:
+            self.assertEqual(f.read().splitlines(), sorted(self.objects[:3]))
+
+        available, unindexed = oe.sstatesig.sstate_mirror_indexes(self.mirrors(mirror), "sstate-index.txt", self.d)
+        self.assertEqual(available, set(self.objects[:3]))
+        self.assertEqual(unindexed, [])
+
+    def test_stale_index(self):
+        import oe.sstatesig
+        mirror = self.make_mirror("mirror", self.objects[:3])
+        self.gen_index(mirror)
+        # Objects added since the index was written are missed, and removed
+        # ones are still listed until the index is written again
+        self.make_mirror("mirror", self.objects[3:4])
+        os.unlink(os.path.join(mirror, self.objects[0]))
+
+        available, unindexed = oe.sstatesig.sstate_mirror_indexes(self.mirrors(mirror), "sstate-index.txt", self.d)
+        self.assertEqual(available, set(self.objects[:3]))
+
+        self.gen_index(mirror)
+        available, unindexed = oe.sstatesig.sstate_mirror_indexes(self.mirrors(mirror), "sstate-index.txt", self.d)
+        self.assertEqual(available, set(self.objects[1:4]))
+
+    def test_unindexed_mirror(self):
+        import bb.fetch2
+        import oe.sstatesig
+        indexed = self.make_mirror("indexed", self.objects[:2])
+        self.gen_index(indexed)
+        plain = self.make_mirror("plain", self.objects[2:4])
+
+        mirrors = self.mirrors(indexed, plain)
+        available, unindexed = oe.sstatesig.sstate_mirror_indexes(mirrors, "sstate-index.txt", self.d)
+        self.assertEqual(available, set(self.objects[:2]))
+        self.assertEqual(unindexed, mirrors[1:])
+
+        # The remaining objects are found by checking each of them on the
+        # mirrors without an index
+        dldir = os.path.join(self.tempdir, "sstate")
+        localdata = bb.data.createCopy(self.d)
+        localdata.setVar("DL_DIR", dldir)
+        localdata.setVar("FILESPATH", dldir)
+        localdata.setVar("PREMIRRORS", " ".join("%s %s" % m for m in unindexed))
+        for o in self.objects[2:]:
+            fetcher = bb.fetch2.Fetch(["file://" + o], localdata)
+            if o in self.objects[2:4]:
+                fetcher.checkstatus()
+            else:
+                with self.assertRaises(bb.fetch2.FetchError):
+                    fetcher.checkstatus()
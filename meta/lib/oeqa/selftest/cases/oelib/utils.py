@@ -101,3 +101,63 @@ class TestMultiprocessLaunch(TestCase):
             self.assertRaises(bb.BBHandledException, multiprocess_launch, testfunction, ["1", "2", "3", "4", "5", "6"], d, extraargs=(d,))
         self.assertIn("KeyError: 'Invalid number 1'", out.getvalue())
         self.assertIn("KeyError: 'Invalid number 2'", out.getvalue())
+
+    def test_multiprocesslaunch_many(self):
+        import bb
+
+        d = bb.data_smart.DataSmart()
+        d.setVar("BB_NUMBER_THREADS", "4")
+
+        # Falsy results are dropped
+        result = multiprocess_launch(lambda i: i, range(10000), d)
+        self.assertEqual(sorted(result), list(range(1, 10000)))
+
+        self.assertEqual(multiprocess_launch(lambda i: i, [], d), [])
+
+    def test_multiprocesslaunch_crash(self):
+        import bb
+        import os
+
+        def crash(item):
+            if item == 50:
+                os._exit(1)
+            return item
+
+        def dummyfatal(msg):
+            raise bb.BBHandledException(msg)
+
+        d = bb.data_smart.DataSmart()
+        d.setVar("BB_NUMBER_THREADS", "2")
+        oldfatal = bb.fatal
+        bb.fatal = dummyfatal
+        try:
+            with self.assertRaises(bb.BBHandledException) as cm:
+                multiprocess_launch(crash, range(100), d)
+        finally:
+            bb.fatal = oldfatal
+        self.assertIn("Worker process exited with code 1", str(cm.exception))
+
+    def test_multiprocesslaunch_files(self):
+        import bb
+        import os
+        import shutil
+        import tempfile
+
+        def filesize(path):
+            return (path, os.lstat(path).st_size)
+
+        tempdir = tempfile.mkdtemp(prefix="oelib-multiprocess-")
+        try:
+            files = []
+            for i in range(2000):
+                path = os.path.join(tempdir, "file%d" % i)
+                with open(path, "w") as f:
+                    f.write("x" * (i % 100))
+                files.append(path)
+
+            d = bb.data_smart.DataSmart()
+            result = multiprocess_launch(filesize, files, d)
+        finally:
+            shutil.rmtree(tempdir)
+
+        self.assertEqual(sorted(result), sorted((path, i % 100) for i, path in enumerate(files)))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+# Measure the overhead of oe.utils.multiprocess_launch on a package made of
+# many small files
+#
+# Each file is stat'ed, read and hashed, which is about as little work per
+# item as the callers in package.bbclass do, so the time is dominated by
+# handing out items and collecting results. The files are also processed in
+# a plain loop for comparison. By default a synthetic package is created;
+# pass --path to use the files of an existing directory instead.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+scripts_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, scripts_path + '/lib')
+import scriptpath
+scriptpath.add_bitbake_lib_path()
+scriptpath.add_oe_lib_path()
+
+import bb.data_smart
+import oe.utils
+
+def hash_file(path):
+    s = os.lstat(path)
+    with open(path, "rb") as f:
+        return (path, s.st_size, hashlib.sha256(f.read()).hexdigest())
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of oe.utils.multiprocess_launch on many small files")
+    parser.add_argument("-p", "--path", help="Use the files in this directory instead of a synthetic package")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="Number of files in the synthetic package (default: %(default)s)")
+    parser.add_argument("-t", "--threads", type=int, action="append",
+                        help="BB_NUMBER_THREADS to use, may be given more than once (default: the number of CPUs)")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Number of times to process the files (default: %(default)s)")
+    args = parser.parse_args()
+
+    threads = args.threads or [os.cpu_count() or 1]
+
+    tempdir = None
+    path = args.path
+    if path is None:
+        tempdir = tempfile.mkdtemp(prefix="multiprocess-benchmark-")
+        path = tempdir
+        for i in range(args.count):
+            with open(os.path.join(path, "file%d" % i), "w") as f:
+                f.write("x" * (i % 100))
+
+    try:
+        files = []
+        for root, dirs, names in os.walk(path):
+            files.extend(os.path.join(root, n) for n in names if os.path.isfile(os.path.join(root, n)))
+
+        d = bb.data_smart.DataSmart()
+        for run in range(args.repeat):
+            start = time.time()
+            expected = sorted(hash_file(f) for f in files)
+            print("Run %d: %d files in a loop in %.3fs" % (run + 1, len(files), time.time() - start))
+
+            for n in threads:
+                d.setVar("BB_NUMBER_THREADS", str(n))
+                start = time.time()
+                result = oe.utils.multiprocess_launch(hash_file, files, d)
+                elapsed = time.time() - start
+                print("Run %d: %d files with multiprocess_launch and %d processes in %.3fs" % (run + 1, len(files), n, elapsed))
+                if sorted(result) != expected:
+                    print("ERROR: multiprocess_launch returned different results")
+                    return 1
+    finally:
+        if tempdir:
+            shutil.rmtree(tempdir)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Measure how long OEOuthashBasic takes to hash a tree of files
+#
+# By default a synthetic tree of files of a few sizes is created and hashed
+# with each of the given numbers of threads, after one untimed run to warm
+# the page cache. Pass --path to hash an existing directory, such as the
+# image or package directory of a recipe, instead.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+scripts_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, scripts_path + '/lib')
+import scriptpath
+scriptpath.add_bitbake_lib_path()
+scriptpath.add_oe_lib_path()
+
+import bb.data_smart
+import oe.sstatesig
+
+def make_tree(root, dirs, files_per_dir, size):
+    for i in range(dirs):
+        subdir = os.path.join(root, "usr", "lib%d" % i)
+        os.makedirs(subdir)
+        for j in range(files_per_dir):
+            # Mix empty, small and large files
+            data = hashlib.sha256(("%d/%d" % (i, j)).encode("utf-8")).digest()
+            with open(os.path.join(subdir, "file%d" % j), "wb") as f:
+                f.write(data * (size * (j % 3) // len(data)))
+
+def outhash(d, path, threads):
+    d.setVar("BB_NUMBER_THREADS", str(threads))
+    return oe.sstatesig.OEOuthashBasic(path, None, "do_package", d)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long OEOuthashBasic takes to hash a tree of files")
+    parser.add_argument("-p", "--path", help="Hash this directory instead of a synthetic tree")
+    parser.add_argument("--dirs", type=int, default=50, help="Directories in the synthetic tree (default: %(default)s)")
+    parser.add_argument("--files", type=int, default=40, help="Files per directory in the synthetic tree (default: %(default)s)")
+    parser.add_argument("--size", type=int, default=128 * 1024, help="Size of the large files in the synthetic tree (default: %(default)s)")
+    parser.add_argument("-t", "--threads", type=int, action="append",
+                        help="Number of threads to hash with, may be given more than once (default: 1 and the number of CPUs)")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Number of times to hash the tree (default: %(default)s)")
+    args = parser.parse_args()
+
+    threads = args.threads or sorted(set([1, os.cpu_count() or 1]))
+
+    d = bb.data_smart.DataSmart()
+    d.setVar("SSTATE_PKGSPEC", "sstate:outhash-benchmark::1.0:r0::3:")
+
+    tempdir = None
+    path = args.path
+    if path is None:
+        tempdir = tempfile.mkdtemp(prefix="outhash-benchmark-")
+        path = os.path.join(tempdir, "tree")
+        make_tree(path, args.dirs, args.files, args.size)
+
+    try:
+        nfiles = sum(len(files) for _, _, files in os.walk(path))
+        outhash(d, path, threads[0])
+
+        hashes = set()
+        for run in range(args.repeat):
+            for n in threads:
+                start = time.time()
+                hashes.add(outhash(d, path, n))
+                print("Run %d: hashed %d files with %d threads in %.3fs" % (run + 1, nfiles, n, time.time() - start))
+
+        if len(hashes) != 1:
+            print("ERROR: The hash depends on the number of threads")
+            return 1
+    finally:
+        if tempdir:
+            shutil.rmtree(tempdir)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# Measure how long BitBake takes to parse the recipes of a layer
+#
+# The recipes are parsed in-process, one after another, on top of the
+# layer's conf/bitbake.conf and base.bbclass. No build directory, server or
+# parse cache is involved, so the result reflects the cost of the parser and
+# the datastore alone. Run it before and after a change to BitBake to
+# compare them.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+
+scripts_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, scripts_path + '/lib')
+import scriptpath
+scriptpath.add_bitbake_lib_path()
+scriptpath.add_oe_lib_path()
+
+import bb.cache
+import bb.data_smart
+import bb.parse
+
+def base_config(layerdir, machine, topdir):
+    d = bb.data_smart.DataSmart()
+    d.setVar("BBPATH", layerdir)
+    d.setVar("TOPDIR", topdir)
+    d.setVar("MACHINE", machine)
+    d.setVar("BB_CURRENT_MC", "default")
+    d = bb.parse.handle(os.path.join(layerdir, "conf", "bitbake.conf"), d)
+    d = bb.parse.handle(os.path.join(layerdir, "classes", "base.bbclass"), d, True)
+    bb.parse.init_parser(d)
+    return d
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long BitBake takes to parse the recipes of a layer")
+    parser.add_argument("-l", "--layer", default=os.path.join(scripts_path, "..", "meta"),
+                        help="Layer whose recipes are parsed (default: %(default)s)")
+    parser.add_argument("-m", "--machine", default="qemux86-64", help="MACHINE to parse for (default: %(default)s)")
+    parser.add_argument("-n", "--count", type=int, default=0, help="Only parse the first COUNT recipes")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show why recipes failed to parse")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Number of times to parse the recipes (default: %(default)s)")
+    args = parser.parse_args()
+
+    logging.getLogger("BitBake").setLevel(logging.CRITICAL)
+
+    layerdir = os.path.abspath(args.layer)
+    recipes = sorted(glob.glob(os.path.join(layerdir, "recipes-*", "*", "*.bb")))
+    if args.count:
+        recipes = recipes[:args.count]
+
+    start = time.time()
+    d = base_config(layerdir, args.machine, os.path.join(os.getcwd(), "parse-benchmark"))
+    print("Parsed the base configuration in %.2fs" % (time.time() - start))
+
+    for run in range(args.repeat):
+        failed = 0
+        start = time.time()
+        for fn in recipes:
+            try:
+                bb.cache.parse_recipe(d.createCopy(), fn, [])
+            except Exception as e:
+                failed += 1
+                if args.verbose and run == 0:
+                    print("Failed to parse %s: %s" % (fn, e))
+        elapsed = time.time() - start
+        print("Run %d: parsed %d recipes (%d failed) in %.2fs, %.1fms per recipe"
+              % (run + 1, len(recipes), failed, elapsed, elapsed * 1000 / max(len(recipes), 1)))
+
+    if hasattr(bb.data_smart, "expansion_template"):
+        print("Expansion templates: %s" % (bb.data_smart.expansion_template.cache_info(),))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
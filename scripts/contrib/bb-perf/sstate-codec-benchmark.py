@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Compare the sstate archive codecs by how fast objects are restored
+#
+# A directory is packed into an archive with each codec available on the
+# host, in the same way sstate.bbclass does it, and the archive is then
+# extracted again. The size of the archive and the time taken to create and
+# restore it are reported for each codec. By default a synthetic tree is
+# packed; pass --path to pack an existing directory, such as the image
+# directory of a recipe, instead.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+scripts_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, scripts_path + '/lib')
+import scriptpath
+scriptpath.add_bitbake_lib_path()
+scriptpath.add_oe_lib_path()
+
+import oe.sstatecodec
+
+def make_tree(root, files, size):
+    os.makedirs(os.path.join(root, "usr", "lib"))
+    seed = b"sstate"
+    for i in range(files):
+        data = b""
+        while len(data) < size:
+            seed = hashlib.sha256(seed).digest()
+            # Repeat each digest so the data compresses like real objects
+            data += seed * 8 + bytes(256)
+        with open(os.path.join(root, "usr", "lib", "file%d" % i), "wb") as f:
+            f.write(data[:size])
+
+def tree_size(root):
+    size = 0
+    for dirpath, dirs, files in os.walk(root):
+        for f in files:
+            size += os.lstat(os.path.join(dirpath, f)).st_size
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sstate archive codecs by how fast objects are restored")
+    parser.add_argument("-p", "--path", help="Pack this directory instead of a synthetic tree")
+    parser.add_argument("--files", type=int, default=200, help="Files in the synthetic tree (default: %(default)s)")
+    parser.add_argument("--size", type=int, default=256 * 1024, help="Size of the files in the synthetic tree (default: %(default)s)")
+    parser.add_argument("-c", "--codec", action="append", choices=sorted(oe.sstatecodec.CODECS),
+                        help="Codec to measure, may be given more than once (default: all those available)")
+    parser.add_argument("-t", "--threads", type=int, default=os.cpu_count() or 1,
+                        help="Compression and decompression threads, as SSTATE_COMPRESSION_THREADS (default: %(default)s)")
+    args = parser.parse_args()
+
+    path = os.environ.get("PATH")
+    codecs = args.codec or [name for (name, codec) in sorted(oe.sstatecodec.CODECS.items()) if codec.program(path, 1)]
+
+    tempdir = tempfile.mkdtemp(prefix="sstate-codec-benchmark-")
+    try:
+        root = args.path
+        if root is None:
+            root = os.path.join(tempdir, "tree")
+            make_tree(root, args.files, args.size)
+        total = tree_size(root) / (1024 * 1024)
+        print("Packing %.1f MiB with %d threads" % (total, args.threads))
+
+        for codec in codecs:
+            (used, program) = oe.sstatecodec.compress_program(codec, path, args.threads)
+            if used != codec:
+                print("%s: not available, skipped" % codec)
+                continue
+
+            archive = os.path.join(tempdir, "sstate-%s.tgz" % codec)
+            start = time.time()
+            subprocess.check_call(["tar", "-I", program, "-cS", "-f", archive, "."], cwd=root)
+            pack_time = time.time() - start
+
+            dest = os.path.join(tempdir, "restore-%s" % codec)
+            os.makedirs(dest)
+            start = time.time()
+            program = oe.sstatecodec.decompress_program(archive, path, args.threads)
+            subprocess.check_call(["tar", "-I", program, "-xf", archive], cwd=dest)
+            restore_time = time.time() - start
+
+            print("%s: archive %.1f MiB, created at %.1f MiB/s, restored at %.1f MiB/s"
+                  % (codec, os.path.getsize(archive) / (1024 * 1024), total / pack_time, total / restore_time))
+            os.unlink(archive)
+            shutil.rmtree(dest)
+    finally:
+        shutil.rmtree(tempdir)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,11 @@ from statistics import mean
 
 log = logging.getLogger()
 
+# Name of the event log in the buildstats directory of a build. It is
+# written by buildstats.bbclass, see write_record() in meta/lib/buildstats.py,
+# and holds one JSON object per line, in the order the events happened.
+EVENT_LOG = 'buildstats.jsonl'
+
 
 taskdiff_fields = ('pkg', 'pkg_op', 'task', 'task_op', 'value1', 'value2',
                    'absdiff', 'reldiff')
@@ -115,6 +120,42 @@ class BSTask(dict):
         return bs_task
 
 
+    @classmethod
+    def from_record(cls, record):
+        """Create new BSTask from a task record of the event log"""
+        bs_task = cls()
+        if record['start_time'] is None:
+            raise BSError("Task {}:{} has no start time".format(record['pf'], record['task']))
+        bs_task['start_time'] = record['start_time']
+        bs_task['elapsed_time'] = record['end_time'] - record['start_time']
+        bs_task['status'] = record['status']
+        for key in ('iostat', 'rusage', 'child_rusage'):
+            if key in record:
+                bs_task[key] = record[key]
+        return bs_task
+
+
+def read_event_log(path, fobj=None):
+    """
+    Iterate over the records of a buildstats event log. The log is read a
+    line at a time, so large logs don't need to fit in memory. A record cut
+    short by an interrupted build is skipped. If fobj is given, the log is
+    read from it, in text or binary mode, instead of opening path.
+    """
+    if fobj is None:
+        with open(path) as fobj:
+            yield from read_event_log(path, fobj)
+        return
+
+    for line in fobj:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.endswith('\n'):
+            log.warning("Ignoring incomplete record at the end of %s", path)
+            break
+        yield json.loads(line)
+
+
 class BSTaskAggregate(object):
     """Class representing multiple runs of the same task"""
     properties = ('cputime', 'walltime', 'read_bytes', 'write_bytes',
@@ -226,12 +267,36 @@ class BuildStats(dict):
         epoch = match.group('epoch')
         return name, epoch, version, revision
 
+    @classmethod
+    def from_event_log(cls, path):
+        """Load buildstats from the event log of a build"""
+        log.debug("Reading buildstats event log %s", path)
+
+        buildstats = cls()
+        recipes = {}
+        for record in read_event_log(path):
+            if record['type'] != 'task' or record['start_time'] is None:
+                continue
+            pf = record['pf']
+            if pf not in recipes:
+                name, epoch, version, revision = cls.split_nevr(pf)
+                if name in buildstats:
+                    raise BSError("Cannot handle multiple versions of the same "
+                                  "package ({})".format(name))
+                recipes[pf] = buildstats[name] = BSRecipe(name, epoch, version, revision)
+            recipes[pf].tasks[record['task']] = BSTask.from_record(record)
+
+        return buildstats
+
     @classmethod
     def from_dir(cls, path):
         """Load buildstats from a buildstats directory"""
         if not os.path.isfile(os.path.join(path, 'build_stats')):
             raise BSError("{} does not look like a buildstats directory".format(path))
 
+        if os.path.isfile(os.path.join(path, EVENT_LOG)):
+            return cls.from_event_log(os.path.join(path, EVENT_LOG))
+
         log.debug("Reading buildstats directory %s", path)
 
         buildstats = cls()
@@ -28,6 +28,12 @@ from .process_tree import ProcessTree
 if sys.version_info >= (3, 0):
     long = int
 
+# Event log written by buildstats.bbclass, read with scripts/lib/buildstats.py.
+# When a buildstats directory has one, it holds everything that is also in the
+# per recipe directories.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))), 'lib'))
+from buildstats import EVENT_LOG as BUILDSTATS_EVENT_LOG, read_event_log
+
 # Parsing produces as its end result a 'Trace'
 
 class Trace:
@@ -705,6 +711,12 @@ def _parse_bitbake_buildstats(writer, state, filename, file):
     if start and end:
         state.add_process(pn + ":" + task, start, end)
 
+def _parse_bitbake_event_log(writer, state, filename, file):
+    for record in read_event_log(filename, file):
+        if record['type'] == 'task' and record['start_time'] is not None:
+            state.add_process(record['pf'] + ":" + record['task'],
+                              int(record['start_time']), int(record['end_time']))
+
 def get_num_cpus(headers):
     """Get the number of CPUs from the system.cpu header property. As the
     CPU utilization graphs are relative, the number of CPUs currently makes
@@ -741,6 +753,8 @@ def _do_parse(writer, state, filename, file):
         state.cmdline = _parse_cmdline_log(writer, file)
     elif name == "monitor_disk.log":
         state.monitor_disk = _parse_monitor_disk_log(file)
+    elif name == BUILDSTATS_EVENT_LOG:
+        _parse_bitbake_event_log(writer, state, filename, file)
     elif not filename.endswith('.log'):
         _parse_bitbake_buildstats(writer, state, filename, file)
     t2 = clock()
@@ -765,6 +779,9 @@ def parse_paths(writer, state, paths):
         #state.filename = path
         if os.path.isdir(path):
             files = sorted([os.path.join(path, f) for f in os.listdir(path)])
+            if os.path.exists(os.path.join(path, BUILDSTATS_EVENT_LOG)):
+                # No need to read the task files of each recipe
+                files = [f for f in files if not os.path.isdir(f)]
             state = parse_paths(writer, state, files)
         elif extension in [".tar", ".tgz", ".gz"]:
             if extension == ".gz":